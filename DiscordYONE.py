@@ -1,6 +1,6 @@
-import os, re, time, random, discord, tempfile, logging, datetime, asyncio, base64
+import os, re, time, random, discord, tempfile, logging, datetime, asyncio, base64, subprocess, weakref, collections, functools
 from discord import app_commands
-from openai import OpenAI, AssistantEventHandler
+from openai import OpenAI, AsyncOpenAI, AsyncAssistantEventHandler, NotFoundError
 import json, feedparser, aiohttp
 from bs4 import BeautifulSoup
 
@@ -9,10 +9,26 @@ from urllib.parse import urlparse, parse_qs, urlunparse
 from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
 
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict, field, fields
 from typing import Any
 
 from poker import PokerMatch, PokerView
+from extract_service import ExtractService
+from track_cache import TrackCache, normalize_codec, stream_codec, stream_expiry
+from panel_renderer import PanelScheduler
+from track_queue import TrackQueue
+from audio_store import AudioStore, AudioTooLarge, AudioStoreFull
+from frame_buffer import BufferBudget, FrameBuffer, FRAME_SECONDS
+from track_mixer import TrackMixer
+from loudness import measure_loudness, normalize_gain_db, db_to_linear, linear_to_db
+from state_store import StateStore
+from voice_manager import VoiceManager
+from title_index import TitleIndex
+from reply_stream import ReplyStream
+from thread_store import ThreadStore
+from reply_index import ReplyIndex
+from context_packer import ContextPacker, Line, make_line
+from translation import Translator, combine_translations, content_key
 
 
 # ───────────────── TOKEN / KEY ─────────────────
@@ -105,6 +121,40 @@ LAST_EEW_ID = _load_last_eew()
 WEATHER_CHANNEL_ID = _load_weather_channel()
 
 openai_client = OpenAI(api_key=OPENAI_API_KEY)
+# GPT の回答はイベントループを止めないよう非同期クライアントで扱う
+GPT_REQUEST_TIMEOUT = 30.0    # 1 回の API 呼び出しの上限 (秒)
+GPT_RUN_TIMEOUT = 180.0       # 1 回答 (ストリーム全体) の上限 (秒)
+GPT_MAX_CONCURRENCY = 4       # Bot 全体で同時に走らせる回答数
+openai_async = AsyncOpenAI(api_key=OPENAI_API_KEY, timeout=GPT_REQUEST_TIMEOUT, max_retries=2)
+
+# チャンネル → Assistants スレッドの対応 (複数プロセスで共有できる SQLite)
+THREAD_DB_FILE = os.path.join(ROOT_DIR, "threads.sqlite3")
+LEGACY_THREAD_DB = "threads.db"      # 旧 shelve (起動時のカレントディレクトリに作られていた)
+GPT_THREAD_IDLE_TTL = 30 * 86400     # これだけ使われなかったスレッドは削除する
+thread_store = ThreadStore(THREAD_DB_FILE, idle_ttl=GPT_THREAD_IDLE_TTL)
+
+
+def _import_legacy_threads() -> None:
+    """旧 shelve ストアの対応を一度だけ引き継ぐ (既に登録済みのチャンネルはそのまま)
+
+    取り込んだら旧ファイルを *.migrated に改名し、expire() で消した対応が
+    次の起動で戻ってこないようにする。
+    """
+    import dbm, glob, shelve
+    if not dbm.whichdb(LEGACY_THREAD_DB):
+        return
+    try:
+        with shelve.open(LEGACY_THREAD_DB, "r") as db:
+            n = thread_store.import_legacy(dict(db))
+        # dbm の実装によって threads.db / threads.db.dat などファイル名が変わる
+        for path in glob.glob(glob.escape(LEGACY_THREAD_DB) + "*"):
+            if not path.endswith(".migrated"):
+                os.replace(path, path + ".migrated")
+    except Exception as e:
+        logger.warning("legacy thread store import failed: %s", e)
+        return
+    logger.info("imported %d threads from %s", n, LEGACY_THREAD_DB)
+
 
 # ───────────────── Voice Transcription / TTS ─────────────────
 
@@ -114,6 +164,8 @@ logging.basicConfig(level=logging.INFO, handlers=[handler])
 logging.getLogger('discord').setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 
+_import_legacy_threads()
+
 # チャンネル型の許可タプル (Text / Thread / Stage)
 MESSAGE_CHANNEL_TYPES: tuple[type, ...] = (
     discord.TextChannel,
@@ -153,21 +205,47 @@ def parse_cmd(content: str):
     return parts[0].lower(), parts[1] if len(parts) > 1 else ""
 
 
-async def _gather_reply_chain(msg: discord.Message, limit: int | None = None) -> list[discord.Message]:
-    """Return the full reply chain for ``msg``.
+# 返信チェーンの索引 (Bot との会話への返信かを HTTP なしで判定する)
+REPLY_INDEX_SIZE = 50000     # 覚えておくメッセージ数
+REPLY_CHAIN_LIMIT = 10       # 索引に無いときに遡って取得する最大件数
+reply_index = ReplyIndex(max_entries=REPLY_INDEX_SIZE)
+
+
+def index_message(msg: discord.Message) -> bool | None:
+    """メッセージを返信索引に登録し、Bot との会話チェーン上にあるかを返す"""
+    ref = getattr(msg, "reference", None)
+    parent = ref.message_id if ref and ref.message_id else None
+    return reply_index.add(msg.id, parent, bool(client.user) and msg.author.id == client.user.id)
+
 
-    If ``limit`` is given, stop after that many messages. When ``limit`` is
-    ``None`` (default) the chain is collected until no reference is present.
+async def _fetch_parent(msg: discord.Message) -> discord.Message:
+    """msg の返信先を、索引のキャッシュ → gateway が付けた本文 → REST の順で取得"""
+    ref = msg.reference
+    parent = reply_index.message(ref.message_id)
+    if parent is None and isinstance(ref.resolved, discord.Message):
+        parent = ref.resolved
+    if parent is None:
+        parent = await msg.channel.fetch_message(ref.message_id)
+    reply_index.remember(parent.id, parent)
+    return parent
+
+
+async def _gather_reply_chain(msg: discord.Message, limit: int | None = REPLY_CHAIN_LIMIT) -> list[discord.Message]:
+    """Return the reply chain for ``msg`` (oldest first).
+
+    At most ``limit`` messages are collected (``None`` follows the chain to
+    its root). Parents already seen are served from ``reply_index`` or from
+    the gateway payload, so only unknown hops cost a ``fetch_message`` call.
     ``SlashMessage`` instances are ignored because interactions cannot reply to
     other messages.
     """
     chain: list[discord.Message] = []
     current = msg
-    while getattr(current, "reference", None):
+    while getattr(current, "reference", None) and current.reference.message_id:
         if limit is not None and len(chain) >= limit:
             break
         try:
-            current = await current.channel.fetch_message(current.reference.message_id)
+            current = await _fetch_parent(current)
         except Exception:
             break
         chain.append(current)
@@ -175,6 +253,67 @@ async def _gather_reply_chain(msg: discord.Message, limit: int | None = None) ->
     return chain
 
 
+# 返信チェーンを GPT への文脈としてまとめる
+GPT_CONTEXT_BUDGET = 1500    # 文脈に使う token 数の上限 (estimate_tokens による見積もり)
+context_packer = ContextPacker(budget=GPT_CONTEXT_BUDGET)
+
+
+def chat_line(msg: discord.Message, content: str | None = None) -> Line:
+    return make_line(
+        msg.id,
+        msg.author.display_name,
+        msg.clean_content if content is None else content,
+        [a.filename for a in msg.attachments],
+    )
+
+
+async def reply_context(msg: discord.Message) -> str:
+    """msg が返信しているチェーンを文脈テキストにする (msg 自身は含めない)
+
+    親のチェーンが詰め済みならそれを使い、無いときだけチェーンを取得する。
+    msg の分もキャッシュに足すので、続きの返信ではもう取得しない。
+    """
+    ref = msg.reference
+    if not ref or not ref.message_id:
+        context_packer.build([chat_line(msg)])
+        return ""
+    lines = context_packer.lines(ref.message_id)
+    if lines is None:
+        lines = context_packer.build([chat_line(m) for m in await _gather_reply_chain(msg)])
+    context_packer.extend(ref.message_id, chat_line(msg))
+    return context_packer.render(lines)
+
+
+async def replies_to_bot(msg: discord.Message) -> bool:
+    """msg が Bot の発言を含む返信チェーンへの返信か
+
+    ふつうは索引を引くだけで済み、知らない返信先のときだけチェーンを
+    REPLY_CHAIN_LIMIT 件まで遡って索引に登録する (それより先は無関係とみなす)。
+    """
+    ref = msg.reference
+    if not ref or not ref.message_id:
+        return False
+    known = reply_index.in_bot_chain(ref.message_id)
+    if known is not None:
+        return known
+    chain: list[discord.Message] = []
+    current = msg
+    while len(chain) < REPLY_CHAIN_LIMIT:
+        r = current.reference
+        if not r or not r.message_id or reply_index.in_bot_chain(r.message_id) is not None:
+            break  # 先頭まで来たか、索引が知っているところに繋がった
+        try:
+            current = await _fetch_parent(current)
+        except Exception:
+            break
+        chain.append(current)
+    for m in reversed(chain):
+        if index_message(m) is None:
+            # 遡りきれなかった先頭はチェーンの始まりとして扱い、結果を確定させる
+            reply_index.add(m.id, None, m.author.id == client.user.id)
+    return bool(index_message(msg))  # 親が分かったので msg 自身のフラグも確定させる
+
+
 def _strip_bot_mention(text: str) -> str:
     if client.user is None:
         return text.strip()
@@ -235,10 +374,113 @@ class SlashMessage:
 from yt_dlp import YoutubeDL
 YTDL_OPTS = {
     "quiet": True,
-    "format": "bestaudio[ext=m4a]/bestaudio/best",
+    # Opus (webm) を優先すると再エンコードせずにそのまま送れる
+    "format": "bestaudio[acodec=opus]/bestaudio[ext=m4a]/bestaudio/best",
     "default_search": "ytsearch",
 }
 
+# yt-dlp の抽出はイベントループを止めないよう専用プールで実行する
+EXTRACT_WORKERS = 4      # 同時に走らせる抽出数
+EXTRACT_TIMEOUT = 30.0   # 1 リクエストあたりの上限秒数
+extractor = ExtractService(max_workers=EXTRACT_WORKERS, timeout=EXTRACT_TIMEOUT)
+
+# 解決済みトラックのメタデータキャッシュ (ストリーム URL は短命なので別 TTL)
+TRACK_CACHE_FILE = os.path.join(ROOT_DIR, "track_cache.db")
+STREAM_TTL = 1800
+track_cache = TrackCache(TRACK_CACHE_FILE, max_entries=5000, stream_ttl=STREAM_TTL)
+
+# 添付音源は内容ハッシュで 1 つだけ保存し、全サーバーのキューで参照を共有する
+AUDIO_STORE_DIR = os.path.join(tempfile.gettempdir(), "yone_audio")
+AUDIO_MAX_FILE_SIZE = 100 * 2**20   # 1 ファイルの上限
+AUDIO_DISK_BUDGET = 2 * 2**30       # 保存全体の上限
+AUDIO_CHUNK_SIZE = 64 * 1024
+TEMP_PREFIX = "yone_"               # 画像などの一時ファイル名 (reaper が掃除する目印)
+# 再起動をまたいでキュー・再生位置を引き継ぐ (ギルドごとに 1 ファイル)
+MUSIC_STATE_DIR = os.path.join(ROOT_DIR, "music_state")
+MUSIC_STATE_DELAY = 2.0            # 変更をまとめて書き出すまでの秒数
+MUSIC_STATE_POSITION_INTERVAL = 10.0  # 再生中に位置を保存し直す間隔 (秒)
+state_store = StateStore(MUSIC_STATE_DIR, delay=MUSIC_STATE_DELAY)
+# 1 ギルドの状態は 3 つの記録に分けて書く。再生位置は頻繁に、キューは変わったときだけ
+MUSIC_QUEUE_SUFFIX = ".queue"   # {"tracks": [...]} (キューの version が変わったときだけ書き直す)
+MUSIC_POS_SUFFIX = ".pos"       # {"position": 秒, "title": 再生中の曲名}
+
+
+def _load_music_states() -> dict[str, dict]:
+    """保存済みの状態を読み、キューと再生位置の記録を本体にまとめる"""
+    raw = state_store.load_all()
+    states: dict[str, dict] = {}
+    for key, snap in raw.items():
+        if not key.isdecimal():
+            continue
+        snap = dict(snap)
+        if (q := raw.get(key + MUSIC_QUEUE_SUFFIX)) is not None:
+            snap["queue"] = q.get("tracks", [])
+        pos = raw.get(key + MUSIC_POS_SUFFIX) or {}
+        current = snap.get("current") or {}
+        if pos.get("title") == current.get("title"):
+            snap["position"] = pos.get("position", 0)
+        states[key] = snap
+    for key in raw:
+        if key.split(".")[0] not in states:
+            state_store.discard(key)  # 本体の無い記録
+    return states
+
+
+def discard_music_state(guild_id: int | str) -> None:
+    for suffix in ("", MUSIC_QUEUE_SUFFIX, MUSIC_POS_SUFFIX):
+        state_store.discard(f"{guild_id}{suffix}")
+
+
+saved_states = _load_music_states()   # on_ready で復元するまで保持
+
+audio_store = AudioStore(AUDIO_STORE_DIR, max_file_size=AUDIO_MAX_FILE_SIZE,
+                         budget=AUDIO_DISK_BUDGET,
+                         # 復元するキューが参照している添付は消さずに残す
+                         keep=[t["url"] for snap in saved_states.values()
+                               for t in [snap.get("current") or {}, *snap.get("queue", [])]
+                               if t.get("stored")])
+
+# Opus の音源は FFmpeg でコンテナを外すだけにして送り、それ以外も FFmpeg 側で
+# Opus にエンコードする (Python プロセスで PCM→Opus を行わない)
+OPUS_PASSTHROUGH = True
+OPUS_BITRATE = 128       # FFmpeg でエンコードするときのビットレート (kbps)
+PLAYBACK_VOLUME = 0.9    # loudness 未測定の曲に掛ける音量
+
+# 曲ごとの integrated loudness を 1 回だけ裏で測ってキャッシュし、再生時は静的なゲインで揃える
+LOUDNESS_TARGET = -16.0      # 目標 (LUFS)
+LOUDNESS_MAX_BOOST = 6.0     # 小さい曲を持ち上げる上限 (dB)
+LOUDNESS_TOLERANCE = 1.5     # 補正がこの範囲 (dB) なら Opus をそのままコピーする
+LOUDNESS_TIMEOUT = 300.0
+LOUDNESS_MAX_SECONDS = 600   # 長い曲も先頭からこの秒数だけ測る (丸ごと取り直さない)
+LOUDNESS_QUEUE_MAX = 8       # 解析待ちの上限 (溢れた曲は次の再生時に改めて頼む)
+analyzer = ExtractService(max_workers=1, timeout=LOUDNESS_TIMEOUT)  # 解析は 1 本ずつ
+
+# 再生中の曲をフレーム単位でメモリに溜め、窓の内側へのシークは FFmpeg を再起動しない
+# バッファの大きさは秒数 × ビットレートで決め、全ギルドの合計を SEEK_BUFFER_TOTAL に抑える
+SEEK_BUFFER_SECONDS = 240.0      # 1 曲あたりに持つ秒数 (先読み分を含む)
+SEEK_BUFFER_AHEAD = 60.0         # 先読みする秒数 (これより先への早送りはネットから取り直す)
+SEEK_BUFFER_MIN_SECONDS = 10.0   # 合計の上限に達しても最低限確保する秒数
+SEEK_BUFFER_TOTAL = 512 * 2**20  # 全ギルド合計の上限 (バイト)
+OPUS_BUFFER_KBPS = 192           # Opus フレームの見込みビットレート (コピー時の元音源も含めた上限)
+PCM_BYTES_PER_SECOND = 48000 * 2 * 2   # 48kHz 16bit ステレオ
+seek_budget = BufferBudget(SEEK_BUFFER_TOTAL)
+
+# 曲の終わりが見えたら次の曲の FFmpeg を先に起動し、フレーム単位で切れ目なくつなぐ
+#
+# CROSSFADE_SECONDS を 0 より大きくすると曲間を重ねるが、重ねるには PCM が要るので
+# OPUS_PASSTHROUGH が効かなくなる (make_audio_source 参照)。全曲が PCM 経路になり、
+# FFmpeg のデコードに加えて discord.py が Python プロセス内で Opus エンコードと
+# ミックスを行うため、1 ギルドあたりの CPU 使用量が大きく増える。ギルド数が多い
+# 環境では scripts/bench_voice_capacity.py の --codec pcm で負荷を確かめてから使うこと。
+CROSSFADE_SECONDS = 0.0
+
+PREFETCH_COUNT = 2       # 再生中に先読みしておく次曲数
+PREFETCH_PROBE = True    # 先読みした URL が生きているか 1 バイトだけ取得して確認
+
+# /play のオートコンプリート (再生した曲名からギルドごとに候補を出す)
+TITLE_INDEX_MAX = 2000   # 1 ギルドあたりに覚えておく曲数
+title_index = TitleIndex(max_entries=TITLE_INDEX_MAX)
+
 WMO_CODES = {
     0: "快晴",
     1: "晴れ",
@@ -281,12 +523,13 @@ HELP_PAGES: list[tuple[str, str]] = [
                 "y!play … 添付ファイルを先に、テキストはカンマ区切りで順に追加",
                 "/play … query/file 引数を入力した順に追加 (query 内のカンマは分割されません)",
                 "/queue, y!queue : キューの表示や操作（Skip/Shuffle/Loop/Pause/Resume/Leaveなど）",
-                "/remove <番号>, y!remove <番号> : 指定した曲をキューから削除",
+                "/remove <番号>, y!remove <番号> : 指定した曲をキューから削除 (2-5 のような範囲指定も可)",
                 "/keep <番号>, y!keep <番号> : 指定番号以外の曲をまとめて削除",
                 "/stop, y!stop : VCから退出",
                 "/seek <時間>, y!seek <時間> : 再生位置を変更",
                 "/rewind <時間>, y!rewind <時間> : 再生位置を指定秒数だけ巻き戻し",
                 "/forward <時間>, y!forward <時間> : 再生位置を指定秒数だけ早送り",
+                "/volume <0-200>, y!volume <0-200> : 再生音量を変更 (曲ごとの音量差は自動で補正)",
                 "　※例: y!rewind 1分, y!forward 30, /rewind 1:10",
                 "",
                 "💬 翻訳機能",
@@ -413,6 +656,45 @@ class Track:
     title: str
     url: str
     duration: int | None = None
+    webpage_url: str | None = None   # 再解決用の元ページ URL (ローカルファイルは None)
+    video_id: str | None = None
+    expires: float | None = None     # url (ストリーム) の有効期限
+    stored: bool = False             # audio_store の参照を持っているか
+    codec: str | None = None         # 音声コーデック (分かれば "opus" など)
+    loudness: float | None = None    # integrated loudness (LUFS)
+
+
+def track_to_dict(track: Track) -> dict:
+    return asdict(track)
+
+
+def track_from_dict(data: dict) -> Track:
+    """track_to_dict で保存した値から Track を作り直す (未知のキーは無視)"""
+    names = {f.name for f in fields(Track)}
+    return Track(**{k: v for k, v in data.items() if k in names})
+
+
+def _video_key(info: dict) -> str | None:
+    """yt-dlp の info から動画を一意に表すキーを作る"""
+    vid = info.get("id")
+    if not vid:
+        return None
+    extractor_key = info.get("extractor_key") or ""
+    return vid if extractor_key in ("", "Youtube") else f"{extractor_key.lower()}:{vid}"
+
+
+def _track_from_info(info: dict) -> Track:
+    url = info.get("url", "")
+    return Track(
+        info.get("title", "?"),
+        url,
+        info.get("duration"),
+        info.get("webpage_url") or info.get("original_url"),
+        _video_key(info),
+        stream_expiry(url, STREAM_TTL) if url else None,
+        codec=normalize_codec(info.get("acodec")) or stream_codec(url),
+    )
+
 
 def yt_extract(url_or_term: str) -> list[Track]:
     """URL か検索語から Track 一覧を返す (単曲の場合は長さ1)"""
@@ -423,34 +705,143 @@ def yt_extract(url_or_term: str) -> list[Track]:
                 results = []
                 for ent in info.get("entries", []):
                     if ent:
-                        results.append(Track(ent.get("title", "?"), ent.get("url", ""), ent.get("duration")))
+                        results.append(_track_from_info(ent))
                 return results
             info = info["entries"][0]
-        return [Track(info.get("title", "?"), info.get("url", ""), info.get("duration"))]
+        return [_track_from_info(info)]
+
+
+def cached_extract(url_or_term: str) -> list[Track]:
+    """track_cache を引いてから yt_extract する (単曲の結果だけキャッシュ)
+
+    キャッシュヒット時は検索を丸ごと省略し、ストリーム URL が失効していれば
+    url を空にして再生直前の ensure_stream() に解決を任せる。
+    """
+    hit = track_cache.lookup(url_or_term)
+    if hit:
+        return [Track(hit.title, hit.stream_url or "", hit.duration,
+                      hit.webpage_url, hit.video_id, hit.stream_expires,
+                      codec=stream_codec(hit.stream_url or ""), loudness=hit.loudness)]
+    tracks = yt_extract(url_or_term)
+    if len(tracks) == 1 and tracks[0].video_id and tracks[0].webpage_url:
+        tr = tracks[0]
+        track_cache.store(url_or_term, video_id=tr.video_id, title=tr.title,
+                          webpage_url=tr.webpage_url, duration=tr.duration,
+                          stream_url=tr.url or None)
+    return tracks
+
+
+def _stream_valid(url: str | None, expires: float | None, min_valid: float) -> bool:
+    return bool(url) and expires is not None and expires - min_valid > time.time()
+
+
+def _resolve_stream(track: Track, min_valid: float = 0,
+                    force: bool = False) -> tuple[str, float | None, str | None]:
+    """ストリーム URL を (キャッシュ → yt-dlp の順で) 取り直す
+
+    戻り値は (url, 有効期限, コーデック)。
+    """
+    if track.video_id and not force:
+        hit = track_cache.get(track.video_id)
+        if hit and _stream_valid(hit.stream_url, hit.stream_expires, min_valid):
+            return hit.stream_url, hit.stream_expires, stream_codec(hit.stream_url)
+    fresh = yt_extract(track.webpage_url)[0]
+    if not fresh.url:
+        raise RuntimeError("stream url not found")
+    if track.duration is None:
+        track.duration = fresh.duration  # フラット取得のプレースホルダは長さ不明のことがある
+    if track.video_id:
+        track_cache.store(None, video_id=track.video_id, title=fresh.title,
+                          webpage_url=track.webpage_url, duration=fresh.duration,
+                          stream_url=fresh.url)
+    return fresh.url, fresh.expires, fresh.codec
+
+
+# 同じ Track を JIT 解決と先読みが同時に解決しないよう、実行中ジョブを共有する
+_stream_jobs: dict[int, asyncio.Task] = {}
+
+
+async def ensure_stream(track: Track, owner: Any = None, *,
+                        min_valid: float = 60, force: bool = False) -> str:
+    """期限切れ/未解決のストリーム URL を解決して返す
+
+    ``min_valid`` 秒以上有効な URL が既にあればそのまま返す。``force`` の
+    場合はキャッシュも無視して yt-dlp から取り直す。
+    """
+    if not track.webpage_url:
+        return track.url  # ローカルファイルなど再解決できないもの
+    if not force and _stream_valid(track.url, track.expires, min_valid):
+        return track.url
+
+    key = id(track)
+    job = _stream_jobs.get(key)
+    if job is None or force:
+        async def refresh() -> str:
+            track.url, track.expires, track.codec = await extractor.run(
+                _resolve_stream, track, min_valid, force, owner=owner)
+            return track.url
+
+        job = asyncio.create_task(refresh())
+        _stream_jobs[key] = job
+
+        def _done(t: asyncio.Task):
+            if _stream_jobs.get(key) is t:
+                del _stream_jobs[key]
+            if not t.cancelled():
+                t.exception()  # 待ち手がいなくても警告を出さない
+
+        job.add_done_callback(_done)
+    return await asyncio.shield(job)
+
+
+async def probe_stream(url: str) -> bool:
+    """ストリーム URL に 1 バイトだけ要求して再生可能か確認"""
+    try:
+        async with aiohttp.ClientSession() as sess:
+            async with sess.get(url, headers={"Range": "bytes=0-0"}, timeout=5) as r:
+                return r.status in (200, 206)
+    except Exception:
+        return False
+
+
+async def _iter_attachment(att: discord.Attachment):
+    """添付ファイルをチャンク単位で読み出す (全体をメモリに載せない)"""
+    async with aiohttp.ClientSession() as sess:
+        async with sess.get(att.url) as r:
+            r.raise_for_status()
+            async for chunk in r.content.iter_chunked(AUDIO_CHUNK_SIZE):
+                yield chunk
 
 
 async def attachment_to_track(att: discord.Attachment) -> Track:
-    """Discord 添付ファイルを一時保存して Track に変換"""
-    fd, path = tempfile.mkstemp(prefix="yone_", suffix=os.path.splitext(att.filename)[1])
-    os.close(fd)
-    await att.save(path)
-    return Track(att.filename, path)
+    """Discord 添付ファイルを音源ストアに保存して Track に変換
+
+    同じ添付・同じ内容のファイルは再ダウンロードせず既存ファイルを共有する。
+    """
+    path = await audio_store.store(
+        f"att:{att.id}:{att.size}",
+        _iter_attachment(att),
+        suffix=os.path.splitext(att.filename)[1],
+        size=att.size,
+    )
+    return Track(att.filename, path, stored=True)
 
 
-async def attachments_to_tracks(attachments: list[discord.Attachment]) -> list[Track]:
-    """複数添付ファイルを並列で Track に変換"""
+async def attachments_to_tracks(attachments: list[discord.Attachment]) -> list[Track | BaseException]:
+    """複数添付ファイルを並列で Track に変換 (失敗した分は例外を入れて返す)"""
     tasks = [attachment_to_track(a) for a in attachments]
-    return await asyncio.gather(*tasks)
+    return await asyncio.gather(*tasks, return_exceptions=True)
 
 
-def yt_extract_multiple(urls: list[str]) -> list[Track]:
-    """複数 URL を順に yt_extract して Track をまとめて返す"""
+async def yt_extract_multiple(urls: list[str], owner: Any = None) -> list[Track]:
+    """複数 URL を並列に yt_extract して入力順に Track をまとめて返す"""
     tracks: list[Track] = []
-    for url in urls:
-        try:
-            tracks.extend(yt_extract(url))
-        except Exception as e:
-            logger.error("取得失敗 (%s): %s", url, e)
+    results = await extractor.gather(cached_extract, urls, owner=owner)
+    for url, res in zip(urls, results):
+        if isinstance(res, BaseException):
+            logger.error("取得失敗 (%s): %s", url, res)
+            continue
+        tracks.extend(res)
     return tracks
 
 
@@ -459,6 +850,175 @@ def is_http_source(path_or_url: str) -> bool:
     return path_or_url.startswith(("http://", "https://"))
 
 
+_libopus_ok: bool | None = None
+
+
+def ffmpeg_has_libopus() -> bool:
+    """ffmpeg が libopus エンコーダを持っているか (初回だけ確認)"""
+    global _libopus_ok
+    if _libopus_ok is None:
+        try:
+            out = subprocess.run(
+                ["ffmpeg", "-hide_banner", "-encoders"],
+                capture_output=True, text=True, timeout=10,
+            ).stdout
+            _libopus_ok = "libopus" in out
+        except Exception as e:
+            logger.warning("ffmpeg encoder check failed: %s", e)
+            _libopus_ok = False
+    return _libopus_ok
+
+
+async def source_codec(track: Track, url: str) -> str | None:
+    """再生する音源のコーデック (ローカルファイルは ffprobe で調べて覚えておく)"""
+    if track.codec or is_http_source(url):
+        return track.codec
+    try:
+        track.codec, _ = await discord.FFmpegOpusAudio.probe(url)
+    except Exception as e:
+        logger.debug("probe failed (%s): %s", url, e)
+    return track.codec
+
+
+class BufferedAudio(discord.AudioSource):
+    """FFmpeg の出力を FrameBuffer 越しに渡し、バッファ内のシークを即時に行う"""
+
+    def __init__(self, inner: discord.AudioSource, start: float = 0.0):
+        self.inner = inner
+        rate = OPUS_BUFFER_KBPS * 1000 // 8 if inner.is_opus() else PCM_BYTES_PER_SECOND
+        self.capacity = seek_budget.acquire(int(rate * SEEK_BUFFER_SECONDS),
+                                            int(rate * SEEK_BUFFER_MIN_SECONDS))
+        try:
+            self.buffer = FrameBuffer(inner.read, start=start,
+                                      capacity=self.capacity, max_ahead=SEEK_BUFFER_AHEAD)
+        except BaseException:
+            seek_budget.release(self.capacity)
+            raise
+
+    def read(self) -> bytes:
+        return self.buffer.read()
+
+    def is_opus(self) -> bool:
+        return self.inner.is_opus()
+
+    def remaining(self) -> int | None:
+        return self.buffer.remaining()
+
+    def cleanup(self):
+        if self.capacity:
+            seek_budget.release(self.capacity)
+            self.capacity = 0
+        self.buffer.close()
+        self.inner.cleanup()  # FFmpeg を止めると読み込みスレッドも抜ける
+
+
+class MixedAudio(TrackMixer, discord.AudioSource):
+    """VoiceClient に渡す TrackMixer (曲が変わっても同じソースを流し続ける)"""
+
+
+# 測定・照会済みの loudness (キーは video_id か添付のパス)。動画は track_cache にも保存する
+_loudness_memo: dict[str, float] = {}
+_loudness_jobs: dict[str, asyncio.Task] = {}
+
+
+async def load_loudness(track: Track) -> float | None:
+    """測定済みの loudness を track に読み込む (未測定なら None)
+
+    track_cache (SQLite) はワーカースレッドで引き、見つかった値はメモリにも覚える。
+    """
+    key = track.video_id or track.url
+    if track.loudness is None and key:
+        track.loudness = _loudness_memo.get(key)
+        if track.loudness is None and track.video_id:
+            hit = await asyncio.to_thread(track_cache.get, track.video_id)
+            if hit and hit.loudness is not None:
+                track.loudness = _loudness_memo[key] = hit.loudness
+    return track.loudness
+
+
+def schedule_loudness(track: Track, url: str, owner: Any = None) -> None:
+    """未測定なら裏で loudness を測る (次に再生するときから補正される)
+
+    load_loudness の後に呼ぶ。同じ曲の解析は 1 本にまとめ、待ちが
+    LOUDNESS_QUEUE_MAX 件を超えたら諦める (次に再生するときにまた頼む)。
+    """
+    key = track.video_id or track.url
+    if track.loudness is not None or not key or key in _loudness_jobs:
+        return
+    if len(_loudness_jobs) >= LOUDNESS_QUEUE_MAX:
+        return
+    before = f"-t {LOUDNESS_MAX_SECONDS}"
+    if is_http_source(url):
+        before += " -reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+    measure = functools.partial(measure_loudness, url, before_options=before,
+                                timeout=LOUDNESS_TIMEOUT)
+
+    async def job():
+        try:
+            lufs = await analyzer.run(measure, owner=owner)
+        except Exception as e:
+            logger.debug("loudness 解析失敗 (%s): %s", track.title, e)
+            return
+        finally:
+            _loudness_jobs.pop(key, None)
+        if lufs is None:
+            return
+        track.loudness = _loudness_memo[key] = lufs
+        if track.video_id:
+            await asyncio.to_thread(track_cache.store_loudness, track.video_id, lufs)
+
+    _loudness_jobs[key] = asyncio.create_task(job())
+
+
+def make_audio_source(url: str, codec: str | None, before_opts: str,
+                      opus_ok: bool, gain: float = PLAYBACK_VOLUME, *,
+                      opus: bool | None = None) -> discord.AudioSource:
+    """音源に合わせて AudioSource を作る
+
+    - Opus の音源で補正がほぼ不要: コピーするだけでデコード/エンコードしない
+    - それ以外: FFmpeg が Opus にエンコードし、ゲインもそこで掛ける
+    - libopus が無いか無効化したとき、クロスフェードするときは PCM で受けて
+      discord.py がエンコード (CROSSFADE_SECONDS > 0 にすると Opus のままコピー
+      できる曲も含めて全曲この経路になり、CPU 負荷が上がる)
+
+    opus を指定すると出力をその種類 (True: Opus / False: PCM) に揃える。
+    再生中のミキサーに続けてつなぐ曲はミキサーと同じ種類でなければならない。
+    """
+    passthrough = OPUS_PASSTHROUGH and CROSSFADE_SECONDS <= 0 and opus is not False
+    if passthrough and codec == "opus" and abs(linear_to_db(gain)) <= LOUDNESS_TOLERANCE:
+        return discord.FFmpegOpusAudio(
+            url, codec="copy",
+            before_options=before_opts,
+            options="-vn -loglevel warning",
+        )
+    options = f'-vn -loglevel warning -af "volume={gain:.4f}"'
+    if passthrough and opus_ok:
+        return discord.FFmpegOpusAudio(
+            url, bitrate=OPUS_BITRATE,
+            before_options=before_opts,
+            options=options,
+        )
+    if opus:
+        raise ValueError("この曲は Opus で出力できません")
+    return discord.FFmpegPCMAudio(
+        source=url,
+        executable="ffmpeg",
+        before_options=before_opts,
+        options=options,
+    )
+
+
+def remember_track(guild_id: int, track: Track) -> None:
+    """曲を /play のオートコンプリート候補に加える
+
+    選ばれたときは元ページの URL を渡すので、track_cache に当たって検索を省略できる。
+    """
+    if not track.webpage_url:
+        return  # 添付ファイルは再生し直せないので候補にしない
+    value = track.webpage_url if len(track.webpage_url) <= 100 else track.title[:100]
+    title_index.add(guild_id, track.title, value)
+
+
 def is_playlist_url(url: str) -> bool:
     """URL に playlist パラメータが含まれるか簡易判定"""
     try:
@@ -487,53 +1047,85 @@ def split_by_commas(text: str) -> list[str]:
     return [t.strip() for t in text.split(",") if t.strip()]
 
 
+PLAYLIST_BATCH = 25              # 1 回にキューへ追加する曲数
+PLAYLIST_REFRESH_INTERVAL = 3.0  # 読み込み中にパネルを更新する最短間隔 (秒)
+
+
+def _placeholder_from_flat(ent: dict) -> Track | None:
+    """extract_flat のエントリを未解決の Track にする (タイトル不明なら None)
+
+    ストリーム URL は空のままキューに積み、再生直前の ensure_stream() で解決する。
+    """
+    url = ent.get("url") or ent.get("webpage_url")
+    vid = ent.get("id")
+    if not url and vid:
+        url = f"https://www.youtube.com/watch?v={vid}"
+    title = ent.get("title")
+    if not url or not title or title in ("[Private video]", "[Deleted video]"):
+        return None
+    dur = ent.get("duration")
+    return Track(title, "", int(dur) if dur else None, url, _video_key(ent))
+
+
 async def add_playlist_lazy(state: "MusicState", playlist_url: str,
                             voice: discord.VoiceClient,
                             channel: discord.TextChannel):
-    """プレイリストの曲を逐次取得してキューへ追加"""
-    task = asyncio.current_task()
+    """プレイリストの曲をバッチ単位でキューへ追加
+
+    フラット取得したエントリはそのままプレースホルダ Track として追加し、
+    タイトルが取れなかったものだけバッチ内で並列に解決する (順序は維持)。
+    パネル更新は PLAYLIST_REFRESH_INTERVAL 秒に 1 回までに抑える。
+    """
     qs = parse_qs(urlparse(playlist_url).query)
     list_id = qs.get("list", [None])[0]
     if list_id:
         playlist_url = f"https://www.youtube.com/playlist?list={list_id}"
-    loop = asyncio.get_running_loop()
-    info = await loop.run_in_executor(
-        None,
+    info = await extractor.run(
         lambda: YoutubeDL({**YTDL_OPTS, "extract_flat": True}).extract_info(
-            playlist_url, download=False)
+            playlist_url, download=False),
+        owner=state,
     )
-    entries = info.get("entries", [])
+    entries = [e for e in info.get("entries", []) if e]
     if not entries:
         await channel.send("⚠️ プレイリストに曲が見つかりませんでした。", delete_after=5)
         return
     await channel.send(f"⏱️ プレイリストを読み込み中... ({len(entries)}曲)")
-    for ent in entries:
-        if task.cancelled() or not voice.is_connected():
+    added = 0
+    last_refresh = 0.0
+    for start in range(0, len(entries), PLAYLIST_BATCH):
+        if not voice.is_connected():
             break
-        url = ent.get("url")
-        if not url:
-            continue
-        try:
-            tracks = await loop.run_in_executor(None, yt_extract, url)
-        except Exception as e:
-            logger.error("取得失敗 (%s): %s", url, e)
-            continue
-        if not tracks:
+        batch = entries[start:start + PLAYLIST_BATCH]
+        tracks: list[Track | None] = [_placeholder_from_flat(e) for e in batch]
+        missing = [i for i, tr in enumerate(tracks) if tr is None and batch[i].get("url")]
+        if missing:
+            urls = [batch[i]["url"] for i in missing]
+            results = await extractor.gather(cached_extract, urls, owner=state)
+            for i, url, res in zip(missing, urls, results):
+                if isinstance(res, BaseException) or not res:
+                    logger.error("取得失敗 (%s): %s", url, res)
+                    continue
+                tracks[i] = res[0]
+        resolved = [tr for tr in tracks if tr is not None]
+        if not resolved:
             continue
-        state.queue.append(tracks[0])
-        await refresh_queue(state)
-        if not voice.is_playing() and not state.play_next.is_set():
-            client.loop.create_task(state.player_loop(voice, channel))
-    await channel.send(f"✅ プレイリストの読み込みが完了しました ({len(entries)}曲)", delete_after=10)
+        state.queue.extend(resolved)
+        added += len(resolved)
+        last = start + PLAYLIST_BATCH >= len(entries)
+        if last or time.monotonic() - last_refresh >= PLAYLIST_REFRESH_INTERVAL:
+            await refresh_queue(state)
+            last_refresh = time.monotonic()
+        state.ensure_player(voice, channel)
+        if start == 0 and state.current is not None:
+            state.start_prefetch()
+    await channel.send(f"✅ プレイリストの読み込みが完了しました ({added}曲)", delete_after=10)
 
 
 def cleanup_track(track: Track | None):
-    """ローカルファイルの場合は削除"""
-    if track and os.path.exists(track.url):
-        try:
-            os.remove(track.url)
-        except Exception as e:
-            logger.error("cleanup failed for %s: %s", track.url, e)
+    """添付音源の参照を手放す (どのキューからも使われなくなったファイルは削除される)"""
+    if track and track.stored:
+        track.stored = False  # 停止と再生ループの両方から呼ばれても 1 回だけ
+        audio_store.release(track.url)
 
 
 def parse_message_link(link: str) -> tuple[int, int, int] | None:
@@ -543,7 +1135,7 @@ def parse_message_link(link: str) -> tuple[int, int, int] | None:
         return None
     return int(m.group(1)), int(m.group(2)), int(m.group(3))
     
-import asyncio, collections
+import asyncio
 
 def fmt_time(sec: int) -> str:
     m, s = divmod(int(sec), 60)
@@ -607,143 +1199,535 @@ def num_emoji(n: int) -> str:
     emojis = ["0️⃣","1️⃣","2️⃣","3️⃣","4️⃣","5️⃣","6️⃣","7️⃣","8️⃣","9️⃣","🔟"]
     return emojis[n] if 0 <= n < len(emojis) else f'[{n}]'
 
+UP_NEXT_MAX_CHARS = 800   # Up Next 欄に載せる最大文字数
+REMOVE_BUTTONS = 10       # パネルに並べる削除ボタン数
+
+
 class MusicState:
-    def __init__(self):
-        self.queue   = collections.deque()   # 再生待ち Track 一覧
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.queue: TrackQueue[Track] = TrackQueue()  # 再生待ち Track 一覧 (再生中の曲は含まない)
         self.loop    = 0  # 0:OFF,1:SONG,2:QUEUE
         self.auto_leave = True             # 全員退出時に自動で切断するか
-        self.current: Track | None = None
-        self.play_next = asyncio.Event()
+        self.volume = 100                  # /volume で指定した音量 (%)
+        self.current: Track | None = None  # 再生中の曲 (キューとは別枠)
         self.queue_msg: discord.Message | None = None
         self.panel_owner: int | None = None
-        self.start_time: float | None = None
-        self.pause_offset: float = 0.0
+        self.panel_view: "ControlView | None" = None  # queue_msg に付いている View
+        self.source: BufferedAudio | None = None  # 再生中の音源 (再生位置の基準)
+        self.mixer: MixedAudio | None = None       # VoiceClient に渡しているミキサー
+        self.preload_task: asyncio.Task | None = None
+        self.channel: discord.TextChannel | None = None
         self.is_paused: bool = False
         self.playlist_task: asyncio.Task | None = None
         self.seek_to: int | None = None
         self.seeking: bool = False
+        self.prefetch_task: asyncio.Task | None = None
+        self.player_task: asyncio.Task | None = None
+        self.voice_channel_id: int | None = None
+        self._saved_queue_version: int | None = None  # 最後に書き出したキューの version
+        self._up_next_key: int | None = None
+        self._up_next: tuple[str, list[int]] = ("Empty", [])
+
+    def up_next(self) -> tuple[str, list[int]]:
+        """Up Next 欄の本文と、削除ボタンに割り当てるエントリ ID を返す
+
+        キューが変わったときだけ作り直し、毎秒の描画ではキャッシュをそのまま使う。
+        """
+        if self.queue.version == self._up_next_key:
+            return self._up_next
+        total = len(self.queue)
+        lines, chars = [], 0
+        for i, tr in enumerate(self.queue, 1):
+            line = f"{num_emoji(i)} {tr.title}"
+            if chars + len(line) + 1 > UP_NEXT_MAX_CHARS:
+                lines.append(f"…and **{total-i+1}** more")
+                break
+            lines.append(line)
+            chars += len(line) + 1
+        body = "\n".join(lines) if lines else "Empty"
+        self._up_next_key = self.queue.version
+        self._up_next = (body, self.queue.ids(0, REMOVE_BUTTONS))
+        return self._up_next
+
+    def finish_current(self):
+        """再生し終えた曲をループ設定に従って片付ける"""
+        finished, self.current = self.current, None
+        if finished is None:
+            return
+        if self.loop == 1:
+            self.current = finished          # 同じ曲をもう一度
+        elif self.loop == 2:
+            self.queue.append(finished)      # キューの末尾へ戻す
+        else:
+            cleanup_track(finished)
+
+    def drop_current(self):
+        """再生できなかった曲を捨てる"""
+        cleanup_track(self.current)
+        self.current = None
+
+    @property
+    def position(self) -> float:
+        """再生位置 (秒)
+
+        壁時計ではなく、音源が実際に送出した 20ms フレームの数から数えるので、
+        FFmpeg の待ちや一時停止・イベントループの遅れでずれない。
+        """
+        return self.source.buffer.position if self.source else 0.0
+
+    def seek_buffered(self, pos: float) -> bool:
+        """pos が再生中のバッファ内なら FFmpeg を止めずにシークする"""
+        return self.source is not None and self.source.buffer.seek(pos)
+
+    def _saving(self) -> bool:
+        """保存すべき状態か (停止・自動退出で破棄されたか、空なら False)"""
+        if guild_states.get(self.guild_id) is not self:
+            return False
+        return self.current is not None or bool(self.queue)
+
+    def snapshot(self) -> dict | None:
+        """再起動後に再生を再開するための状態 (キューと再生位置は別の記録)"""
+        if not self._saving():
+            return None
+        guild = client.get_guild(self.guild_id)
+        vc = guild.voice_client if guild else None
+        if vc and vc.channel:
+            self.voice_channel_id = vc.channel.id
+        return {
+            "voice_channel": self.voice_channel_id,
+            "text_channel": self.channel.id if self.channel else None,
+            "panel_message": self.queue_msg.id if self.queue_msg else None,
+            "panel_owner": self.panel_owner,
+            "loop": self.loop,
+            "auto_leave": self.auto_leave,
+            "volume": self.volume,
+            "current": track_to_dict(self.current) if self.current else None,
+        }
+
+    def queue_snapshot(self) -> dict | None:
+        if not self._saving():
+            return None
+        self._saved_queue_version = self.queue.version
+        return {"tracks": [track_to_dict(tr) for tr in self.queue]}
+
+    def position_snapshot(self) -> dict | None:
+        if not self._saving():
+            return None
+        pos = self.position if self.source is not None else (self.seek_to or 0)
+        return {
+            "position": round(pos, 1),
+            "title": self.current.title if self.current else None,
+        }
+
+    def persist(self):
+        """状態が変わったので保存を予約する (書き込みは state_store がまとめて行う)
+
+        キューはその version が最後に書いたときから変わった場合だけ書き直す。
+        """
+        key = str(self.guild_id)
+        state_store.mark(key, self.snapshot)
+        if self.queue.version != self._saved_queue_version or not self._saving():
+            state_store.mark(key + MUSIC_QUEUE_SUFFIX, self.queue_snapshot)
+        self.persist_position()
+
+    def persist_position(self):
+        state_store.mark(str(self.guild_id) + MUSIC_POS_SUFFIX, self.position_snapshot)
+
+    def ensure_player(self, voice: discord.VoiceClient, channel: discord.TextChannel):
+        """player_loop が動いていなければ起動する (二重起動しない)"""
+        if self.player_task and not self.player_task.done():
+            return
+        self.channel = channel
+        self.voice_channel_id = voice.channel.id if voice.channel else None
+        self.player_task = client.loop.create_task(self.player_loop(voice, channel))
+
+    def upcoming(self, n: int) -> list[Track]:
+        """この後に再生される予定の Track を最大 n 件返す (ループ設定を考慮)"""
+        if self.loop == 1 or n <= 0:
+            return []
+        nxt = self.queue.items(0, n)
+        if self.loop == 2 and len(nxt) < n and self.current:
+            nxt.append(self.current)  # 一周して戻ってくる
+        return nxt
+
+    def start_prefetch(self):
+        """次曲のストリーム解決をバックグラウンドで開始 (実行中なら張り直す)"""
+        self.cancel_prefetch()
+        if self.upcoming(PREFETCH_COUNT):
+            self.prefetch_task = asyncio.create_task(self._prefetch())
+
+    def cancel_prefetch(self):
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+        self.prefetch_task = None
+
+    async def _prefetch(self):
+        # 現在の曲が終わるまで URL が持つよう、残り時間分の余裕を要求する。
+        # 新しく取った URL でも満たせるよう STREAM_TTL の半分で頭打ちにする
+        # (それより先の期限切れは再生直前の ensure_stream が取り直す)
+        remaining = max(0.0, (self.current.duration or 0) - self.position) if self.current else 0.0
+        margin = min(remaining + 60, STREAM_TTL / 2)
+        for tr in self.upcoming(PREFETCH_COUNT):
+            if not tr.webpage_url:
+                continue
+            try:
+                url = await ensure_stream(tr, self, min_valid=margin)
+                if PREFETCH_PROBE and not await probe_stream(url):
+                    url = await ensure_stream(tr, self, force=True)
+                await load_loudness(tr)
+                schedule_loudness(tr, url, self)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("prefetch failed (%s): %s", tr.title, e)
+
+    def _next_track(self) -> tuple[Track, int | None] | None:
+        """今の曲の次に流す曲と、そのキュー上のエントリ ID (ループ設定を考慮)"""
+        if self.loop == 1 and self.current:
+            return self.current, None
+        if self.queue:
+            return self.queue[0], self.queue.id_at(0)
+        if self.loop == 2 and self.current:
+            return self.current, None
+        return None
+
+    def _is_next(self, tag: tuple[Track, int | None] | None) -> bool:
+        nxt = self._next_track()
+        return nxt is not None and tag is not None and nxt[0] is tag[0] and nxt[1] == tag[1]
+
+    def start_preload(self):
+        """次の曲の FFmpeg を先に起動してミキサーに渡す (実行中なら張り直す)"""
+        self.cancel_preload()
+        if self.mixer and self._next_track():
+            self.preload_task = asyncio.create_task(self._preload(self.mixer))
+
+    def cancel_preload(self):
+        if self.preload_task and not self.preload_task.done():
+            self.preload_task.cancel()
+        self.preload_task = None
+
+    async def _preload(self, mixer: MixedAudio):
+        while self.mixer is mixer:
+            nxt = self._next_track()
+            if nxt is None:
+                return
+            # ミキサーの出力 (Opus / PCM) は途中で変えられないので同じ種類で開く。
+            # 開けなければ今の曲の終わりでミキサーを作り直す
+            deck = await self._open_deck(nxt[0], None, notify=False, opus=mixer.is_opus())
+            if deck is None:
+                return  # 切り替え時に改めて開き、失敗はそこで通知する
+            if self.mixer is mixer and self._is_next(nxt):
+                mixer.queue_next(deck, nxt)
+                return
+            deck.cleanup()  # 開いている間にキューが変わったので開き直す
+
+    def check_preload(self):
+        """キューやループ設定が変わって先読みした次曲が外れたら開き直す"""
+        if self.mixer is None:
+            return
+        tag = self.mixer.next_tag
+        if tag is not None:
+            if self._is_next(tag):
+                return
+            self.mixer.clear_next()
+        preloading = self.preload_task is not None and not self.preload_task.done()
+        if not preloading and self.source and self.source.remaining() is not None:
+            self.start_preload()  # もう曲の終わりが見えているので今すぐ用意する
+
+    def skip_to_next(self) -> bool:
+        """先読み済みの次曲があればミキサー上で即座に切り替える"""
+        return self.mixer is not None and self.mixer.skip()
+
+    def advance_to(self, track: Track, entry_id: int | None):
+        """ミキサーが先読みした曲へ切り替わったときにキューを進める"""
+        if track is self.current:
+            return  # 1 曲ループ / 1 曲だけのキューループ
+        self.finish_current()
+        if entry_id is not None:
+            self.queue.remove_id(entry_id)
+        self.current = track
+
+    def track_gain(self, track: Track) -> float:
+        """再生時に掛ける音量 (loudness の補正 × /volume)"""
+        lufs = track.loudness  # _open_deck で load_loudness 済み
+        if lufs is None:
+            base = PLAYBACK_VOLUME
+        else:
+            base = db_to_linear(normalize_gain_db(lufs, LOUDNESS_TARGET, LOUDNESS_MAX_BOOST))
+        return base * self.volume / 100
+
+    async def _open_deck(self, track: Track, seek_pos: int | None, *,
+                         notify: bool = True, opus: bool | None = None) -> BufferedAudio | None:
+        """track の FFmpeg を起動して返す (失敗したら None。opus は make_audio_source と同じ)"""
+        title = track.title
+        # ストリーム URL は期限があるので FFmpeg に渡す直前に確認する
+        try:
+            url = await ensure_stream(track, self)
+        except Exception as e:
+            logger.error("stream 解決失敗 (%s): %s", title, e)
+            if notify:
+                await self.channel.send(
+                    f"⚠️ `{title}` の再生に失敗しました（{e}）",
+                    delete_after=5
+                )
+            return None
+
+        before_opts = ""
+        if seek_pos is not None:
+            before_opts += f"-ss {seek_pos} "
+        before_opts += (
+            "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
+            if is_http_source(url) else ""
+        )
+        codec = await source_codec(track, url)
+        opus_ok = await asyncio.to_thread(ffmpeg_has_libopus)
+        await load_loudness(track)
+        schedule_loudness(track, url, self)
+        try:
+            return BufferedAudio(
+                make_audio_source(url, codec, before_opts.strip(), opus_ok,
+                                  self.track_gain(track), opus=opus),
+                start=seek_pos or 0,
+            )
+        except ValueError as e:
+            # 再生中のミキサーと出力の種類を揃えられなかった (先読みだけで起きる)
+            logger.info("deck not opened (%s): %s", title, e)
+        except FileNotFoundError:
+            logger.error("ffmpeg executable not found")
+            if notify:
+                await self.channel.send(
+                    "⚠️ **ffmpeg が見つかりません** — サーバーに ffmpeg をインストールして再試行してください。",
+                    delete_after=5
+                )
+        except Exception as e:
+            logger.error(f"ffmpeg 再生エラー: {e}")
+            if notify:
+                await self.channel.send(
+                    f"⚠️ `{title}` の再生に失敗しました（{e}）",
+                    delete_after=5
+                )
+        return None
 
     async def player_loop(self, voice: discord.VoiceClient, channel: discord.TextChannel):
         """
         キューが続く限り再生し続けるループ。
-        self.current に再生中タプル (title,url) をセットし、
-        曲が変わるたびに refresh_queue() を呼んで Embed を更新。
+        self.current に再生中の Track をセットし、
+        曲が変わるたびに refresh_queue() で Embed の更新を予約する。
+
+        曲と曲の間は MixedAudio が先読みした次の曲へ切れ目なく切り替え、
+        ここではその通知を受けて状態を進める。FFmpeg を起動し直すのは
+        最初の曲・スキップ (先読み前)・バッファ外へのシークのときだけ。
         """
+        self.channel = channel
+        loop = asyncio.get_running_loop()
         while True:
-            self.play_next.clear()
-
-            # キューが空なら 5 秒待機→まだ空なら切断
-            if not self.queue:
-                await asyncio.sleep(5)
+            if self.current is None:
+                # キューが空なら 5 秒待機→まだ空なら切断
                 if not self.queue:
-                    await voice.disconnect()
-                    if self.queue_msg:
+                    await asyncio.sleep(5)
+                    if not self.queue:
+                        self.cancel_prefetch()
+                        panel.forget(self)
+                        self.persist()  # 空になったので保存状態も消える
                         try:
-                            await self.queue_msg.delete()
-                        except Exception:
-                            pass
-                        self.queue_msg = None
-                        self.panel_owner = None
-                    return
+                            await voice.disconnect()
+                        except Exception as e:
+                            # 残った状態は reaper が回収する
+                            logger.warning("voice disconnect failed: %s", e)
+                        if self.queue_msg:
+                            try:
+                                await self.queue_msg.delete()
+                            except Exception:
+                                pass
+                            self.queue_msg = None
+                            self.panel_owner = None
+                        return
+                self.current = self.queue.popleft()
 
             # 再生準備
-            self.current = self.queue[0]
             seek_pos = self.seek_to
             announce = not self.seeking
             self.seek_to = None
             self.seeking = False
-            title, url = self.current.title, self.current.url
+            title = self.current.title
             self.is_paused = False
-            self.pause_offset = 0
-
-            before_opts = ""
-            if seek_pos is not None:
-                before_opts += f"-ss {seek_pos} "
-            before_opts += (
-                "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5"
-                if is_http_source(url) else ""
+
+            deck = await self._open_deck(self.current, seek_pos)
+            if deck is None:
+                self.drop_current()
+                continue
+
+            # ミキサーの通知は読み出しスレッドから届くので、ループ側のキューへ移す
+            events: asyncio.Queue[tuple[str, Any]] = asyncio.Queue()
+
+            def notify(kind: str, tag: Any, q=events):
+                loop.call_soon_threadsafe(q.put_nowait, (kind, tag))
+
+            mixer = MixedAudio(
+                deck, tag=(self.current, None),
+                fade_frames=int(CROSSFADE_SECONDS / FRAME_SECONDS),
+                on_event=notify,
             )
             try:
-                ffmpeg_audio = discord.FFmpegPCMAudio(
-                    source=url,
-                    executable="ffmpeg",
-                    before_options=before_opts.strip(),
-                    options='-vn -loglevel warning -af "volume=0.9"'
-                )
-                voice.play(ffmpeg_audio, after=lambda _: self.play_next.set())
-            except FileNotFoundError:
-                logger.error("ffmpeg executable not found")
-                await channel.send(
-                    "⚠️ **ffmpeg が見つかりません** — サーバーに ffmpeg をインストールして再試行してください。",
-                    delete_after=5
-                )
-                cleanup_track(self.queue.popleft())
-                continue
+                voice.play(mixer, after=lambda _: notify("ended", None))
             except Exception as e:
                 logger.error(f"ffmpeg 再生エラー: {e}")
                 await channel.send(
                     f"⚠️ `{title}` の再生に失敗しました（{e}）",
                     delete_after=5
                 )
-                cleanup_track(self.queue.popleft())
+                mixer.cleanup()
+                self.drop_current()
                 continue
 
-            self.start_time = time.time() - (seek_pos or 0)
-
+            self.mixer, self.source = mixer, deck
 
+            # 再生中に次曲の URL を解決しておき、曲間の待ちをなくす
+            if not seek_pos:
+                self.start_prefetch()
 
+            remember_track(self.guild_id, self.current)
 
             # チャット通知 & Embed 更新
             if announce:
                 await channel.send(f"▶️ **Now playing**: {title}")
             await refresh_queue(self)
 
-            progress_task = asyncio.create_task(progress_updater(self))
-
-            # 次曲まで待機
-            await self.play_next.wait()
-            progress_task.cancel()
-            self.start_time = None
+            panel.start_progress(self)
+
+            # ミキサーが止まるまで、曲の終わりと切り替えを処理する
+            while (event := await events.get())[0] != "ended":
+                kind, tag = event
+                if kind == "draining":
+                    self.start_preload()
+                elif kind == "switched":
+                    self.advance_to(*tag)
+                    self.source = mixer.current
+                    remember_track(self.guild_id, self.current)
+                    await channel.send(f"▶️ **Now playing**: {self.current.title}")
+                    await refresh_queue(self)
+                    panel.start_progress(self)
+                    self.start_prefetch()
+
+            panel.stop_progress(self)
+            self.cancel_preload()
+            self.mixer = self.source = None
             if self.seek_to is not None:
                 await refresh_queue(self)
                 continue
 
-            # ループOFFなら再生し終えた曲をキューから外す
-            if self.loop == 0 and self.queue:
-                finished = self.queue.popleft()
-                cleanup_track(finished)
-            elif self.loop == 2 and self.queue:
-                self.queue.rotate(-1)
-
+            self.finish_current()
             await refresh_queue(self)
 
 
 # クラス外でOK
 async def refresh_queue(state: "MusicState"):
-    """既存のキュー Embed と View を最新内容に書き換える"""
-    if not state.queue_msg:
+    """キュー Embed の書き換えを予約する (編集は panel スケジューラがまとめて行う)"""
+    state.check_preload()
+    state.persist()
+    if state.queue_msg:
+        panel.request(state)
+
+
+def _panel_signature(state: "MusicState", emb: discord.Embed | None) -> tuple:
+    """パネルの見た目を表す値。前回と同じなら編集を省略する"""
+    msg_id = state.queue_msg.id if state.queue_msg else None
+    if emb is None:
+        return (msg_id, None)
+    return (
+        msg_id,
+        json.dumps(emb.to_dict(), sort_keys=True, ensure_ascii=False),
+        tuple(state.up_next()[1]),
+        state.panel_owner,
+    )
+
+
+def _panel_view_key(state: "MusicState", vc: discord.VoiceClient, owner_id: int) -> tuple:
+    """パネルのボタン構成を表す値。前回と同じなら View を作り直さない"""
+    return (tuple(state.up_next()[1]), state.loop, state.auto_leave, vc, owner_id)
+
+
+def _render_panel(state: "MusicState"):
+    msg = state.queue_msg
+    if not msg:
+        return None
+    vc = msg.guild.voice_client
+    if not vc or not vc.is_connected():
+        return _panel_signature(state, None), None  # VC から抜けていればパネルを消す
+    emb = make_embed(state)
+    owner = state.panel_owner or msg.author.id
+    return _panel_signature(state, emb), (emb, vc, owner)
+
+
+async def _apply_panel(state: "MusicState", payload):
+    msg = state.queue_msg
+    if msg is None:
+        return
+    if payload is None:
+        try:
+            await msg.delete()
+        except discord.HTTPException:
+            pass
+        if state.queue_msg is msg:
+            state.queue_msg = None
+            state.panel_owner = None
         return
+    emb, vc, owner = payload
+    view = state.panel_view
     try:
-        vc = state.queue_msg.guild.voice_client
-        if not vc or not vc.is_connected():
-            await state.queue_msg.delete()
+        if view is not None and view.key() == _panel_view_key(state, vc, owner):
+            # シークバーだけの更新ではボタンを送り直さない (登録済みの View をそのまま使う)
+            await msg.edit(embed=emb)
+        else:
+            view = QueueRemoveView(state, vc, owner)
+            await msg.edit(embed=emb, view=view)
+            if state.queue_msg is msg:
+                state.panel_view = view
+    except discord.NotFound:
+        if state.queue_msg is msg:
             state.queue_msg = None
             state.panel_owner = None
-            return
-        owner = state.panel_owner or state.queue_msg.author.id
-        view = QueueRemoveView(state, vc, owner)
-        await state.queue_msg.edit(embed=make_embed(state), view=view)
-    except discord.HTTPException:
-        pass
 
-async def progress_updater(state: "MusicState"):
-    """再生中は1秒ごとにシークバーを更新"""
-    try:
-        while True:
-            await asyncio.sleep(1)
-            await refresh_queue(state)
-    except asyncio.CancelledError:
-        pass
+
+PROGRESS_MIN_INTERVAL = 2.0    # シークバー更新の最短間隔 (秒)
+PROGRESS_MAX_INTERVAL = 15.0   # 長い曲・一時停止中の更新間隔の上限 (秒)
+
+
+def _progress_interval(state: "MusicState") -> float | None:
+    """シークバーの更新間隔。バーの目盛りが 1 つ進む時間を基準に、REST 予算が
+    逼迫しているほど間隔を広げる。再生していなければ None"""
+    cur = state.current
+    if cur is None or state.source is None or not cur.duration:
+        return None
+    if state.is_paused or not state.queue_msg:
+        # パネルが無い間もゆっくり見回り、後から出たパネルのバーを動かす
+        return PROGRESS_MAX_INTERVAL
+    step = cur.duration / 14  # make_bar の幅 15 → 目盛り 14
+    ivl = min(max(step, PROGRESS_MIN_INTERVAL), PROGRESS_MAX_INTERVAL)
+    return ivl * panel.pressure()
+
+
+panel = PanelScheduler(
+    _render_panel, _apply_panel,
+    interval=_progress_interval,
+    min_interval=1.0, rate=10.0, burst=20,
+)
+
+
+async def respond_panel(itx: discord.Interaction, state: "MusicState",
+                        view: discord.ui.View, owner_id: int):
+    """ボタン操作への応答としてパネルを直接書き換え、スケジューラにも伝える"""
+    state.check_preload()
+    state.persist()
+    emb = make_embed(state)
+    await itx.response.edit_message(embed=emb, view=view)
+    state.queue_msg = itx.message
+    state.panel_owner = owner_id
+    state.panel_view = view
+    panel.note_rendered(state, _panel_signature(state, emb))
+    panel.start_progress(state)
+
 
 # ──────────── 🖼 名言化 APIヘルパ ────────────
 import json, aiohttp, pathlib
@@ -782,7 +1766,7 @@ async def make_quote_image(user, text, color=False) -> pathlib.Path:
         async with sess.get(img_url) as img:
             img_bytes = await img.read()
 
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
+    with tempfile.NamedTemporaryFile(delete=False, prefix=TEMP_PREFIX, suffix=".jpg") as tmp:
         tmp.write(img_bytes)
         tmp_path = pathlib.Path(tmp.name)
 
@@ -848,12 +1832,17 @@ class QuoteView(discord.ui.View):
 
 # ──────────── 🎵  VCユーティリティ ────────────
 guild_states: dict[int, "MusicState"] = {}
-voice_lock = asyncio.Lock()
-last_4022: dict[int, float] = {}
+VOICE_CONNECT_TIMEOUT = 10.0
+VOICE_4022_SUPPRESS = 60.0   # 4022 を受けたギルドへの再接続を控える秒数
+voice_manager = VoiceManager(suppress_ttl=VOICE_4022_SUPPRESS,
+                             backoff_base=1.0, backoff_cap=60.0)
 
 class YoneVoiceClient(discord.VoiceClient):
+    def cleanup(self) -> None:
+        voice_manager.disconnected(self.guild.id)
+        super().cleanup()
+
     async def poll_voice_ws(self, reconnect: bool) -> None:
-        backoff = discord.utils.ExponentialBackoff()
         while True:
             try:
                 await self.ws.poll_event()
@@ -865,23 +1854,26 @@ class YoneVoiceClient(discord.VoiceClient):
                         break
                     if exc.code == 4014:
                         logger.info('Disconnected from voice by force... potentially reconnecting.')
+                        voice_manager.reconnecting(self.guild.id)
                         successful = await self.potential_reconnect()
                         if not successful:
                             logger.info('Reconnect was unsuccessful, disconnecting from voice normally...')
                             await self.disconnect()
                             break
                         else:
+                            voice_manager.connected(self.guild.id)
                             continue
                     if exc.code == 4022:
-                        last_4022[self.guild.id] = time.time()
-                        logger.warning('Received 4022, suppressing reconnect for 60s')
+                        voice_manager.suppress(self.guild.id)
+                        logger.warning('Received 4022, suppressing reconnect for %ds', VOICE_4022_SUPPRESS)
                         await self.disconnect()
                         break
                 if not reconnect:
                     await self.disconnect()
                     raise
 
-                retry = backoff.delay()
+                # 待ち時間はギルドごとのバックオフ (接続に成功するとリセット)
+                retry = voice_manager.reconnecting(self.guild.id)
                 logger.exception('Disconnected from voice... Reconnecting in %.2fs.', retry)
                 self._connected.clear()
                 await asyncio.sleep(retry)
@@ -891,6 +1883,24 @@ class YoneVoiceClient(discord.VoiceClient):
                 except asyncio.TimeoutError:
                     logger.warning('Could not connect to voice... Retrying...')
                     continue
+                voice_manager.connected(self.guild.id)
+
+
+async def connect_voice(channel: discord.abc.Connectable, *,
+                        self_deaf: bool = True) -> discord.VoiceClient:
+    """channel のギルドへ接続する (既に接続済みならそれを返す)"""
+    guild = channel.guild
+
+    def current() -> discord.VoiceClient | None:
+        vc = guild.voice_client
+        return vc if vc and vc.is_connected() else None
+
+    return await voice_manager.connect(
+        guild.id,
+        lambda: channel.connect(self_deaf=self_deaf, cls=YoneVoiceClient),
+        timeout=VOICE_CONNECT_TIMEOUT,
+        current=current,
+    )
 
 
 async def ensure_voice(msg: discord.Message, self_deaf: bool = True) -> discord.VoiceClient | None:
@@ -899,7 +1909,7 @@ async def ensure_voice(msg: discord.Message, self_deaf: bool = True) -> discord.
         await msg.reply("🎤 まず VC に入室してからコマンドを実行してね！")
         return None
 
-    if time.time() - last_4022.get(msg.guild.id, 0) < 60:
+    if voice_manager.suppressed(msg.guild.id):
         return None
 
     voice = msg.guild.voice_client
@@ -908,18 +1918,12 @@ async def ensure_voice(msg: discord.Message, self_deaf: bool = True) -> discord.
             await voice.move_to(msg.author.voice.channel)
         return voice
 
-    # 未接続 → 接続を試みる（10 秒タイムアウト）
+    # 未接続 → 接続を試みる（同じギルドの接続だけを直列化、10 秒タイムアウト）
     try:
-        async with voice_lock:
-            if msg.guild.voice_client and msg.guild.voice_client.is_connected():
-                return msg.guild.voice_client
-            return await asyncio.wait_for(
-                msg.author.voice.channel.connect(self_deaf=self_deaf, cls=YoneVoiceClient),
-                timeout=10
-            )
+        return await connect_voice(msg.author.voice.channel, self_deaf=self_deaf)
     except discord.errors.ConnectionClosed as e:
         if e.code == 4022:
-            last_4022[msg.guild.id] = time.time()
+            voice_manager.suppress(msg.guild.id)
         await msg.reply("⚠️ VC への接続に失敗しました。", delete_after=5)
         return None
     except asyncio.TimeoutError:
@@ -937,12 +1941,8 @@ def make_embed(state: "MusicState") -> discord.Embed:
     # Now Playing
     if state.current:
         emb.add_field(name="▶️ Now Playing:", value=state.current.title, inline=False)
-        if state.start_time is not None and state.current.duration:
-            if state.is_paused:
-                pos = int(state.pause_offset)
-            else:
-                pos = int(time.time() - state.start_time)
-            pos = max(0, min(pos, state.current.duration))
+        if state.source is not None and state.current.duration:
+            pos = max(0, min(int(state.position), state.current.duration))
             bar = make_bar(pos, state.current.duration)
             emb.add_field(
                 name=f"[{bar}] {fmt_time(pos)} / {fmt_time(state.current.duration)}",
@@ -952,24 +1952,8 @@ def make_embed(state: "MusicState") -> discord.Embed:
     else:
         emb.add_field(name="Now Playing", value="Nothing", inline=False)
 
-    # Up Next
-    queue_list = list(state.queue)
-    if state.current in queue_list:   # どこにあっても 1 回だけ除外
-        queue_list.remove(state.current)
-
-    if queue_list:
-        lines, chars = [], 0
-        for i, tr in enumerate(queue_list, 1):
-            line = f"{num_emoji(i)} {tr.title}"
-            if chars + len(line) + 1 > 800:
-                lines.append(f"…and **{len(queue_list)-i+1}** more")
-                break
-            lines.append(line)
-            chars += len(line) + 1
-        body = "\n".join(lines)
-    else:
-        body = "Empty"
-
+    # Up Next (キュー変更時だけ作り直したキャッシュを使う)
+    body, _ = state.up_next()
     emb.add_field(name="Up Next", value=body, inline=False)
     loop_map = {0: "OFF", 1: "Song", 2: "Queue"}
     footer = f"Loop: {loop_map.get(state.loop, 'OFF')} | Auto Leave: {'ON' if state.auto_leave else 'OFF'}"
@@ -982,6 +1966,7 @@ class ControlView(discord.ui.View):
     def __init__(self, state: "MusicState", vc: discord.VoiceClient, owner_id: int):
         super().__init__(timeout=None)
         self.state, self.vc, self.owner_id = state, vc, owner_id
+        self.entry_ids = tuple(state.up_next()[1])  # 削除ボタンを付けた曲
         self._update_labels()
 
 
@@ -990,6 +1975,11 @@ class ControlView(discord.ui.View):
         labels = {0: "OFF", 1: "Song", 2: "Queue"}
         self.loop_toggle.label = f"🔁 Loop: {labels[self.state.loop]}"
         self.leave_toggle.label = f"👋 Auto Leave: {'ON' if self.state.auto_leave else 'OFF'}"
+        self._shown = (self.state.loop, self.state.auto_leave)
+
+    def key(self) -> tuple:
+        """表示しているボタン構成 (_panel_view_key と比べる)"""
+        return (self.entry_ids, *self._shown, self.vc, self.owner_id)
 
 
     async def interaction_check(self, itx: discord.Interaction) -> bool:
@@ -1005,13 +1995,10 @@ class ControlView(discord.ui.View):
     @discord.ui.button(label="⏭ Skip", style=discord.ButtonStyle.primary)
     async def _skip(self, itx: discord.Interaction, _: discord.ui.Button):
         try:
-            if self.vc.is_playing():
+            if self.vc.is_playing() and not self.state.skip_to_next():
                 self.vc.stop()
             new_view = QueueRemoveView(self.state, self.vc, self.owner_id)
-            await itx.response.edit_message(embed=make_embed(self.state), view=new_view)
-            self.state.queue_msg = itx.message
-
-            self.state.panel_owner = self.owner_id
+            await respond_panel(itx, self.state, new_view, self.owner_id)
         except Exception:
             await itx.response.send_message(
                 "⚠️ この操作パネルは無効です。\n"
@@ -1022,12 +2009,9 @@ class ControlView(discord.ui.View):
     @discord.ui.button(label="🔀 Shuffle", style=discord.ButtonStyle.primary)
     async def _shuffle(self, itx: discord.Interaction, _: discord.ui.Button):
         try:
-            random.shuffle(self.state.queue)
+            self.state.queue.shuffle()
             new_view = QueueRemoveView(self.state, self.vc, self.owner_id)
-            await itx.response.edit_message(embed=make_embed(self.state), view=new_view)
-            self.state.queue_msg = itx.message
-
-            self.state.panel_owner = self.owner_id
+            await respond_panel(itx, self.state, new_view, self.owner_id)
 
         except Exception:
             await itx.response.send_message(
@@ -1042,18 +2026,11 @@ class ControlView(discord.ui.View):
             if self.vc.is_playing():
                 self.vc.pause()
                 self.state.is_paused = True
-                if self.state.start_time is not None:
-                    self.state.pause_offset = time.time() - self.state.start_time
             elif self.vc.is_paused():
                 self.vc.resume()
                 self.state.is_paused = False
-                if self.state.start_time is not None:
-                    self.state.start_time = time.time() - self.state.pause_offset
             new_view = QueueRemoveView(self.state, self.vc, self.owner_id)
-            await itx.response.edit_message(embed=make_embed(self.state), view=new_view)
-            self.state.queue_msg = itx.message
-
-            self.state.panel_owner = self.owner_id
+            await respond_panel(itx, self.state, new_view, self.owner_id)
 
         except Exception:
             await itx.response.send_message(
@@ -1068,9 +2045,7 @@ class ControlView(discord.ui.View):
 
             self.state.loop = (self.state.loop + 1) % 3
             self._update_labels()
-            await itx.response.edit_message(embed=make_embed(self.state), view=self)
-            self.state.queue_msg = itx.message
-            self.state.panel_owner = self.owner_id
+            await respond_panel(itx, self.state, self, self.owner_id)
 
         except Exception:
             await itx.response.send_message(
@@ -1085,9 +2060,7 @@ class ControlView(discord.ui.View):
 
             self.state.auto_leave = not self.state.auto_leave
             self._update_labels()
-            await itx.response.edit_message(embed=make_embed(self.state), view=self)
-            self.state.queue_msg = itx.message
-            self.state.panel_owner = self.owner_id
+            await respond_panel(itx, self.state, self, self.owner_id)
 
         except Exception:
             await itx.response.send_message(
@@ -1099,9 +2072,10 @@ class ControlView(discord.ui.View):
 
 # ──────────── 削除ボタン付き View ──────────
 class RemoveButton(discord.ui.Button):
-    def __init__(self, index: int):
+    def __init__(self, index: int, entry_id: int):
         super().__init__(label=f"🗑 {index}", style=discord.ButtonStyle.danger, row=1 + (index - 1) // 5)
         self.index = index
+        self.entry_id = entry_id  # 表示後にキューがずれても同じ曲を消せるよう ID で持つ
 
     async def callback(self, interaction: discord.Interaction):
         view: QueueRemoveView = self.view  # type: ignore
@@ -1111,33 +2085,24 @@ class RemoveButton(discord.ui.Button):
                 ephemeral=True,
             )
             return
-        base = 1 if view.state.current and view.state.current in view.state.queue else 0
-        remove_index = base + self.index - 1
-        if remove_index >= len(view.state.queue):
+        tr = view.state.queue.remove_id(self.entry_id)
+        if tr is None:
             await interaction.response.send_message(
                 "⚠️ この操作パネルは無効です。\n`y!queue` で再表示してね！",
                 ephemeral=True,
             )
             return
-        tr = list(view.state.queue)[remove_index]
-        del view.state.queue[remove_index]
         cleanup_track(tr)
         new_view = QueueRemoveView(view.state, view.vc, view.owner_id)
-        await interaction.response.edit_message(embed=make_embed(view.state), view=new_view)
-        view.state.queue_msg = interaction.message
-        view.state.panel_owner = view.owner_id
-        await refresh_queue(view.state)
+        await respond_panel(interaction, view.state, new_view, view.owner_id)
 
 
 class QueueRemoveView(ControlView):
     def __init__(self, state: "MusicState", vc: discord.VoiceClient, owner_id: int):
         super().__init__(state, vc, owner_id)
 
-        qlist = list(state.queue)
-        if state.current in qlist:
-            qlist.remove(state.current)
-        for i, _ in enumerate(qlist[:10], 1):
-            self.add_item(RemoveButton(i))
+        for i, eid in enumerate(self.entry_ids, 1):
+            self.add_item(RemoveButton(i, eid))
 
 
 
@@ -1216,7 +2181,17 @@ class HelpView(discord.ui.View):
 # ───────────────── コマンド実装 ─────────────────
 async def cmd_ping(msg: discord.Message):
     ms = client.latency * 1000
-    await msg.channel.send(f"Pong! `{ms:.0f} ms` 🏓")
+    vs = voice_manager.stats()
+    rs = resource_stats()
+    await msg.channel.send(
+        f"Pong! `{ms:.0f} ms` 🏓\n"
+        f"VC: 接続 {vs['connects']} 回 (中央値 `{vs['latency_p50'] * 1000:.0f} ms`,"
+        f" p95 `{vs['latency_p95'] * 1000:.0f} ms`) / 失敗 {vs['failures'] + vs['timeouts']} 回"
+        f" / 再接続 {vs['reconnects']} 回\n"
+        f"資源: 再生状態 {rs['states']} / 音楽タスク {rs['music_tasks']} (全 {rs['tasks']})"
+        f" / 添付 `{rs['audio_bytes'] / 2**20:.1f} MB` / シーク用バッファ `{rs['seek_buffer_bytes'] / 2**20:.1f} MB`"
+        f" / 一時ファイル {rs['temp_files']} 個"
+    )
 
 async def cmd_queue(msg: discord.Message, _):
     state = guild_states.get(msg.guild.id)
@@ -1233,6 +2208,8 @@ async def cmd_queue(msg: discord.Message, _):
 
     state.queue_msg = await msg.channel.send(embed=make_embed(state), view=view)
     state.panel_owner = msg.author.id
+    state.panel_view = view
+    panel.start_progress(state)
 
 
 async def cmd_say(msg: discord.Message, text: str):
@@ -1422,46 +2399,134 @@ async def cmd_dice(msg: discord.Message, nota: str):
 import asyncio
 
 
-class StreamHandler(AssistantEventHandler):
-    def __init__(self, reply_msg):
+class StreamHandler(AsyncAssistantEventHandler):
+    def __init__(self, stream: ReplyStream):
         super().__init__()
         self.buf = ""
-        self.reply_msg = reply_msg
-        self.last_edit = time.monotonic()
+        self.stream = stream
 
-    def on_text_delta(self, delta, *_):
+    async def on_text_delta(self, delta, snapshot):
+        # 編集は ReplyStream が最新の内容だけを順番に反映する
         self.buf += delta.value or ""
-        if time.monotonic() - self.last_edit > 0.5:
-            asyncio.create_task(self.reply_msg.edit(content=self.buf[:1900]))
-            self.last_edit = time.monotonic()
+        self.stream.update(self.buf)
 
 
-async def cmd_gpt(msg: discord.Message, user_text: str):
+def reply_stream(reply: discord.Message) -> ReplyStream:
+    """reply を書き換えながら回答を流す ReplyStream (長くなったら続きを送る)"""
+    async def send(text: str) -> discord.Message:
+        return await reply.channel.send(text)
+
+    async def edit(msg: discord.Message, text: str) -> None:
+        await msg.edit(content=text)
+
+    return ReplyStream(reply, send, edit, limit=1900, min_interval=0.5, max_interval=5.0)
+
+
+# Assistants のスレッドは同時に 1 つの run しか持てないのでチャンネルごとに直列化する
+gpt_channel_locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+gpt_slots = asyncio.Semaphore(GPT_MAX_CONCURRENCY)
+
+
+def _gpt_channel_lock(channel_id: int) -> asyncio.Lock:
+    lock = gpt_channel_locks.get(channel_id)
+    if lock is None:
+        lock = gpt_channel_locks[channel_id] = asyncio.Lock()
+    return lock
+
+
+async def _run_gpt(thread_id: str, user_text: str, handler: StreamHandler) -> None:
+    await openai_async.beta.threads.messages.create(
+        thread_id=thread_id,
+        role="user",
+        content=user_text,
+    )
+    async with openai_async.beta.threads.runs.stream(
+        thread_id=thread_id,
+        assistant_id=ASSISTANT_ID,
+        event_handler=handler,
+    ) as stream:
+        await stream.until_done()
+
+
+async def _delete_thread(thread_id: str) -> None:
+    try:
+        await openai_async.beta.threads.delete(thread_id)
+    except Exception as e:
+        logger.warning("gpt thread delete failed (%s): %s", thread_id, e)
+
+
+async def _gpt_thread(channel_id: int, stale: str | None = None) -> str:
+    """チャンネルのスレッド ID を返す (無ければ作る。stale は消えていたスレッド)"""
+    if stale:
+        await thread_store.forget(channel_id, stale)
+    info = await thread_store.get(channel_id)
+    if info is None:
+        created = (await openai_async.beta.threads.create()).id
+        info = await thread_store.claim(channel_id, created)
+        if info.thread_id != created:
+            await _delete_thread(created)  # 別プロセスが先に作っていた
+    return info.thread_id
+
+
+async def _cancel_run(thread_id: str, handler: StreamHandler) -> None:
+    """打ち切った回答の run をサーバー側でも止める (止めないとスレッドが塞がる)"""
+    run = handler.current_run
+    if run is None:
+        return
+    try:
+        await openai_async.beta.threads.runs.cancel(run.id, thread_id=thread_id)
+    except Exception as e:
+        logger.warning("gpt run cancel failed: %s", e)
+
+
+async def cmd_gpt(msg: discord.Message, user_text: str, context: str = ""):
+    """GPT に質問する (context は返信チェーンなど、質問の前に添える文脈)"""
     if not user_text.strip():
         await msg.reply("質問を書いてね！")
         return
-
-    from thread_store import get, save
-
-    t_id = get(msg.channel.id)
-    if not t_id:
-        t_id = openai_client.beta.threads.create().id
-        save(msg.channel.id, t_id)
-
-    openai_client.beta.threads.messages.create(
-        thread_id=t_id,
-        role="user",
-        content=user_text,
-    )
+    if context:
+        user_text = (
+            "以下はこの発言が返信しているやり取りです (古い順):\n"
+            f"{context}\n\n今の発言:\n{user_text}"
+        )
 
     reply = await msg.reply("…")
-    handler = StreamHandler(reply)
-    with openai_client.beta.threads.runs.stream(
-        thread_id=t_id,
-        assistant_id=ASSISTANT_ID,
-        event_handler=handler,
-    ) as stream:
-        stream.until_done()
+    async with _gpt_channel_lock(msg.channel.id), gpt_slots:
+        t_id = await _gpt_thread(msg.channel.id)
+        stream = reply_stream(reply)
+        handler = StreamHandler(stream)
+        final: str | None = None   # 打ち切ったときに最後に表示する内容
+        try:
+            try:
+                await asyncio.wait_for(_run_gpt(t_id, user_text, handler), GPT_RUN_TIMEOUT)
+            except NotFoundError:
+                if handler.current_run is not None:
+                    raise
+                # 別プロセスが期限切れで削除したスレッドだったので作り直す
+                t_id = await _gpt_thread(msg.channel.id, stale=t_id)
+                await asyncio.wait_for(_run_gpt(t_id, user_text, handler), GPT_RUN_TIMEOUT)
+        except asyncio.TimeoutError:
+            await _cancel_run(t_id, handler)
+            final = (handler.buf + "\n\n⚠️ 時間切れのため回答を打ち切りました").strip()
+        except asyncio.CancelledError:
+            await asyncio.shield(_cancel_run(t_id, handler))
+            final = (handler.buf + "\n\n⚠️ 回答を中断しました").strip()
+            raise
+        finally:
+            # エラーや中断でも途中まで届いた分を反映し、作業タスクも残さない
+            await asyncio.shield(stream.close(final))
+
+        # 回答の各メッセージを文脈キャッシュに載せ、どれに返信されても取り直さずに済むようにする
+        if handler.buf:
+            for m in stream.messages:
+                context_packer.extend(msg.id, make_line(m.id, client.user.display_name, handler.buf))
+        if final is None:
+            usage = getattr(handler.current_run, "usage", None)
+            await thread_store.touch(
+                msg.channel.id,
+                prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+            )
 
 # ──────────── 🎵  コマンド郡 ────────────
 
@@ -1488,7 +2553,7 @@ async def cmd_play(msg: discord.Message, query: str = "", *, first_query: bool =
     if not voice:
         return
 
-    state = guild_states.setdefault(msg.guild.id, MusicState())
+    state = guild_states.setdefault(msg.guild.id, MusicState(msg.guild.id))
 
     if state.playlist_task and not state.playlist_task.done():
         state.playlist_task.cancel()
@@ -1497,8 +2562,16 @@ async def cmd_play(msg: discord.Message, query: str = "", *, first_query: bool =
     tracks_query: list[Track] = []
     tracks_attach: list[Track] = []
 
-    def handle_query() -> None:
+    def replaced() -> bool:
+        """待っている間に y!stop などで state が破棄・作り直しされたか"""
+        return guild_states.get(msg.guild.id) is not state
+
+    async def handle_query() -> None:
         nonlocal playlist_handled, tracks_query
+        if replaced():
+            return
+        # プレイリスト以外の URL / 検索語を集め、まとめて並列に解決する
+        targets: list[str] = []
         for q in queries:
             urls, text_query = parse_urls_and_text(q)
             for u in urls:
@@ -1508,37 +2581,55 @@ async def cmd_play(msg: discord.Message, query: str = "", *, first_query: bool =
                     )
                     playlist_handled = True
                 else:
-                    try:
-                        tracks_query += yt_extract(u)
-                    except Exception:
-                        client.loop.create_task(
-                            msg.reply("URLから曲を取得できませんでした。", delete_after=5)
-                        )
-
+                    targets.append(u)
             if text_query:
-                try:
-                    tracks_query += yt_extract(text_query)
-                except Exception:
-                    client.loop.create_task(
-                        msg.reply("URLから曲を取得できませんでした。", delete_after=5)
-                    )
+                targets.append(text_query)
+
+        if not targets:
+            return
+        # dispose_state の extractor.cancel(state) で CancelledError が届いたらそのまま抜ける
+        results = await extractor.gather(cached_extract, targets, owner=state)
+        for target, res in zip(targets, results):
+            if isinstance(res, BaseException):
+                logger.error("取得失敗 (%s): %s", target, res)
+                client.loop.create_task(
+                    msg.reply("URLから曲を取得できませんでした。", delete_after=5)
+                )
+                continue
+            tracks_query += res
+            for tr in res:
+                remember_track(msg.guild.id, tr)
 
     async def handle_attachments() -> None:
-        nonlocal tracks_attach
         if attachments:
-            try:
-                tracks_attach += await attachments_to_tracks(attachments)
-            except Exception as e:
-                await msg.reply(f"添付ファイル取得エラー: {e}", delete_after=5)
-                raise
+            results = await attachments_to_tracks(attachments)
+            for att, res in zip(attachments, results):
+                if isinstance(res, AudioTooLarge):
+                    await msg.reply(
+                        f"⚠️ `{att.filename}` は大きすぎます（上限 {AUDIO_MAX_FILE_SIZE // 2**20}MB）",
+                        delete_after=5,
+                    )
+                elif isinstance(res, AudioStoreFull):
+                    await msg.reply("⚠️ 保存領域がいっぱいです。キューが減ってから試してね！", delete_after=5)
+                elif isinstance(res, BaseException):
+                    logger.error("添付ファイル取得失敗 (%s): %s", att.filename, res)
+                    await msg.reply(f"添付ファイル取得エラー: {res}", delete_after=5)
+                else:
+                    tracks_attach.append(res)
 
     playlist_handled = False
     if first_query:
-        handle_query()
+        await handle_query()
         await handle_attachments()
     else:
         await handle_attachments()
-        handle_query()
+        await handle_query()
+
+    if replaced():
+        # 破棄された state には積まない (保存した添付の参照も手放す)
+        for tr in tracks_attach:
+            cleanup_track(tr)
+        return
 
     if not tracks_query and not tracks_attach and not playlist_handled:
         return
@@ -1550,53 +2641,96 @@ async def cmd_play(msg: discord.Message, query: str = "", *, first_query: bool =
 
     if tracks:
         state.queue.extend(tracks)
+        if state.current is not None:
+            state.start_prefetch()
         await refresh_queue(state)
         await msg.channel.send(f"⏱️ **{len(tracks)}曲** をキューに追加しました！")
 
 
     # 再生していなければループを起動
-    if state.queue and not voice.is_playing() and not state.play_next.is_set():
-        client.loop.create_task(state.player_loop(voice, msg.channel))
+    if state.queue and not replaced():
+        state.ensure_player(voice, msg.channel)
 
 
 
 
+async def dispose_state(guild_id: int) -> "MusicState | None":
+    """ギルドの MusicState を破棄し、タスク・添付の参照・パネル・保存状態を片付ける"""
+    state = guild_states.pop(guild_id, None)
+    discard_music_state(guild_id)
+    if state is None:
+        return None
+    state.cancel_prefetch()
+    state.cancel_preload()
+    panel.forget(state)
+    extractor.cancel(state)
+    analyzer.cancel(state)
+    for task in (state.playlist_task, state.player_task):
+        if task and not task.done() and task is not asyncio.current_task():
+            task.cancel()
+    cleanup_track(state.current)
+    for tr in state.queue:
+        cleanup_track(tr)
+    state.queue.clear()
+    if state.queue_msg:
+        try:
+            await state.queue_msg.delete()
+        except Exception:
+            pass
+        state.queue_msg = None
+        state.panel_owner = None
+    return state
+
+
 async def cmd_stop(msg: discord.Message, _):
     """Bot を VC から切断し、キュー初期化"""
     if vc := msg.guild.voice_client:
         await vc.disconnect()
-    state = guild_states.pop(msg.guild.id, None)
-    if state:
-        if state.playlist_task and not state.playlist_task.done():
-            state.playlist_task.cancel()
-        cleanup_track(state.current)
-        for tr in state.queue:
-            cleanup_track(tr)
-        if state.queue_msg:
-            try:
-                await state.queue_msg.delete()
-            except Exception:
-                pass
-            state.queue_msg = None
-            state.panel_owner = None
+    await dispose_state(msg.guild.id)
     await msg.add_reaction("⏹️")
 
 
+def parse_queue_ranges(arg: str, limit: int) -> list[tuple[int, int]]:
+    """"1 3 5-8" のような番号指定を 0 始まりの区間 [start, stop) のリストにする
+
+    limit 番より後ろは切り捨て、重なる・隣り合う区間はまとめて昇順で返す。
+    """
+    def num(s: str) -> int:
+        return min(int(s), limit + 1) if len(s) <= 9 else limit + 1
+
+    spans: list[tuple[int, int]] = []
+    for tok in arg.split():
+        m = re.fullmatch(r"(\d+)-(\d+)", tok)
+        if m:
+            lo, hi = sorted((num(m.group(1)), num(m.group(2))))
+        elif tok.isdecimal():
+            lo = hi = num(tok)
+        else:
+            continue
+        lo, hi = max(lo, 1), min(hi, limit)
+        if lo <= hi:
+            spans.append((lo - 1, hi))
+    merged: list[tuple[int, int]] = []
+    for start, stop in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+    return merged
+
+
 async def cmd_remove(msg: discord.Message, arg: str):
     state = guild_states.get(msg.guild.id)
     if not state or not state.queue:
         await msg.reply("キューは空だよ！")
         return
-    nums = [int(x) for x in arg.split() if x.isdecimal()]
-    if not nums:
+    spans = parse_queue_ranges(arg, len(state.queue))
+    if not spans:
         await msg.reply("番号を指定してね！")
         return
-    q = list(state.queue)
     removed = []
-    for i in sorted(set(nums), reverse=True):
-        if 1 <= i <= len(q):
-            removed.append(q.pop(i-1))
-    state.queue = collections.deque(q)
+    for start, stop in reversed(spans):
+        removed += state.queue.delete_range(start, stop)
     for tr in removed:
         cleanup_track(tr)
     await refresh_queue(state)
@@ -1608,19 +2742,17 @@ async def cmd_keep(msg: discord.Message, arg: str):
     if not state or not state.queue:
         await msg.reply("キューは空だよ！")
         return
-    nums = {int(x) for x in arg.split() if x.isdecimal()}
-    if not nums:
+    n = len(state.queue)
+    spans = parse_queue_ranges(arg, n)
+    if not spans:
         await msg.reply("番号を指定してね！")
         return
-    q = list(state.queue)
-    kept = []
+    keep = [i for start, stop in spans for i in range(start, stop)]
+    # 残す番号の間にある区間を後ろからまとめて削除する
+    bounds = [-1] + keep + [n]
     removed = []
-    for i, tr in enumerate(q, 1):
-        if i in nums:
-            kept.append(tr)
-        else:
-            removed.append(tr)
-    state.queue = collections.deque(kept)
+    for lo, hi in reversed(list(zip(bounds, bounds[1:]))):
+        removed += state.queue.delete_range(lo + 1, hi)
     for tr in removed:
         cleanup_track(tr)
     await refresh_queue(state)
@@ -1649,9 +2781,13 @@ async def cmd_seek(msg: discord.Message, arg: str):
         await msg.reply(f"曲の長さは {dur//60}分{dur%60}秒です。短い時間を指定してください")
         return
 
-    state.seek_to = pos
-    state.seeking = True
-    voice.stop()
+    if state.seek_buffered(pos):
+        await refresh_queue(state)
+    else:
+        # バッファの外なので FFmpeg を -ss 付きで起動し直す
+        state.seek_to = pos
+        state.seeking = True
+        voice.stop()
     await msg.channel.send(f"{fmt_time_jp(pos)}から再生します")
 
 
@@ -1673,11 +2809,7 @@ async def cmd_rewind(msg: discord.Message, arg: str):
         await msg.reply("再生中の曲がありません")
         return
 
-    if state.start_time is not None:
-        cur = state.pause_offset if state.is_paused else time.time() - state.start_time
-    else:
-        cur = 0
-    cur = max(0, int(cur))
+    cur = max(0, int(state.position))
     if state.current.duration:
         cur = min(cur, state.current.duration)
 
@@ -1703,11 +2835,7 @@ async def cmd_forward(msg: discord.Message, arg: str):
         await msg.reply("再生中の曲がありません")
         return
 
-    if state.start_time is not None:
-        cur = state.pause_offset if state.is_paused else time.time() - state.start_time
-    else:
-        cur = 0
-    cur = max(0, int(cur))
+    cur = max(0, int(state.position))
     if state.current.duration:
         cur = min(cur, state.current.duration)
         new_pos = min(cur + delta, state.current.duration)
@@ -1717,6 +2845,34 @@ async def cmd_forward(msg: discord.Message, arg: str):
     await cmd_seek(msg, str(new_pos))
 
 
+async def cmd_volume(msg: discord.Message, arg: str):
+    """再生音量を % で指定 (loudness の補正に上乗せされる)"""
+    state = guild_states.get(msg.guild.id)
+    arg = arg.strip().rstrip("%")
+    if not arg:
+        vol = state.volume if state else 100
+        await msg.reply(f"🔊 現在の音量は {vol}% です")
+        return
+    if not arg.isdecimal() or not 0 <= int(arg) <= 200:
+        await msg.reply("音量は 0〜200 の数字で指定してね！ 例：y!volume 80")
+        return
+    if not state:
+        await msg.reply("再生中の曲がありません")
+        return
+    state.volume = int(arg)
+    state.persist()
+    voice = msg.guild.voice_client
+    if state.mixer and state.source and voice and voice.is_connected():
+        # 音量は FFmpeg の volume フィルタで掛けるので、今の位置から起動し直す
+        # (フレームごとに Python で掛けると再生スレッドの CPU を食う)。
+        # 先読みした次の曲も捨て、新しい音量で開き直させる
+        state.mixer.clear_next()
+        state.seek_to = int(state.position)
+        state.seeking = True
+        voice.stop()
+    await msg.channel.send(f"🔊 音量を {state.volume}% にしました")
+
+
 async def cmd_purge(msg: discord.Message, arg: str):
     """指定数またはリンク以降のメッセージを一括削除"""
     if not msg.guild:
@@ -1857,7 +3013,7 @@ async def cmd_qr(msg: discord.Message, text: str) -> None:
     qr.make(fit=True)
     img = qr.make_image(fill_color="black", back_color="white")
 
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
+    tmp = tempfile.NamedTemporaryFile(delete=False, prefix=TEMP_PREFIX, suffix=".png")
     path = tmp.name
     tmp.close()
     await asyncio.to_thread(img.save, path)
@@ -1890,7 +3046,7 @@ async def cmd_barcode(msg: discord.Message, text: str) -> None:
     except IllegalCharacterError:
         await msg.reply("Code128 では英数字など ASCII 文字のみ利用できます。", delete_after=5)
         return
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
+    tmp = tempfile.NamedTemporaryFile(delete=False, prefix=TEMP_PREFIX, suffix=".png")
     path = tmp.name
     tmp.close()
     await asyncio.to_thread(code.write, path)
@@ -1924,7 +3080,7 @@ async def cmd_tex(msg: discord.Message, formula: str) -> None:
     fig = plt.figure()
     fig.text(0.5, 0.5, f"${formula}$", fontsize=20, ha="center", va="center")
     plt.axis("off")
-    tmp = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
+    tmp = tempfile.NamedTemporaryFile(delete=False, prefix=TEMP_PREFIX, suffix=".png")
     path = tmp.name
     tmp.close()
     await asyncio.to_thread(fig.savefig, path, bbox_inches="tight", pad_inches=0.2)
@@ -1959,20 +3115,215 @@ async def on_voice_state_update(member, before, after):
         try:
             await voice.disconnect()
         finally:
-            st = guild_states.pop(member.guild.id, None)
-            if st:
-                if st.playlist_task and not st.playlist_task.done():
-                    st.playlist_task.cancel()
-                cleanup_track(st.current)
-                for tr in st.queue:
-                    cleanup_track(tr)
-                if st.queue_msg:
-                    try:
-                        await st.queue_msg.delete()
-                    except Exception:
-                        pass
-                    st.queue_msg = None
-                    st.panel_owner = None
+            await dispose_state(member.guild.id)
+
+
+# ──────────── 🎵  再起動後の再開 ────────────
+MUSIC_RESTORE_GAP = 1.0  # ギルドごとの再接続の間隔 (秒)
+restore_task: asyncio.Task | None = None
+position_task: asyncio.Task | None = None
+
+
+def _release_snapshot(snap: dict) -> None:
+    """復元しなかったスナップショットが持つ添付の参照を手放す"""
+    for data in [snap.get("current"), *snap.get("queue", [])]:
+        if data:
+            cleanup_track(track_from_dict(data))
+
+
+async def _restore_music_state(guild_id: int, snap: dict) -> bool:
+    """保存した状態から VC に入り直し、保存時の位置から再生を再開する"""
+    guild = client.get_guild(guild_id)
+    if guild is None or guild_id in guild_states:
+        return False
+    voice_ch = guild.get_channel(snap.get("voice_channel") or 0)
+    text_ch = guild.get_channel_or_thread(snap.get("text_channel") or 0)
+    if not isinstance(voice_ch, (discord.VoiceChannel, discord.StageChannel)) or text_ch is None:
+        return False
+    if snap.get("auto_leave", True) and not any(not m.bot for m in voice_ch.members):
+        return False  # 聞いている人がいなければ戻らない
+
+    state = MusicState(guild_id)
+    state.loop = snap.get("loop", 0)
+    state.auto_leave = snap.get("auto_leave", True)
+    state.volume = snap.get("volume", 100)
+    # 再起動の間に消えた添付 (OS の一時ディレクトリ掃除など) は飛ばす
+    def usable(tr: Track) -> bool:
+        return not tr.stored or tr.url in audio_store
+
+    current = track_from_dict(snap["current"]) if snap.get("current") else None
+    tracks = [tr for tr in (track_from_dict(d) for d in snap.get("queue", []) if d) if usable(tr)]
+    if current is not None and usable(current):
+        state.current = current
+        state.seek_to = int(snap.get("position") or 0) or None
+        state.seeking = True  # 「Now playing」を出さずに続きから流す
+    elif not tracks:
+        return False
+    # 再生中の曲を戻せなければ、保存位置は使わずキューの先頭から流す
+    state.queue.extend(tracks)
+
+    if voice_manager.suppressed(guild_id):
+        return False
+    voice = await connect_voice(voice_ch)
+    if msg_id := snap.get("panel_message"):
+        try:
+            state.queue_msg = await text_ch.fetch_message(msg_id)
+            state.panel_owner = snap.get("panel_owner")
+        except discord.HTTPException:
+            pass
+    guild_states[guild_id] = state
+    state.ensure_player(voice, text_ch)
+    await refresh_queue(state)
+    return True
+
+
+async def restore_music_states() -> None:
+    """前回終了時に再生していたギルドを順に再開する"""
+    global saved_states
+    pending, saved_states = saved_states, {}
+    for key, snap in pending.items():
+        try:
+            restored = await _restore_music_state(int(key), snap)
+        except Exception as e:
+            logger.warning("music state restore failed (%s): %s", key, e)
+            restored = False
+        if not restored:
+            discard_music_state(key)
+            _release_snapshot(snap)
+            continue
+        logger.info("music state restored: guild %s", key)
+        await asyncio.sleep(MUSIC_RESTORE_GAP)
+
+
+async def save_music_positions() -> None:
+    """再生中のギルドの再生位置を定期的に保存する (小さな位置の記録だけを書き直す)"""
+    while True:
+        await asyncio.sleep(MUSIC_STATE_POSITION_INTERVAL)
+        for state in list(guild_states.values()):
+            if state.source is not None and not state.is_paused:
+                state.persist_position()
+
+
+# ──────────── 🧹  資源の回収 ────────────
+REAPER_INTERVAL = 60.0      # 点検の間隔 (秒)
+TEMP_MAX_AGE = 3600.0       # これより古い一時ファイル (TEMP_PREFIX) は消す
+reaper_task: asyncio.Task | None = None
+reaper_stats = {
+    "temp_files": 0,        # 一時ファイルの数 (最後の点検時)
+    "temp_bytes": 0,
+    "reclaimed_states": 0,  # 以下は起動からの累計
+    "reclaimed_refs": 0,
+    "reclaimed_files": 0,
+    "expired_threads": 0,
+}
+
+
+def _state_orphaned(guild_id: int, state: "MusicState") -> bool:
+    """再生も読み込みもしておらず、VC にも居ない (または空のまま居残っている) か"""
+    if any(t and not t.done() for t in (state.player_task, state.playlist_task)):
+        return False
+    guild = client.get_guild(guild_id)
+    vc = guild.voice_client if guild else None
+    if vc is None or not vc.is_connected():
+        return True
+    return state.current is None and not state.queue and not vc.is_playing()
+
+
+def _live_audio_paths() -> set[str]:
+    """キュー (と復元待ちのスナップショット) が使っている添付のパス"""
+    paths = {tr.url for st in guild_states.values()
+             for tr in [st.current, *st.queue] if tr and tr.stored}
+    for snap in saved_states.values():
+        paths.update(t["url"] for t in [snap.get("current") or {}, *snap.get("queue", [])]
+                     if t.get("stored"))
+    return paths
+
+
+def _sweep_temp_files(now: float) -> tuple[int, int, int]:
+    """古い一時ファイルを消し、(削除数, 残りの数, 残りのバイト数) を返す"""
+    removed = count = size = 0
+    with os.scandir(tempfile.gettempdir()) as it:
+        for ent in it:
+            if not ent.name.startswith(TEMP_PREFIX) or not ent.is_file(follow_symlinks=False):
+                continue
+            try:
+                st = ent.stat(follow_symlinks=False)
+                if now - st.st_mtime > TEMP_MAX_AGE:
+                    os.remove(ent.path)
+                    removed += 1
+                    continue
+            except OSError:
+                continue
+            count += 1
+            size += st.st_size
+    return removed, count, size
+
+
+async def _reap_once(suspects: set, audio_suspects: set[str]) -> tuple[set, set[str]]:
+    """1 回分の点検。2 回続けて持ち主の無かったものだけを回収する
+
+    (コマンド処理の途中でまだキューに入っていない状態・添付を誤って消さないため)
+    """
+    orphans = {gid for gid, st in guild_states.items() if _state_orphaned(gid, st)}
+    for gid in orphans & suspects:
+        guild = client.get_guild(gid)
+        if guild and guild.voice_client:
+            try:
+                await guild.voice_client.disconnect(force=True)
+            except Exception as e:
+                logger.warning("reaper: disconnect failed (%s): %s", gid, e)
+        if await dispose_state(gid):
+            reaper_stats["reclaimed_states"] += 1
+            logger.info("reaper: reclaimed idle music state of guild %s", gid)
+
+    live = set(guild_states.values())
+    for key in panel.tracked() - live:
+        panel.forget(key)
+
+    stray = audio_store.held() - _live_audio_paths()
+    for path in stray & audio_suspects:
+        if audio_store.release_all(path):
+            reaper_stats["reclaimed_refs"] += 1
+            logger.info("reaper: released orphaned audio %s", path)
+
+    for tid in await thread_store.expire():
+        await _delete_thread(tid)
+        reaper_stats["expired_threads"] += 1
+
+    removed, count, size = await asyncio.to_thread(_sweep_temp_files, time.time())
+    reaper_stats["reclaimed_files"] += removed
+    reaper_stats["temp_files"] = count
+    reaper_stats["temp_bytes"] = size
+    return orphans - suspects, stray - audio_suspects
+
+
+async def reap_resources() -> None:
+    """guild_states・添付ストア・一時ファイルを定期的に点検して取り残しを回収する"""
+    suspects: set = set()
+    audio_suspects: set[str] = set()
+    while True:
+        await asyncio.sleep(REAPER_INTERVAL)
+        try:
+            suspects, audio_suspects = await _reap_once(suspects, audio_suspects)
+        except Exception as e:
+            logger.warning("reaper failed: %s", e)
+
+
+def resource_stats() -> dict[str, int]:
+    """稼働中の状態・タスク数とディスク使用量"""
+    music_tasks = sum(
+        1 for st in guild_states.values()
+        for t in (st.player_task, st.playlist_task, st.prefetch_task, st.preload_task)
+        if t and not t.done()
+    )
+    return {
+        "states": len(guild_states),
+        "music_tasks": music_tasks,
+        "tasks": len(asyncio.all_tasks()),
+        "audio_bytes": audio_store.total_bytes,
+        "seek_buffer_bytes": seek_budget.used,
+        **reaper_stats,
+    }
 
 
 
@@ -2540,6 +3891,9 @@ async def on_ready():
     except Exception as e:
         logger.error("Slash command sync failed: %s", e)
     logger.info("LOGIN: %s", client.user)
+    for m in sorted(client.cached_messages, key=lambda m: m.id):
+        if m.id not in reply_index:
+            index_message(m)
     global news_task
     if news_task is None or news_task.done():
         news_task = asyncio.create_task(hourly_news())
@@ -2549,6 +3903,15 @@ async def on_ready():
     global weather_task
     if weather_task is None or weather_task.done():
         weather_task = asyncio.create_task(scheduled_weather())
+    global restore_task
+    if restore_task is None:  # 再接続で on_ready が再び呼ばれても 1 回だけ
+        restore_task = asyncio.create_task(restore_music_states())
+    global position_task
+    if position_task is None or position_task.done():
+        position_task = asyncio.create_task(save_music_positions())
+    global reaper_task
+    if reaper_task is None or reaper_task.done():
+        reaper_task = asyncio.create_task(reap_resources())
 
 # ----- Slash command wrappers -----
 @tree.command(name="ping", description="Botの応答速度を表示")
@@ -2798,6 +4161,19 @@ async def sc_play(
         await itx.followup.send(f"エラー発生: {e}")
 
 
+@sc_play.autocomplete("query1")
+@sc_play.autocomplete("query2")
+@sc_play.autocomplete("query3")
+async def play_autocomplete(itx: discord.Interaction, current: str) -> list[app_commands.Choice[str]]:
+    """このサーバーで再生した曲名から候補を返す (yt-dlp は使わない)"""
+    if itx.guild_id is None or is_http_url(current.strip()):
+        return []
+    return [
+        app_commands.Choice(name=title[:100], value=value)
+        for title, value in title_index.search(itx.guild_id, current, limit=25)
+    ]
+
+
 
 @tree.command(name="queue", description="再生キューを表示")
 async def sc_queue(itx: discord.Interaction):
@@ -2811,7 +4187,7 @@ async def sc_queue(itx: discord.Interaction):
 
 
 @tree.command(name="remove", description="キューから曲を削除")
-@app_commands.describe(numbers="削除する番号 (スペース区切り)")
+@app_commands.describe(numbers="削除する番号 (スペース区切り, 2-5 で範囲指定)")
 async def sc_remove(itx: discord.Interaction, numbers: str):
 
     try:
@@ -2823,7 +4199,7 @@ async def sc_remove(itx: discord.Interaction, numbers: str):
 
 
 @tree.command(name="keep", description="指定番号以外を削除")
-@app_commands.describe(numbers="残す番号 (スペース区切り)")
+@app_commands.describe(numbers="残す番号 (スペース区切り, 2-5 で範囲指定)")
 async def sc_keep(itx: discord.Interaction, numbers: str):
 
     try:
@@ -2866,6 +4242,17 @@ async def sc_forward(itx: discord.Interaction, time: str | None = None):
         await itx.followup.send(f"エラー発生: {e}")
 
 
+@tree.command(name="volume", description="再生音量を変更")
+@app_commands.describe(percent="0〜200 (省略すると現在の音量を表示)")
+async def sc_volume(itx: discord.Interaction, percent: app_commands.Range[int, 0, 200] | None = None):
+
+    try:
+        await itx.response.defer()
+        await cmd_volume(SlashMessage(itx), "" if percent is None else str(percent))
+    except Exception as e:
+        await itx.followup.send(f"エラー発生: {e}")
+
+
 @tree.command(name="purge", description="メッセージを一括削除")
 @app_commands.describe(arg="削除数またはメッセージリンク")
 async def sc_purge(itx: discord.Interaction, arg: str):
@@ -3209,6 +4596,122 @@ def flag_to_iso(emoji: str) -> str | None:
     except:
         return None
 
+TRANSLATION_CACHE_SIZE = 1024   # 覚えておく訳文の数
+TRANSLATION_BATCH_WINDOW = 1.5  # 同じメッセージへの国旗をまとめて訳すまでの待ち時間 (秒)
+TRANSLATION_POSTS_MAX = 256     # 訳文を書き足していく返信を覚えておく数
+
+TRANSLATION_FORMAT = {
+    "type": "json_schema",
+    "name": "translations",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "translations": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "target": {"type": "integer"},
+                        "text": {"type": "string"},
+                    },
+                    "required": ["target", "text"],
+                    "additionalProperties": False,
+                },
+            },
+        },
+        "required": ["translations"],
+        "additionalProperties": False,
+    },
+}
+
+
+async def _translate_batch(text: str, targets: list[tuple[str, str]]) -> dict[tuple[str, str], str]:
+    """本文を複数の言語へ 1 回のリクエストで訳す"""
+    listing = "\n".join(
+        f"{i}: {lang} (regional variant indicated by the flag {flag})"
+        for i, (lang, flag) in enumerate(targets)
+    )
+    resp = await openai_async.responses.create(
+        model="gpt-4.1",
+        instructions=(
+            "Translate the user's message into each of the following targets, considering the regional variant "
+            "indicated by each flag. Keep every translation concise and return one entry per target number.\n"
+            + listing
+        ),
+        input=text,
+        temperature=0.3,
+        text={"format": TRANSLATION_FORMAT},
+    )
+    out: dict[tuple[str, str], str] = {}
+    for item in json.loads(resp.output_text)["translations"]:
+        if 0 <= item["target"] < len(targets) and item["text"].strip():
+            out[targets[item["target"]]] = item["text"].strip()
+    return out
+
+
+translator = Translator(_translate_batch, window=TRANSLATION_BATCH_WINDOW,
+                        max_entries=TRANSLATION_CACHE_SIZE)
+
+
+@dataclass
+class TranslationPost:
+    """1 つのメッセージへの訳文をまとめた返信"""
+    reply: discord.Message | None = None
+    source: str = ""   # sections を訳した本文の content_key
+    sections: dict[tuple[str, str], str] = field(default_factory=dict)
+    shown: str = ""
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+
+translation_posts: collections.OrderedDict[int, TranslationPost] = collections.OrderedDict()
+
+
+async def post_translation(message: discord.Message, original: str, lang: str, flag: str, text: str):
+    """original の訳文をメッセージへの返信 1 通に書き足す (既に載っていれば何もしない)
+
+    元のメッセージが編集されていたら、古い本文の訳は捨てて載せ直す。
+    """
+    post = translation_posts.get(message.id)
+    if post is None:
+        post = translation_posts[message.id] = TranslationPost()
+        while len(translation_posts) > TRANSLATION_POSTS_MAX:
+            translation_posts.popitem(last=False)
+    translation_posts.move_to_end(message.id)
+    source = content_key(original)
+    if post.source != source:
+        post.source = source
+        post.sections.clear()
+    post.sections[(lang, flag)] = text
+    async with post.lock:
+        # 同じバッチの訳文は先に全部 sections に入るので、編集は最小限で済む
+        content = combine_translations(
+            [(f"💬 {f} **{l}** translation:", t) for (l, f), t in post.sections.items()])
+        if content == post.shown:
+            return
+        if post.reply is not None:
+            try:
+                await post.reply.edit(content=content)
+                post.shown = content
+                return
+            except discord.NotFound:
+                post.reply = None  # 返信が消されていたら出し直す
+        post.reply = await message.reply(content, mention_author=False)
+        post.shown = content
+
+
+async def _reaction_message(payload: discord.RawReactionActionEvent) -> discord.Message:
+    """リアクションされたメッセージ (ゲートウェイのキャッシュにあれば REST を使わない)
+
+    reply_index に残っている Message は編集されても更新されないので、訳す本文には使わない。
+    """
+    msg = discord.utils.get(client.cached_messages, id=payload.message_id)
+    if msg is not None:
+        return msg
+    channel = client.get_channel(payload.channel_id) or await client.fetch_channel(payload.channel_id)
+    return await channel.fetch_message(payload.message_id)
+
+
 @client.event
 async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
     """メッセージに付いた国旗リアクションで自動翻訳"""
@@ -3230,35 +4733,20 @@ async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
         logger.debug("未登録 ISO: %s", iso)
         return
 
-    # 4. 元メッセージ取得
-    channel  = await client.fetch_channel(payload.channel_id)
-    message  = await channel.fetch_message(payload.message_id)
+    # 4. 元メッセージ取得 (キャッシュ優先)
+    message  = await _reaction_message(payload)
+    channel  = message.channel
     original = message.content.strip()
     if not original:
         return
 
-    # 5. GPT-4.1 で翻訳
+    # 5. GPT-4.1 で翻訳 (続けて付いた国旗はまとめて 1 回で訳し、同じ訳は使い回す)
     async with channel.typing():
         try:
-            resp = openai_client.responses.create(
-                model="gpt-4.1",
-                instructions=(
-                    f"Translate the following message into {lang}, considering the regional variant indicated by this flag {emoji}. "
-                    f"Provide only the translation, and keep it concise."
-                ),
-                input=original,
-                temperature=0.3,
-            )
-            translated = resp.output_text.strip()
-
-            # 6. Discord 2000 文字制限に合わせて 1 通で送信
-            header     = f"💬 **{lang}** translation:\n"
-            available  = 2000 - len(header)
-            if len(translated) > available:
-                # ヘッダーを含めて 2000 文字ちょうどになるように丸める
-                translated = translated[:available - 3] + "..."
+            translated = await translator.translate(message.id, original, lang, emoji)
 
-            await channel.send(header + translated)
+            # 6. 言語ごとの訳文を 1 通の返信にまとめる (2000 文字に収める)
+            await post_translation(message, original, lang, emoji, translated)
 
         except Exception as e:
             # 失敗したらメッセージ主へリプライ（失敗した場合はチャンネルに通知）
@@ -3271,6 +4759,12 @@ async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
 
 @client.event
 async def on_message(msg: discord.Message):
+    # Bot 自身の発言も含めて返信索引に載せておく
+    index_message(msg)
+    # Bot 自身の発言 (回答の「…」など) は cmd_gpt が書き終えてから載せる
+    if msg.reference and msg.reference.message_id and msg.author != client.user:
+        context_packer.extend(msg.reference.message_id, chat_line(msg))
+
     # ① Bot の発言は無視
     if msg.author.bot:
         return
@@ -3329,6 +4823,7 @@ async def on_message(msg: discord.Message):
     elif cmd == "seek": await cmd_seek(msg, arg)
     elif cmd == "rewind": await cmd_rewind(msg, arg)
     elif cmd == "forward": await cmd_forward(msg, arg)
+    elif cmd == "volume": await cmd_volume(msg, arg)
     elif cmd == "server": await cmd_server(msg)
     elif cmd == "purge":await cmd_purge(msg, arg)
     elif cmd == "qr": await cmd_qr(msg, arg)
@@ -3342,12 +4837,10 @@ async def on_message(msg: discord.Message):
 
     else:
         mention = client.user and any(m.id == client.user.id for m in msg.mentions)
-        history = await _gather_reply_chain(msg)
-        replied = any(m.author.id == client.user.id for m in history)
-        if mention or replied:
+        if mention or await replies_to_bot(msg):
             text = _strip_bot_mention(msg.content)
             if text:
-                await cmd_gpt(msg, text)
+                await cmd_gpt(msg, text, await reply_context(msg))
 
 
 # ───────────────── 起動 ─────────────────
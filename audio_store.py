@@ -0,0 +1,244 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from typing import AsyncIterable, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class AudioTooLarge(Exception):
+    """ファイルサイズが上限を超えた"""
+
+
+class AudioStoreFull(Exception):
+    """再生中のファイルだけでディスク予算を使い切っている"""
+
+
+class AudioStore:
+    """添付音源を内容のハッシュで保存する参照カウント付きストア
+
+    - 同じ添付 (``key``) や同じ内容のファイルは 1 つだけ保存し、パスを共有する
+    - ``store`` / ``retain`` で参照を 1 つ増やし、``release`` で減らす
+    - 参照が 0 になったファイルは待機リストへ移り、``idle_limit`` バイトを超えた分と
+      ディスク予算 ``budget`` を超えた分を古い順 (LRU) に削除する
+      (既定の ``idle_limit=0`` ではどのキューからも使われなくなった時点で削除)
+    - ``keep`` に渡したパスは起動時に出現回数だけ参照を持った状態で取り込む
+      (再起動前のキューを復元するため)
+    """
+
+    def __init__(self, root: str, *, max_file_size: int = 100 * 2**20,
+                 budget: int = 2 * 2**30, idle_limit: int = 0,
+                 keep: Iterable[str] = ()):
+        self.root = root
+        self.max_file_size = max_file_size
+        self.budget = budget
+        self.idle_limit = idle_limit
+        self._lock = threading.Lock()
+        self._refs: dict[str, int] = {}                    # digest -> 参照数
+        self._sizes: dict[str, int] = {}                   # digest -> バイト数
+        self._paths: dict[str, str] = {}                   # digest -> パス
+        self._by_path: dict[str, str] = {}                 # パス -> digest
+        self._aliases: dict[str, str] = {}                 # key -> digest
+        self._idle: collections.OrderedDict[str, None] = collections.OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+        os.makedirs(root, exist_ok=True)
+        self._scan(collections.Counter(keep))
+
+    # ---- 参照 ----
+    @property
+    def total_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    @property
+    def idle_bytes(self) -> int:
+        return sum(self._sizes[d] for d in self._idle)
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._by_path
+
+    def lookup(self, key: str) -> str | None:
+        """key のファイルが保存済みなら参照を 1 つ増やしてパスを返す"""
+        with self._lock:
+            digest = self._aliases.get(key)
+            if digest is None or digest not in self._paths:
+                return None
+            self._retain_locked(digest)
+            return self._paths[digest]
+
+    def retain(self, path: str) -> bool:
+        with self._lock:
+            digest = self._by_path.get(path)
+            if digest is None:
+                return False
+            self._retain_locked(digest)
+            return True
+
+    def release(self, path: str) -> bool:
+        """参照を 1 つ減らす (ストア外のパスなら False)"""
+        with self._lock:
+            digest = self._by_path.get(path)
+            if digest is None:
+                return False
+            n = self._refs.get(digest, 0) - 1
+            if n > 0:
+                self._refs[digest] = n
+            else:
+                self._refs.pop(digest, None)
+                self._idle[digest] = None
+                self._idle.move_to_end(digest)
+                self._evict_locked(0)
+            return True
+
+    def held(self) -> set[str]:
+        """参照を持たれているファイルのパス"""
+        with self._lock:
+            return {self._paths[d] for d in self._refs if d in self._paths}
+
+    def release_all(self, path: str) -> bool:
+        """path の参照をすべて手放す (持ち主が居なくなった参照の回収用)"""
+        with self._lock:
+            digest = self._by_path.get(path)
+            if digest is None or digest not in self._refs:
+                return False
+            del self._refs[digest]
+            self._idle[digest] = None
+            self._evict_locked(0)
+            return True
+
+    # ---- 保存 ----
+    async def store(self, key: str, chunks: AsyncIterable[bytes], *,
+                    suffix: str = "", size: int | None = None) -> str:
+        """chunks を保存して参照付きのパスを返す
+
+        同じ key のダウンロードが進行中ならそれを待って結果を共有する。
+        """
+        if size is not None and size > self.max_file_size:
+            raise AudioTooLarge(f"{size} bytes > {self.max_file_size} bytes")
+        path = self.lookup(key)
+        if path:
+            return path
+        fut = self._inflight.get(key)
+        if fut is not None:
+            try:
+                await asyncio.shield(fut)
+            except asyncio.CancelledError:
+                if not fut.cancelled():
+                    raise
+                # 先行ダウンロードが中断されたので自分で取り直す
+                return await self.store(key, chunks, suffix=suffix, size=size)
+            path = self.lookup(key)
+            if path:
+                return path
+            raise FileNotFoundError(key)
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            path = await self._download(key, chunks, suffix, size)
+            fut.set_result(path)
+            return path
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # 待ち手がいなくても警告を出さない
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def _download(self, key: str, chunks: AsyncIterable[bytes],
+                        suffix: str, size: int | None) -> str:
+        with self._lock:
+            self._evict_locked(size or 0)
+            if size is not None and self._pinned_bytes_locked() + size > self.budget:
+                raise AudioStoreFull(f"disk budget {self.budget} bytes exhausted")
+        part = os.path.join(self.root, f".part-{uuid.uuid4().hex}")
+        h = hashlib.sha256()
+        written = 0
+        try:
+            with open(part, "wb") as f:
+                async for chunk in chunks:
+                    written += len(chunk)
+                    if written > self.max_file_size:
+                        raise AudioTooLarge(f"> {self.max_file_size} bytes")
+                    h.update(chunk)
+                    await asyncio.to_thread(f.write, chunk)
+            digest = h.hexdigest()
+            with self._lock:
+                if digest in self._paths:
+                    # 別の添付と内容が同じなら既存ファイルを使う
+                    os.remove(part)
+                else:
+                    path = os.path.join(self.root, digest + suffix.lower()[:16])
+                    os.replace(part, path)
+                    self._paths[digest] = path
+                    self._by_path[path] = digest
+                    self._sizes[digest] = written
+                self._aliases[key] = digest
+                self._retain_locked(digest)
+                self._evict_locked(0)
+                return self._paths[digest]
+        except BaseException:
+            try:
+                os.remove(part)
+            except FileNotFoundError:
+                pass
+            raise
+
+    # ---- 内部 ----
+    def _retain_locked(self, digest: str) -> None:
+        self._refs[digest] = self._refs.get(digest, 0) + 1
+        self._idle.pop(digest, None)
+
+    def _pinned_bytes_locked(self) -> int:
+        return sum(self._sizes[d] for d in self._refs)
+
+    def _evict_locked(self, incoming: int) -> None:
+        idle = self.idle_bytes
+        total = self.total_bytes
+        while self._idle and (idle > self.idle_limit or total + incoming > self.budget):
+            digest, _ = self._idle.popitem(last=False)
+            size = self._sizes.pop(digest, 0)
+            path = self._paths.pop(digest)
+            self._by_path.pop(path, None)
+            for k in [k for k, d in self._aliases.items() if d == digest]:
+                del self._aliases[k]
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning("audio store: failed to remove %s: %s", path, e)
+            idle -= size
+            total -= size
+
+    def _scan(self, keep: collections.Counter[str]) -> None:
+        """前回起動時のファイルを取り込む (keep 以外は待機リスト、途中ファイルは削除)"""
+        entries = []
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if not os.path.isfile(path):
+                continue
+            if name.startswith(".part-"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            st = os.stat(path)
+            entries.append((st.st_mtime, name.split(".", 1)[0], path, st.st_size))
+        for _, digest, path, size in sorted(entries):
+            self._paths[digest] = path
+            self._by_path[path] = digest
+            self._sizes[digest] = size
+            if keep[path]:
+                self._refs[digest] = keep[path]
+            else:
+                self._idle[digest] = None
+        with self._lock:
+            self._evict_locked(0)
@@ -0,0 +1,87 @@
+from __future__ import annotations
+
+import collections
+import math
+from typing import NamedTuple, Sequence
+
+
+def estimate_tokens(text: str) -> int:
+    """トークン数のざっくりした見積もり (tokenizer を使わない高速版)
+
+    ASCII は 4 文字で 1 トークン、それ以外 (かな・漢字・絵文字など) は 1 文字
+    1 トークンとして数える。実際より少し多めに出るので予算超過を防げる。
+    """
+    ascii_chars = sum(1 for c in text if c < "\x80")
+    return (len(text) - ascii_chars) + math.ceil(ascii_chars / 4)
+
+
+class Line(NamedTuple):
+    message_id: int
+    text: str
+    tokens: int
+
+
+def make_line(message_id: int, author: str, content: str, attachments: Sequence[str] = (),
+              max_chars: int = 1000) -> Line:
+    """1 メッセージを「名前: 本文 [添付: ファイル名]」の 1 行にする"""
+    body = " ".join(content.split())
+    if len(body) > max_chars:
+        body = body[:max_chars - 1] + "…"
+    if attachments:
+        body = f"{body} [添付: {', '.join(attachments)}]".strip()
+    text = f"{author}: {body}"
+    return Line(message_id, text, estimate_tokens(text) + 1)  # +1 は改行の分
+
+
+class ContextPacker:
+    """返信チェーンを token 予算内の文脈テキストにまとめる
+
+    チェーンの末尾メッセージ ID ごとに、予算内に詰めた行のタプルを ``max_chains``
+    件までキャッシュする。続きの返信は親のキャッシュに 1 行足すだけなので、
+    チェーンを取り直したり全体を数え直したりしない。予算を超えたら古い行から落とす。
+    """
+
+    def __init__(self, budget: int = 1500, max_chains: int = 256):
+        self.budget = budget
+        self.max_chains = max_chains
+        self._chains: collections.OrderedDict[int, tuple[Line, ...]] = collections.OrderedDict()
+
+    def lines(self, tip_id: int) -> tuple[Line, ...] | None:
+        """tip_id で終わるチェーンの詰め済みの行 (キャッシュに無ければ None)"""
+        lines = self._chains.get(tip_id)
+        if lines is not None:
+            self._chains.move_to_end(tip_id)
+        return lines
+
+    def build(self, chain: list[Line]) -> tuple[Line, ...]:
+        """古い順のチェーン全体を詰めて、途中の各メッセージの分もキャッシュする"""
+        packed: tuple[Line, ...] = ()
+        for line in chain:
+            packed = self._store(line.message_id, self._trim(packed + (line,)))
+        return packed
+
+    def extend(self, parent_id: int, line: Line) -> tuple[Line, ...] | None:
+        """親のチェーンがキャッシュにあれば line を足して登録する (無ければ None)"""
+        parent = self._chains.get(parent_id)
+        if parent is None:
+            return None
+        return self._store(line.message_id, self._trim(parent + (line,)))
+
+    @staticmethod
+    def render(lines: tuple[Line, ...]) -> str:
+        return "\n".join(line.text for line in lines)
+
+    def _trim(self, lines: tuple[Line, ...]) -> tuple[Line, ...]:
+        total = sum(line.tokens for line in lines)
+        start = 0
+        while total > self.budget and start < len(lines):
+            total -= lines[start].tokens
+            start += 1
+        return lines[start:]
+
+    def _store(self, tip_id: int, lines: tuple[Line, ...]) -> tuple[Line, ...]:
+        self._chains[tip_id] = lines
+        self._chains.move_to_end(tip_id)
+        while len(self._chains) > self.max_chains:
+            self._chains.popitem(last=False)
+        return lines
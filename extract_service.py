@@ -0,0 +1,82 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, Iterable
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractService:
+    """yt-dlp などのブロッキング処理を専用スレッドプールで実行する
+
+    - ``max_workers`` 本のワーカーで同時実行数を制限
+    - 1 リクエストごとに ``timeout`` 秒で打ち切り
+    - ``owner`` (MusicState など) 単位でまとめてキャンセル可能
+    """
+
+    def __init__(self, max_workers: int = 4, timeout: float = 30.0):
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="yone-extract"
+        )
+        self._owners: dict[Hashable, set[asyncio.Future]] = {}
+
+    async def run(self, func: Callable[..., Any], *args: Any,
+                  owner: Hashable | None = None,
+                  timeout: float | None = None) -> Any:
+        """``func(*args)`` をワーカーで実行して結果を返す
+
+        タイムアウト時は ``asyncio.TimeoutError``、``cancel(owner)`` された場合は
+        ``asyncio.CancelledError`` を送出する。
+        """
+        loop = asyncio.get_running_loop()
+        fut = loop.run_in_executor(self._executor, func, *args)
+        if owner is not None:
+            self._owners.setdefault(owner, set()).add(fut)
+        try:
+            return await asyncio.wait_for(fut, timeout or self.timeout)
+        finally:
+            if owner is not None:
+                futs = self._owners.get(owner)
+                if futs is not None:
+                    futs.discard(fut)
+                    if not futs:
+                        self._owners.pop(owner, None)
+
+    async def gather(self, func: Callable[[Any], Any], items: Iterable[Any], *,
+                     owner: Hashable | None = None,
+                     timeout: float | None = None) -> list[Any]:
+        """``items`` の各要素に ``func`` を並列適用し、入力順で結果を返す
+
+        失敗した要素は例外オブジェクトがそのまま入る。
+        """
+        tasks = [self.run(func, item, owner=owner, timeout=timeout) for item in items]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        for res in results:
+            if isinstance(res, asyncio.CancelledError):
+                raise res
+        return results
+
+    def cancel(self, owner: Hashable) -> int:
+        """``owner`` に紐づく実行中/待機中のリクエストをキャンセルし件数を返す
+
+        既にワーカーで走っている処理は止められないが、待っている側には即座に
+        ``CancelledError`` が届き、未着手のものは実行されない。
+        """
+        futs = self._owners.pop(owner, set())
+        for fut in futs:
+            fut.cancel()
+        return len(futs)
+
+    def pending(self, owner: Hashable | None = None) -> int:
+        """未完了リクエスト数 (owner 指定時はその owner のみ)"""
+        if owner is not None:
+            return len(self._owners.get(owner, ()))
+        return sum(len(f) for f in self._owners.values())
+
+    def shutdown(self) -> None:
+        for owner in list(self._owners):
+            self.cancel(owner)
+        self._executor.shutdown(wait=False, cancel_futures=True)
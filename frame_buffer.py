@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import collections
+import logging
+import mmap
+import threading
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+FRAME_SECONDS = 0.02  # discord.py は 20ms ごとに 1 フレーム読む
+
+
+class BufferBudget:
+    """複数の FrameBuffer で共有するメモリの上限
+
+    ``acquire`` は上限の残りから ``want`` バイトまで割り当てる。残りが足りなければ
+    小さくして渡すが、再生が止まらないよう ``minimum`` だけは上限を超えても渡す。
+    読み込みスレッドからも解放されるのでロックで守る。
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, want: int, minimum: int) -> int:
+        with self._lock:
+            size = max(minimum, min(want, self.total - self.used))
+            self.used += size
+            return size
+
+    def release(self, size: int) -> None:
+        with self._lock:
+            self.used -= size
+
+
+class FrameBuffer:
+    """音声フレームを先読みしてリングバッファに溜め、バッファ内のシークを即時に行う
+
+    ``read_frame`` (FFmpeg ソースの ``read`` など) を別スレッドで呼び続け、
+    フレームを無名 mmap のリングに書き込む。再生側は ``read()`` で 1 フレームずつ
+    取り出し、``seek(t)`` が窓の内側なら読み出し位置を動かすだけで済む。
+
+    - 先読みは ``max_ahead`` 秒まで
+    - リングが一杯になると再生済みの古いフレームから捨てる
+    """
+
+    def __init__(self, read_frame: Callable[[], bytes], *, start: float = 0.0,
+                 capacity: int = 24 * 2**20, max_ahead: float = 60.0,
+                 frame: float = FRAME_SECONDS):
+        self.start = start                # フレーム 0 の再生位置 (秒)
+        self.frame = frame
+        self.capacity = capacity
+        self._read_frame = read_frame
+        self._max_ahead = max(1, int(max_ahead / frame))
+        self._mm = mmap.mmap(-1, capacity)
+        self._frames: collections.deque[tuple[int, int]] = collections.deque()  # (offset, length)
+        self._first = 0                   # _frames[0] のフレーム番号
+        self._cursor = 0                  # 次に read() で返すフレーム番号
+        self._wpos = 0
+        self._eof = False
+        self._closed = False
+        self._reader_done = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._fill, daemon=True, name="frame-buffer")
+        self._thread.start()
+
+    # ---- 参照 ----
+    @property
+    def position(self) -> float:
+        """次に再生するフレームの位置 (秒)"""
+        return self.start + self._cursor * self.frame
+
+    def window(self) -> tuple[float, float]:
+        """バッファ内にある区間 (開始秒, 終了秒)"""
+        with self._cond:
+            end = self._first + len(self._frames)
+            return self.start + self._first * self.frame, self.start + end * self.frame
+
+    @property
+    def eof(self) -> bool:
+        return self._eof
+
+    def remaining(self) -> int | None:
+        """終端まで読み込み済みなら残りフレーム数、まだなら None"""
+        with self._cond:
+            if not self._eof:
+                return None
+            return max(0, self._first + len(self._frames) - self._cursor)
+
+    # ---- 再生側 ----
+    def read(self) -> bytes:
+        """次のフレームを返す (まだ届いていなければ待つ、終端なら b"")"""
+        with self._cond:
+            while (self._cursor >= self._first + len(self._frames)
+                   and not self._eof and not self._closed):
+                self._cond.wait()
+            if self._closed or self._cursor >= self._first + len(self._frames):
+                return b""
+            off, n = self._frames[self._cursor - self._first]
+            self._cursor += 1
+            data = self._mm[off:off + n]
+            self._cond.notify_all()
+            return data
+
+    def seek(self, t: float) -> bool:
+        """t 秒がバッファ内なら読み出し位置を移して True、外なら何もせず False"""
+        idx = round((t - self.start) / self.frame)
+        with self._cond:
+            if not self._first <= idx <= self._first + len(self._frames):
+                return False
+            self._cursor = idx
+            self._cond.notify_all()
+            return True
+
+    def close(self) -> None:
+        """読み込みを止める (ソース側の停止は呼び出し側で行う)"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            if self._reader_done:
+                self._mm.close()
+
+    # ---- 読み込みスレッド ----
+    def _reserve(self, n: int) -> int | None:
+        """n バイト書ける位置を返す。未再生フレームを潰すなら None (待つ)"""
+        if self._first + len(self._frames) - self._cursor >= self._max_ahead:
+            return None
+        off = self._wpos if self._wpos + n <= self.capacity else 0
+        wrapped = off == 0 and self._wpos != 0
+        while self._frames:
+            o, length = self._frames[0]
+            if not ((wrapped and o >= self._wpos) or (o < off + n and off < o + length)):
+                break
+            if self._first >= self._cursor:
+                return None
+            self._frames.popleft()
+            self._first += 1
+        return off
+
+    def _fill(self) -> None:
+        try:
+            while not self._closed:
+                data = self._read_frame()
+                if not data:
+                    break
+                n = len(data)
+                if n > self.capacity:
+                    raise ValueError(f"frame of {n} bytes exceeds buffer capacity")
+                with self._cond:
+                    while not self._closed and (off := self._reserve(n)) is None:
+                        self._cond.wait()
+                    if self._closed:
+                        break
+                    self._mm[off:off + n] = data
+                    self._wpos = off + n
+                    self._frames.append((off, n))
+                    self._cond.notify_all()
+        except Exception as e:
+            if not self._closed:
+                logger.warning("frame buffer reader stopped: %s", e)
+        finally:
+            with self._cond:
+                self._eof = True
+                self._reader_done = True
+                self._cond.notify_all()
+                if self._closed:
+                    self._mm.close()
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import math
+import re
+import shlex
+import subprocess
+
+# ebur128 フィルタの最後に出るサマリ ("I:         -16.1 LUFS")
+_INTEGRATED_RE = re.compile(r"^\s*I:\s+(-?[\d.]+|-inf)\s+LUFS", re.MULTILINE)
+
+
+def parse_ebur128(stderr: str) -> float | None:
+    """ffmpeg ebur128 の出力から integrated loudness (LUFS) を取り出す"""
+    found = _INTEGRATED_RE.findall(stderr)
+    if not found or found[-1] == "-inf":
+        return None
+    return float(found[-1])
+
+
+def measure_loudness(source: str, *, executable: str = "ffmpeg",
+                     before_options: str = "", timeout: float = 300.0) -> float | None:
+    """音源を 1 回デコードして integrated loudness (LUFS) を測る (ブロッキング)
+
+    loudnorm で毎回整えるのではなく、この値から静的なゲインを決める。
+    """
+    cmd = [executable, "-hide_banner", "-nostats", *shlex.split(before_options),
+           "-i", source, "-vn", "-af", "ebur128=framelog=quiet", "-f", "null", "-"]
+    proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+    return parse_ebur128(proc.stderr)
+
+
+def normalize_gain_db(lufs: float, target: float = -16.0,
+                      max_boost: float = 6.0, max_cut: float = 20.0) -> float:
+    """target に合わせるための補正量 (dB)。持ち上げすぎ・下げすぎは抑える"""
+    return max(-max_cut, min(max_boost, target - lufs))
+
+
+def db_to_linear(db: float) -> float:
+    return 10 ** (db / 20)
+
+
+def linear_to_db(gain: float) -> float:
+    return 20 * math.log10(gain) if gain > 0 else -math.inf
@@ -0,0 +1,197 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Hashable
+
+logger = logging.getLogger(__name__)
+
+# render(key) -> (signature, payload) / 何も描画しないなら None
+RenderFunc = Callable[[Hashable], "tuple[Any, Any] | None"]
+ApplyFunc = Callable[[Hashable, Any], Awaitable[None]]
+IntervalFunc = Callable[[Hashable], "float | None"]
+
+
+class PanelScheduler:
+    """キューパネルの編集をまとめて行う単一スケジューラ
+
+    - ``request(key)`` は dirty フラグを立てるだけで、連続した要求は 1 回の編集に
+      まとめられる (coalesce)
+    - 描画結果の signature が前回と同じなら編集しない (suppress)
+    - 同じ key への編集は ``min_interval`` 秒に 1 回まで、全体ではトークンバケット
+      (``rate`` 回/秒, ``burst``) で REST 予算を守る
+    - ``start_progress(key)`` した key は ``interval(key)`` 秒ごとに自動で dirty になる
+    """
+
+    def __init__(self, render: RenderFunc, apply: ApplyFunc, *,
+                 interval: IntervalFunc | None = None,
+                 min_interval: float = 1.0, rate: float = 10.0, burst: int = 20,
+                 max_inflight: int = 5, report_interval: float = 600.0):
+        self._render = render
+        self._apply = apply
+        self._interval = interval
+        self.min_interval = min_interval
+        self.rate = rate
+        self.burst = burst
+        self.report_interval = report_interval
+        self._sem = asyncio.Semaphore(max_inflight)
+        self._dirty: set[Hashable] = set()
+        self._inflight: set[Hashable] = set()
+        self._progress: dict[Hashable, float] = {}
+        self._last_sig: dict[Hashable, Any] = {}
+        self._next_allowed: dict[Hashable, float] = {}
+        self._dropped: set[Hashable] = set()
+        self._tokens = float(burst)
+        self._token_ts = time.monotonic()
+        self._last_report = time.monotonic()
+        self._wake: asyncio.Event | None = None
+        self._task: asyncio.Task | None = None
+        self.stats = {
+            "requests": 0,     # request() 呼び出し回数
+            "coalesced": 0,    # 既に dirty だったためまとめられた回数
+            "edits": 0,        # 実際に行った編集
+            "suppressed": 0,   # 内容が同じで省略した編集
+            "rate_limited": 0,
+            "errors": 0,
+        }
+
+    # ---- 公開 API ----
+    def request(self, key: Hashable) -> None:
+        """key のパネルを近いうちに描き直す"""
+        self.stats["requests"] += 1
+        if key in self._dirty:
+            self.stats["coalesced"] += 1
+        self._dirty.add(key)
+        self._kick()
+
+    def note_rendered(self, key: Hashable, signature: Any) -> None:
+        """インタラクション応答などで直接編集した内容を記録する"""
+        self._last_sig[key] = signature
+        self._next_allowed[key] = time.monotonic() + self.min_interval
+
+    def start_progress(self, key: Hashable) -> None:
+        """シークバーの定期更新を開始"""
+        self._progress[key] = time.monotonic()
+        self._kick()
+
+    def stop_progress(self, key: Hashable) -> None:
+        self._progress.pop(key, None)
+
+    def forget(self, key: Hashable) -> None:
+        """key に関する状態をすべて破棄"""
+        self._dirty.discard(key)
+        self._progress.pop(key, None)
+        self._last_sig.pop(key, None)
+        self._next_allowed.pop(key, None)
+        if key in self._inflight:
+            self._dropped.add(key)
+
+    def tracked(self) -> set[Hashable]:
+        """何らかの状態を持っている key"""
+        return (self._dirty | self._inflight | set(self._progress)
+                | set(self._last_sig) | set(self._next_allowed))
+
+    def pressure(self) -> float:
+        """REST 予算の逼迫度 (1.0 = 余裕あり, 最大 4.0)"""
+        self._refill(time.monotonic())
+        return 1.0 + 3.0 * (1.0 - self._tokens / self.burst)
+
+    # ---- 内部 ----
+    def _kick(self) -> None:
+        if self._task is None or self._task.done():
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._run())
+        self._wake.set()
+
+    def _refill(self, now: float) -> None:
+        self._tokens = min(self.burst, self._tokens + (now - self._token_ts) * self.rate)
+        self._token_ts = now
+
+    def _due_progress(self, now: float) -> float | None:
+        next_wake = None
+        for key, due in list(self._progress.items()):
+            if due <= now:
+                ivl = self._interval(key) if self._interval else None
+                if ivl is None:
+                    del self._progress[key]
+                    continue
+                self._dirty.add(key)
+                due = self._progress[key] = now + ivl
+            next_wake = due if next_wake is None else min(next_wake, due)
+        return next_wake
+
+    async def _run(self) -> None:
+        while True:
+            self._wake.clear()
+            now = time.monotonic()
+            next_wake = self._due_progress(now)
+            self._refill(now)
+            for key in list(self._dirty):
+                if key in self._inflight:
+                    continue
+                allowed = self._next_allowed.get(key, 0.0)
+                if allowed > now:
+                    next_wake = allowed if next_wake is None else min(next_wake, allowed)
+                    continue
+                try:
+                    rendered = self._render(key)
+                except Exception as e:
+                    logger.error("panel render failed: %s", e)
+                    rendered = None
+                if rendered is None:
+                    self._dirty.discard(key)
+                    continue
+                sig, payload = rendered
+                if sig == self._last_sig.get(key):
+                    self._dirty.discard(key)
+                    self.stats["suppressed"] += 1
+                    continue
+                if self._tokens < 1:
+                    retry = now + (1 - self._tokens) / self.rate
+                    next_wake = retry if next_wake is None else min(next_wake, retry)
+                    break
+                self._tokens -= 1
+                self._dirty.discard(key)
+                self._inflight.add(key)
+                asyncio.create_task(self._edit(key, sig, payload))
+
+            if now - self._last_report >= self.report_interval:
+                self._last_report = now
+                logger.info("panel stats: %s", self.stats)
+
+            if not self._dirty and not self._progress and not self._inflight:
+                return
+            timeout = None if next_wake is None else max(0.0, next_wake - time.monotonic())
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _edit(self, key: Hashable, sig: Any, payload: Any) -> None:
+        backoff = self.min_interval
+        try:
+            async with self._sem:
+                await self._apply(key, payload)
+            self._last_sig[key] = sig
+            self.stats["edits"] += 1
+        except Exception as e:
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is None and getattr(e, "status", None) == 429:
+                retry_after = 5.0
+            if retry_after is not None:
+                self.stats["rate_limited"] += 1
+                backoff = max(backoff, float(retry_after))
+                self._dirty.add(key)
+            else:
+                self.stats["errors"] += 1
+                logger.debug("panel edit failed: %s", e)
+        finally:
+            self._inflight.discard(key)
+            if key in self._dropped:
+                self._dropped.discard(key)
+                self.forget(key)
+            else:
+                self._next_allowed[key] = time.monotonic() + backoff
+            if self._wake is not None:
+                self._wake.set()
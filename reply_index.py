@@ -0,0 +1,69 @@
+from __future__ import annotations
+
+import collections
+from typing import Any
+
+
+class ReplyIndex:
+    """メッセージ ID → (返信先 ID, その返信チェーンに Bot の発言があるか) の索引
+
+    on_message で流れてくる全メッセージ (Bot 自身の発言を含む) を ``add`` しておけば、
+    「このメッセージは Bot との会話への返信か」を HTTP なしで O(1) で答えられる。
+
+    - チェーンのフラグは ``add`` の時点で親から引き継いで確定させる
+      (親を知らなければ、自分が Bot の発言でない限り不明 = None)
+    - ``max_entries`` を超えたら古い順に忘れる
+    - 取得した Message 本体も ``max_messages`` 件まで保持し、チェーンの再取得を省く
+    """
+
+    def __init__(self, max_entries: int = 50000, max_messages: int = 500):
+        self.max_entries = max_entries
+        self.max_messages = max_messages
+        self._chain: collections.OrderedDict[int, bool | None] = collections.OrderedDict()
+        self._parent: dict[int, int | None] = {}
+        self._messages: collections.OrderedDict[int, Any] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._chain)
+
+    def __contains__(self, message_id: int) -> bool:
+        return message_id in self._chain
+
+    def add(self, message_id: int, parent_id: int | None, is_bot: bool) -> bool | None:
+        """メッセージを登録してチェーンのフラグを返す
+
+        parent_id が None のメッセージはチェーンの先頭として扱う。
+        """
+        if is_bot:
+            chain: bool | None = True
+        elif parent_id is None:
+            chain = False
+        else:
+            chain = self._chain.get(parent_id)
+        self._chain[message_id] = chain
+        self._chain.move_to_end(message_id)
+        self._parent[message_id] = parent_id
+        while len(self._chain) > self.max_entries:
+            old, _ = self._chain.popitem(last=False)
+            self._parent.pop(old, None)
+        return chain
+
+    def in_bot_chain(self, message_id: int) -> bool | None:
+        """message_id までの返信チェーンに Bot の発言があるか (知らなければ None)"""
+        return self._chain.get(message_id)
+
+    def parent(self, message_id: int) -> int | None:
+        return self._parent.get(message_id)
+
+    # ---- Message 本体のキャッシュ ----
+    def remember(self, message_id: int, message: Any) -> None:
+        self._messages[message_id] = message
+        self._messages.move_to_end(message_id)
+        while len(self._messages) > self.max_messages:
+            self._messages.popitem(last=False)
+
+    def message(self, message_id: int) -> Any | None:
+        msg = self._messages.get(message_id)
+        if msg is not None:
+            self._messages.move_to_end(message_id)
+        return msg
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+SendFunc = Callable[[str], Awaitable[Any]]          # 続きのメッセージを送って返す
+EditFunc = Callable[[Any, str], Awaitable[None]]    # メッセージを書き換える
+
+
+def split_text(text: str, limit: int) -> list[str]:
+    """limit 文字以内の塊に分ける (できるだけ改行で区切る)
+
+    先頭から貪欲に切るので、後ろに文字が増えても確定した塊は変わらない。
+    """
+    chunks = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+class ReplyStream:
+    """ストリーミング中の回答をメッセージ編集で少しずつ見せるパイプライン
+
+    - ``update(text)`` は最新の全文を置いておくだけ (古い未送信の内容は捨てる)
+    - 編集は 1 本の作業タスクが順番に行うので、同時に飛ぶ編集は常に 1 つ
+    - 編集間隔は ``min_interval`` から、編集にかかった時間 (レート制限で待たされた分を
+      含む) や 429 の retry_after に応じて ``max_interval`` まで広げる
+    - ``limit`` 文字を超えた分は続きのメッセージを送って書き足す
+    - ``close()`` で最後の内容を必ず反映してから戻る
+    """
+
+    def __init__(self, first: Any, send: SendFunc, edit: EditFunc, *, limit: int = 1900,
+                 min_interval: float = 0.5, max_interval: float = 5.0):
+        self.limit = limit
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self._send = send
+        self._edit = edit
+        self._messages: list[Any] = [first]
+        self._shown: list[str] = [""]
+        self._latest = ""
+        self._pending = False   # _latest を作業タスクがまだ取り出していない
+        self._closed = False
+        self._broken = False
+        self._retry = False
+        self._last = 0.0
+        self._wake = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self.stats = {"edits": 0, "sends": 0, "skipped": 0, "errors": 0}
+
+    @property
+    def messages(self) -> list[Any]:
+        return list(self._messages)
+
+    def update(self, text: str) -> None:
+        """表示したい全文を渡す (すぐには編集しない)"""
+        if self._closed:
+            return
+        if self._pending:
+            self.stats["skipped"] += 1  # 送られないまま上書きされた途中経過
+        self._latest = text
+        self._pending = True
+        self._wake.set()
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self, text: str | None = None) -> None:
+        """最後の内容を反映して終了する"""
+        if text is not None:
+            self.update(text)
+        self._closed = True
+        self._closing.set()
+        self._wake.set()
+        if self._task is not None:
+            await self._task
+
+    # ---- 内部 ----
+    async def _run(self) -> None:
+        while True:
+            await self._wake.wait()
+            self._wake.clear()
+            wait = self._last + self.interval - time.monotonic()
+            if wait > 0 and self._retry:
+                await asyncio.sleep(wait)  # 失敗直後は close 後でも間隔を守る
+            elif wait > 0 and not self._closed:
+                try:
+                    # 待っている間に close されたらすぐ最終版を書く
+                    await asyncio.wait_for(self._closing.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush()
+            if self._broken or (self._closed and self._synced()):
+                return
+
+    def _synced(self) -> bool:
+        chunks = [c for c in split_text(self._latest, self.limit) if c.strip()]
+        return chunks == self._shown[:len(chunks)]
+
+    async def _flush(self) -> None:
+        self._pending = False
+        chunks = split_text(self._latest, self.limit)
+        for i, chunk in enumerate(chunks):
+            if not chunk.strip():
+                continue
+            if i < len(self._shown) and self._shown[i] == chunk:
+                continue
+            started = time.monotonic()
+            try:
+                if i < len(self._messages):
+                    await self._edit(self._messages[i], chunk)
+                    self.stats["edits"] += 1
+                else:
+                    self._messages.append(await self._send(chunk))
+                    self._shown.append("")
+                    self.stats["sends"] += 1
+            except Exception as e:
+                if not self._on_error(e):
+                    self._broken = True
+                    return
+                return  # 次の周回でやり直す
+            self._shown[i] = chunk
+            self._retry = False
+            self._last = time.monotonic()
+            self._adapt(self._last - started)
+
+    def _adapt(self, took: float) -> None:
+        # 待たされた (= レート制限に近い) ほど間隔を広げ、速ければ徐々に戻す
+        if took > self.interval:
+            self.interval = min(self.max_interval, took * 2)
+        else:
+            self.interval = max(self.min_interval, self.interval * 0.8)
+
+    def _on_error(self, e: Exception) -> bool:
+        """続けられるなら True (429 なら retry_after だけ間隔を空ける)"""
+        self.stats["errors"] += 1
+        status = getattr(e, "status", None)
+        if status == 404:
+            logger.info("reply stream: message is gone, giving up")
+            return False
+        if self._closed and self.stats["errors"] > 5:
+            logger.warning("reply stream: giving up final flush: %s", e)
+            return False
+        retry = getattr(e, "retry_after", None)
+        self.interval = min(self.max_interval, max(self.interval * 2, retry or 0))
+        self._last = time.monotonic()
+        self._retry = True
+        self._wake.set()
+        logger.warning("reply stream edit failed: %s", e)
+        return True
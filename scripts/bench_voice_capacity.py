@@ -0,0 +1,422 @@
+"""何ギルドまで同時再生できるかを Discord に接続せずに測るベンチマーク
+
+Bot 本体 (DiscordYONE) は import しない。import すると本番の SQLite や添付の
+保存先を開いて掃除まで走り、トークンや API キーも要るため。代わりに再生経路を
+作っている部品 (frame_buffer / track_mixer / loudness / panel_renderer) と
+discord.py の FFmpeg 音源で 1 ギルド分の再生を Bot と同じ形に組み立てる。
+音声はローカルに生成したファイルを実際の FFmpeg で流す。
+
+    python scripts/bench_voice_capacity.py --guilds 1 10 50 200 --duration 60
+
+ギルドごとに:
+- 曲を Bot の make_audio_source と同じ規則で開く (Opus で補正が小さければコピー、
+  それ以外は FFmpeg の volume フィルタ付きでエンコード)
+- FrameBuffer 越しに TrackMixer に載せ、"draining" で次の曲を先に開いてつなぐ
+- パネルは PanelScheduler でシークバーを定期更新し、偽のメッセージを編集する
+
+出力 (ギルド数ごと):
+- CPU: ベンチのプロセス + FFmpeg 子プロセスの CPU 使用率 (1 コア = 100%) と 1 ギルドあたり
+- loop lag: イベントループの遅延 (p50 / p99 / max)
+- edits/s: パネル編集回数と 429 になった回数
+- jitter: 20ms ごとの音声パケット送出の遅れ (p50 / p99) と 20ms 以上遅れた割合
+
+FakePlayer は discord.py の AudioPlayer と同じく 1 ギルド 1 スレッドで
+``source.read()`` を 20ms ごとに呼び、Opus でない音源はその場でエンコードする
+(暗号化と UDP 送信は含まない)。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+import discord  # noqa: E402
+
+from frame_buffer import BufferBudget, FrameBuffer, FRAME_SECONDS  # noqa: E402
+from loudness import db_to_linear, linear_to_db, measure_loudness, normalize_gain_db  # noqa: E402
+from panel_renderer import PanelScheduler  # noqa: E402
+from track_mixer import TrackMixer  # noqa: E402
+
+FRAME = FRAME_SECONDS  # discord.py の AudioPlayer.DELAY と同じ
+
+# DiscordYONE と同じ値 (向こうを変えたらこちらも合わせる)
+OPUS_BITRATE = 128
+PLAYBACK_VOLUME = 0.9
+LOUDNESS_TARGET = -16.0
+LOUDNESS_MAX_BOOST = 6.0
+LOUDNESS_TOLERANCE = 1.5
+SEEK_BUFFER_SECONDS = 240.0
+SEEK_BUFFER_AHEAD = 60.0
+SEEK_BUFFER_MIN_SECONDS = 10.0
+SEEK_BUFFER_TOTAL = 512 * 2**20
+OPUS_BUFFER_KBPS = 192
+PCM_BYTES_PER_SECOND = 48000 * 2 * 2
+PROGRESS_MIN_INTERVAL = 2.0
+PROGRESS_MAX_INTERVAL = 15.0
+PANEL_OPTIONS = {"min_interval": 1.0, "rate": 10.0, "burst": 20}
+
+
+# ───────────── 再生経路 ─────────────
+def copies(codec: str, gain: float, passthrough: bool) -> bool:
+    """Opus をデコードせずにコピーできるか (補正がほぼ要らない Opus の曲)"""
+    return passthrough and codec == "opus" and abs(linear_to_db(gain)) <= LOUDNESS_TOLERANCE
+
+
+def make_source(path: str, codec: str, gain: float, passthrough: bool) -> discord.AudioSource:
+    """DiscordYONE.make_audio_source と同じ選び方で FFmpeg 音源を作る"""
+    if copies(codec, gain, passthrough):
+        return discord.FFmpegOpusAudio(path, codec="copy", options="-vn -loglevel warning")
+    options = f'-vn -loglevel warning -af "volume={gain:.4f}"'
+    if passthrough:
+        return discord.FFmpegOpusAudio(path, bitrate=OPUS_BITRATE, options=options)
+    return discord.FFmpegPCMAudio(path, options=options)
+
+
+class BenchDeck:
+    """DiscordYONE.BufferedAudio 相当 (FrameBuffer 越しに FFmpeg の出力を渡す)"""
+
+    def __init__(self, inner: discord.AudioSource, budget: BufferBudget):
+        self.inner = inner
+        self.budget = budget
+        rate = OPUS_BUFFER_KBPS * 1000 // 8 if inner.is_opus() else PCM_BYTES_PER_SECOND
+        self.capacity = budget.acquire(int(rate * SEEK_BUFFER_SECONDS),
+                                       int(rate * SEEK_BUFFER_MIN_SECONDS))
+        self.buffer = FrameBuffer(inner.read, capacity=self.capacity, max_ahead=SEEK_BUFFER_AHEAD)
+
+    def read(self) -> bytes:
+        return self.buffer.read()
+
+    def is_opus(self) -> bool:
+        return self.inner.is_opus()
+
+    def remaining(self) -> int | None:
+        return self.buffer.remaining()
+
+    def cleanup(self) -> None:
+        if self.capacity:
+            self.budget.release(self.capacity)
+            self.capacity = 0
+        self.buffer.close()
+        self.inner.cleanup()
+
+
+class BenchTrack:
+    def __init__(self, title: str, path: str, codec: str, seconds: int, gain: float):
+        self.title, self.path, self.codec = title, path, codec
+        self.seconds, self.gain = seconds, gain
+
+
+# ───────────── 偽プレイヤー ─────────────
+class GuildStats:
+    def __init__(self):
+        self.lateness: list[float] = []   # パケットごとの理想時刻からの遅れ
+        self.packets = 0
+        self.edits = 0
+        self.rate_limited = 0
+
+
+def _make_encoder():
+    """libopus が無ければ None (エンコードの CPU は計測に含まれない)"""
+    try:
+        if not discord.opus.is_loaded() and not discord.opus._load_default():
+            return None
+        return discord.opus.Encoder()
+    except Exception:
+        return None
+
+
+class FakePlayer(threading.Thread):
+    """discord.player.AudioPlayer と同じ間隔で source を読み出すスレッド"""
+
+    def __init__(self, source, after, stats: GuildStats):
+        super().__init__(daemon=True)
+        self.source = source
+        self.after = after
+        self.stats = stats
+        self._end = threading.Event()
+
+    def run(self):
+        error = None
+        encoder = _make_encoder() if not self.source.is_opus() else None
+        loops, start = 0, time.perf_counter()
+        try:
+            while not self._end.is_set():
+                data = self.source.read()
+                if not data:
+                    break
+                if encoder is not None:
+                    encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+                self.stats.lateness.append(time.perf_counter() - (start + FRAME * loops))
+                self.stats.packets += 1
+                loops += 1
+                time.sleep(max(0.0, start + FRAME * loops - time.perf_counter()))
+        except Exception as e:
+            error = e
+        finally:
+            self.source.cleanup()
+            if self.after is not None:
+                self.after(error)
+
+    def stop(self):
+        self._end.set()
+
+
+# ───────────── 偽 HTTP (メッセージ) ─────────────
+class FakeRateLimited(Exception):
+    status = 429
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"429 retry_after={retry_after:.2f}")
+        self.retry_after = retry_after
+
+
+class FakeMessage:
+    """edit に HTTP 往復分の遅延と、メッセージ単位のレート制限 (5 回 / 5 秒) を付ける"""
+
+    def __init__(self, stats: GuildStats, latency: float):
+        self.stats = stats
+        self.latency = latency
+        self._recent: list[float] = []
+
+    async def edit(self, **kwargs):
+        await asyncio.sleep(self.latency)
+        now = time.monotonic()
+        self._recent = [t for t in self._recent if now - t < 5.0]
+        if len(self._recent) >= 5:
+            self.stats.rate_limited += 1
+            raise FakeRateLimited(5.0 - (now - self._recent[0]))
+        self._recent.append(now)
+        self.stats.edits += 1
+        return self
+
+
+# ───────────── 1 ギルド分の再生 ─────────────
+_guild_ids = itertools.count(1)
+
+
+class BenchGuild:
+    """DiscordYONE.MusicState.player_loop のうち、曲の切り替えとパネル更新だけを再現する"""
+
+    def __init__(self, tracks: list[BenchTrack], budget: BufferBudget, panel: PanelScheduler,
+                 passthrough: bool, latency: float):
+        self.id = next(_guild_ids)
+        self.tracks = tracks
+        self.budget = budget
+        self.panel = panel
+        self.passthrough = passthrough
+        self.stats = GuildStats()
+        self.message = FakeMessage(self.stats, latency)
+        self.index = 0
+        self.mixer: TrackMixer | None = None
+        self.player: FakePlayer | None = None
+
+    def open_deck(self, index: int) -> BenchDeck:
+        tr = self.tracks[index % len(self.tracks)]
+        return BenchDeck(make_source(tr.path, tr.codec, tr.gain, self.passthrough), self.budget)
+
+    async def run(self) -> None:
+        """キューループで曲を流し続ける (キャンセルで止まる)"""
+        loop = asyncio.get_running_loop()
+        while True:
+            events: asyncio.Queue[tuple[str, object]] = asyncio.Queue()
+
+            def notify(kind: str, tag: object, q=events):
+                loop.call_soon_threadsafe(q.put_nowait, (kind, tag))
+
+            self.mixer = TrackMixer(self.open_deck(self.index), tag=self.index, on_event=notify)
+            self.player = FakePlayer(self.mixer, lambda _: notify("ended", None), self.stats)
+            self.player.start()
+            self.panel.request(self)
+            self.panel.start_progress(self)
+            try:
+                while (event := await events.get())[0] != "ended":
+                    kind, tag = event
+                    if kind == "draining":
+                        self.mixer.queue_next(self.open_deck(tag + 1), tag + 1)
+                    elif kind == "switched":
+                        self.index = tag
+                        self.panel.request(self)
+            finally:
+                self.panel.stop_progress(self)
+                self.player.stop()
+            self.index += 1
+
+    def stop(self) -> None:
+        if self.player is not None:
+            self.player.stop()
+
+    def position(self) -> float:
+        deck = self.mixer.current if self.mixer else None
+        return deck.buffer.position if deck is not None else 0.0
+
+
+def _render(g: BenchGuild):
+    tr = g.tracks[g.index % len(g.tracks)]
+    pos = g.position()
+    filled = min(14, int(pos / tr.seconds * 14)) if tr.seconds else 0
+    text = f"{tr.title}\n{'▬' * filled}🔘{'▬' * (14 - filled)} {int(pos) // 60}:{int(pos) % 60:02d}"
+    return text, text
+
+
+async def _apply(g: BenchGuild, text: str) -> None:
+    await g.message.edit(content=text)
+
+
+def _make_panel() -> PanelScheduler:
+    def interval(g: BenchGuild) -> float | None:
+        # DiscordYONE._progress_interval と同じ
+        if g.mixer is None:
+            return None
+        step = g.tracks[g.index % len(g.tracks)].seconds / 14
+        return min(max(step, PROGRESS_MIN_INTERVAL), PROGRESS_MAX_INTERVAL) * panel.pressure()
+
+    panel = PanelScheduler(_render, _apply, interval=interval, **PANEL_OPTIONS)
+    return panel
+
+
+# ───────────── 計測 ─────────────
+def make_audio(path: str, seconds: int, codec: str, level_db: float) -> None:
+    enc = {"opus": ["-c:a", "libopus", "-b:a", "128k"], "aac": ["-c:a", "aac"]}[codec]
+    subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-f", "lavfi",
+         "-i", f"sine=frequency=440:duration={seconds}", "-ac", "2", "-ar", "48000",
+         "-af", f"volume={level_db}dB", *enc, path],
+        check=True,
+    )
+
+
+async def _lag_monitor(samples: list[float], interval: float = 0.05):
+    while True:
+        t = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - t - interval)
+
+
+def _pct(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_scenario(n_guilds: int, tracks: list[BenchTrack], duration: float,
+                       passthrough: bool, latency: float) -> dict:
+    panel = _make_panel()
+    budget = BufferBudget(SEEK_BUFFER_TOTAL)
+    lag: list[float] = []
+    monitor = asyncio.create_task(_lag_monitor(lag))
+    t0, cpu0 = time.perf_counter(), os.times()
+    guilds = [BenchGuild(tracks, budget, panel, passthrough, latency) for _ in range(n_guilds)]
+    tasks = [asyncio.create_task(g.run()) for g in guilds]
+
+    await asyncio.sleep(duration)
+
+    for g, task in zip(guilds, tasks):
+        task.cancel()
+        g.stop()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for g in guilds:
+        if g.player is not None:
+            await asyncio.to_thread(g.player.join, 5)
+        panel.forget(g)
+    await asyncio.sleep(0.5)  # FFmpeg の終了待ち (子プロセスの CPU 時間を回収する)
+    monitor.cancel()
+
+    wall = time.perf_counter() - t0
+    cpu1 = os.times()
+    cpu_self = (cpu1.user - cpu0.user) + (cpu1.system - cpu0.system)
+    cpu_child = (cpu1.children_user - cpu0.children_user) + (cpu1.children_system - cpu0.children_system)
+    lateness = [x for g in guilds for x in g.stats.lateness]
+    return {
+        "guilds": n_guilds,
+        "cpu_pct": 100 * (cpu_self + cpu_child) / wall,
+        "cpu_self_pct": 100 * cpu_self / wall,
+        "cpu_guild_pct": 100 * (cpu_self + cpu_child) / wall / n_guilds,
+        "lag_p50_ms": 1000 * _pct(lag, 0.5),
+        "lag_p99_ms": 1000 * _pct(lag, 0.99),
+        "lag_max_ms": 1000 * max(lag, default=0.0),
+        "edits_per_s": sum(g.stats.edits for g in guilds) / wall,
+        "rate_limited": sum(g.stats.rate_limited for g in guilds),
+        "jitter_p50_ms": 1000 * _pct(lateness, 0.5),
+        "jitter_p99_ms": 1000 * _pct(lateness, 0.99),
+        "late_pct": 100 * sum(x > FRAME for x in lateness) / max(1, len(lateness)),
+        "packets": len(lateness),
+        "panel": dict(panel.stats),
+    }
+
+
+def print_report(rows: list[dict]) -> None:
+    header = (f"{'guilds':>6} {'cpu%':>7} {'cpu%/g':>7} {'lag p50':>8} {'p99':>7} {'max':>7} "
+              f"{'edits/s':>8} {'429':>5} {'jit p50':>8} {'p99':>7} {'late%':>6}")
+    print(header)
+    print("-" * len(header))
+    for r in rows:
+        print(f"{r['guilds']:>6} {r['cpu_pct']:>7.1f} {r['cpu_guild_pct']:>7.2f} "
+              f"{r['lag_p50_ms']:>8.1f} {r['lag_p99_ms']:>7.1f} {r['lag_max_ms']:>7.1f} "
+              f"{r['edits_per_s']:>8.2f} {r['rate_limited']:>5} "
+              f"{r['jitter_p50_ms']:>8.2f} {r['jitter_p99_ms']:>7.2f} {r['late_pct']:>6.2f}")
+
+
+def track_gain(path: str, normalize: bool) -> tuple[float, float | None]:
+    """DiscordYONE.MusicState.track_gain と同じ補正量 (/volume は 100%)"""
+    if not normalize:
+        return PLAYBACK_VOLUME, None
+    lufs = measure_loudness(path)
+    if lufs is None:
+        return PLAYBACK_VOLUME, None
+    return db_to_linear(normalize_gain_db(lufs, LOUDNESS_TARGET, LOUDNESS_MAX_BOOST)), lufs
+
+
+async def main(args) -> None:
+    passthrough = args.codec != "pcm"
+    if _make_encoder() is None:
+        print("warning: libopus not found; PCM sources are not encoded", file=sys.stderr)
+    codec = "opus" if args.codec == "opus" else "aac"
+    ext = "opus" if codec == "opus" else "m4a"
+    with tempfile.TemporaryDirectory(prefix="yone_bench_") as tmp:
+        tracks = []
+        for i in range(2):
+            path = os.path.join(tmp, f"track{i}.{ext}")
+            make_audio(path, args.track_seconds, codec, args.level)
+            gain, lufs = track_gain(path, not args.no_loudness)
+            tr = BenchTrack(f"bench {i}", path, codec, args.track_seconds, gain)
+            route = ("copy" if copies(codec, gain, passthrough)
+                     else "opus encode" if passthrough else "pcm")
+            print(f"{tr.title}: loudness {lufs} LUFS, gain {linear_to_db(gain):+.1f} dB -> {route}",
+                  file=sys.stderr)
+            tracks.append(tr)
+        rows = []
+        for n in args.guilds:
+            print(f"running {n} guild(s) for {args.duration:.0f}s ...", file=sys.stderr)
+            rows.append(await run_scenario(n, tracks, args.duration, passthrough, args.http_latency))
+            if args.verbose:
+                print(rows[-1], file=sys.stderr)
+        print_report(rows)
+        if rows:
+            worst = max(rows, key=lambda r: r["guilds"])
+            print(f"\npanel stats ({worst['guilds']} guilds): {worst['panel']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--guilds", type=int, nargs="+", default=[1, 10, 50, 200])
+    parser.add_argument("--duration", type=float, default=60.0, help="1 シナリオの計測秒数")
+    parser.add_argument("--track-seconds", type=int, default=30, help="生成する曲の長さ")
+    parser.add_argument("--codec", choices=["opus", "aac", "pcm"], default="opus",
+                        help="opus: パススルー / aac: FFmpeg で Opus 化 / pcm: 従来の PCM 経路")
+    parser.add_argument("--level", type=float, default=6.0,
+                        help="生成する音に掛ける音量 (dB)。既定では約 -16 LUFS になり補正なしでコピーされる")
+    parser.add_argument("--no-loudness", action="store_true",
+                        help="loudness を測らず未測定の曲と同じ音量で流す")
+    parser.add_argument("--http-latency", type=float, default=0.05, help="偽 HTTP の往復秒数")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    asyncio.run(main(parser.parse_args()))
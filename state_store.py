@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+Snapshot = Callable[[], "dict[str, Any] | None"]
+
+
+class StateStore:
+    """ギルドごとの状態を 1 ファイルずつ JSON で保存するストア
+
+    - ``mark(key, snapshot)`` で変更を知らせると ``delay`` 秒後にまとめて書き出す
+      (その間に何度 mark しても書き込みは 1 回、内容はその時点の ``snapshot()``)
+    - 前回書いた内容と同じなら書き込まない
+    - 書き込みは一時ファイル + ``os.replace`` なので途中で落ちても壊れない
+    """
+
+    def __init__(self, root: str, *, delay: float = 1.0):
+        self.root = root
+        self.delay = delay
+        self._pending: dict[str, Snapshot] = {}
+        self._written: dict[str, str] = {}
+        self._dropped: set[str] = set()   # 書き込み中に discard された key
+        self._task: asyncio.Task | None = None
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.json")
+
+    # ---- 読み込み ----
+    def load_all(self) -> dict[str, dict[str, Any]]:
+        """保存済みの状態をすべて読み込む (壊れたファイルは捨てる)"""
+        result: dict[str, dict[str, Any]] = {}
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if name.endswith(".tmp"):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(".json"):
+                continue
+            key = name[:-5]
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    text = f.read()
+                data = json.loads(text)
+            except (OSError, ValueError) as e:
+                logger.warning("state store: dropping unreadable %s: %s", name, e)
+                self.discard(key)
+                continue
+            if isinstance(data, dict):
+                result[key] = data
+                self._written[key] = text
+        return result
+
+    # ---- 書き込み ----
+    def mark(self, key: str, snapshot: Snapshot) -> None:
+        """key の状態が変わったことを知らせる (実際の書き込みは後でまとめて)"""
+        self._pending[key] = snapshot
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    def discard(self, key: str) -> None:
+        """key の保存状態を消す (予約中の書き込みも取り消す)"""
+        self._pending.pop(key, None)
+        self._written.pop(key, None)
+        self._dropped.add(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning("state store: failed to remove %s: %s", key, e)
+
+    async def flush(self) -> None:
+        """予約中の書き込みを今すぐ行う"""
+        pending, self._pending = self._pending, {}
+        for key, snapshot in pending.items():
+            try:
+                data = snapshot()
+            except Exception as e:
+                logger.warning("state store: snapshot of %s failed: %s", key, e)
+                continue
+            if data is None:
+                self.discard(key)
+                continue
+            text = json.dumps(data, ensure_ascii=False, sort_keys=True)
+            if self._written.get(key) == text:
+                continue
+            self._dropped.discard(key)
+            try:
+                await asyncio.to_thread(self._write, key, text)
+            except OSError as e:
+                logger.warning("state store: failed to write %s: %s", key, e)
+                continue
+            if key in self._dropped:
+                # 書いている間に discard されたので消し直す
+                self.discard(key)
+            else:
+                self._written[key] = text
+
+    def _write(self, key: str, text: str) -> None:
+        path = self._path(key)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+    async def _flush_later(self) -> None:
+        while self._pending:
+            await asyncio.sleep(self.delay)
+            await self.flush()
@@ -0,0 +1,114 @@
+import asyncio
+import os
+
+import pytest
+
+from audio_store import AudioStore, AudioTooLarge
+
+
+async def _chunks(data, size=4):
+    for i in range(0, len(data), size):
+        yield data[i:i + size]
+
+
+def test_same_key_and_same_content_are_shared(tmp_path):
+    store = AudioStore(str(tmp_path))
+
+    async def main():
+        a = await store.store("att:1", _chunks(b"hello world"), suffix=".mp3")
+        b = await store.store("att:1", _chunks(b"ignored"), suffix=".mp3")
+        c = await store.store("att:2", _chunks(b"hello world"), suffix=".mp3")
+        return a, b, c
+
+    a, b, c = asyncio.run(main())
+    assert a == b == c
+    assert a.endswith(".mp3")
+    with open(a, "rb") as f:
+        assert f.read() == b"hello world"
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_file_removed_after_last_release(tmp_path):
+    store = AudioStore(str(tmp_path))
+    path = asyncio.run(store.store("k", _chunks(b"data")))
+    assert store.retain(path)
+    store.release(path)
+    assert os.path.exists(path)
+    store.release(path)
+    assert not os.path.exists(path)
+    assert path not in store
+    assert store.lookup("k") is None
+
+
+def test_size_cap_rejects_and_cleans_up(tmp_path):
+    store = AudioStore(str(tmp_path), max_file_size=8)
+    with pytest.raises(AudioTooLarge):
+        asyncio.run(store.store("k", _chunks(b"x" * 20)))
+    with pytest.raises(AudioTooLarge):
+        asyncio.run(store.store("k", _chunks(b""), size=9))
+    assert os.listdir(tmp_path) == []
+
+
+def test_idle_files_evicted_lru_within_budget(tmp_path):
+    store = AudioStore(str(tmp_path), budget=10, idle_limit=10)
+
+    async def main():
+        return [await store.store(k, _chunks(k.encode() * 4)) for k in ("a", "b")]
+
+    a, b = asyncio.run(main())
+    store.release(a)
+    store.release(b)
+    assert os.path.exists(a) and os.path.exists(b)
+    c = asyncio.run(store.store("c", _chunks(b"cccc")))
+    assert not os.path.exists(a)   # 最も古い待機ファイルから消える
+    assert os.path.exists(b) and os.path.exists(c)
+    assert store.lookup("b") == b
+
+
+def test_concurrent_downloads_of_same_key(tmp_path):
+    store = AudioStore(str(tmp_path))
+    calls = []
+
+    async def slow(data):
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        yield data
+
+    async def main():
+        return await asyncio.gather(
+            store.store("k", slow(b"abc")),
+            store.store("k", slow(b"abc")),
+        )
+
+    p1, p2 = asyncio.run(main())
+    assert p1 == p2
+    assert len(calls) == 1
+    store.release(p1)
+    assert os.path.exists(p1)
+    store.release(p1)
+    assert not os.path.exists(p1)
+
+
+def test_keep_restores_references_on_startup(tmp_path):
+    store = AudioStore(str(tmp_path))
+    kept = asyncio.run(store.store("a", _chunks(b"kept")))
+    dropped = asyncio.run(store.store("b", _chunks(b"dropped")))
+
+    store = AudioStore(str(tmp_path), keep=[kept, kept])
+    assert kept in store and os.path.exists(kept)
+    assert not os.path.exists(dropped)
+    store.release(kept)
+    assert os.path.exists(kept)
+    store.release(kept)
+    assert not os.path.exists(kept)
+
+
+def test_release_all_reclaims_orphaned_refs(tmp_path):
+    store = AudioStore(str(tmp_path))
+    path = asyncio.run(store.store("k", _chunks(b"data")))
+    store.retain(path)
+    assert store.held() == {path}
+    assert store.release_all(path)
+    assert store.held() == set()
+    assert not os.path.exists(path)
+    assert not store.release_all(path)
@@ -0,0 +1,43 @@
+from context_packer import ContextPacker, estimate_tokens, make_line
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("abcd") == 1
+    assert estimate_tokens("abcde") == 2
+    assert estimate_tokens("こんにちは") == 5
+
+
+def test_make_line_formats_author_and_attachments():
+    line = make_line(1, "alice", "hello\n  world", ["a.png", "b.txt"])
+    assert line.text == "alice: hello world [添付: a.png, b.txt]"
+    assert line.tokens == estimate_tokens(line.text) + 1
+    assert make_line(2, "bob", "x" * 50, max_chars=10).text == "bob: " + "x" * 9 + "…"
+
+
+def test_build_caches_every_prefix_and_extend_reuses_it():
+    packer = ContextPacker(budget=1000)
+    chain = [make_line(i, "u", f"m{i}") for i in range(1, 4)]
+    packed = packer.build(chain)
+    assert [l.message_id for l in packed] == [1, 2, 3]
+    assert [l.message_id for l in packer.lines(2)] == [1, 2]
+    ext = packer.extend(3, make_line(4, "bot", "answer"))
+    assert [l.message_id for l in ext] == [1, 2, 3, 4]
+    assert packer.extend(99, make_line(5, "u", "x")) is None
+    assert packer.render(ext).splitlines()[-1] == "bot: answer"
+
+
+def test_budget_drops_oldest_lines():
+    packer = ContextPacker(budget=10)
+    lines = [make_line(i, "u", "abcdefgh") for i in range(5)]   # 各 5 tokens
+    packed = packer.build(lines)
+    assert [l.message_id for l in packed] == [3, 4]
+    assert sum(l.tokens for l in packed) <= 10
+
+
+def test_chain_cache_is_bounded():
+    packer = ContextPacker(max_chains=2)
+    for i in range(3):
+        packer.build([make_line(i, "u", "x")])
+    assert packer.lines(0) is None
+    assert packer.lines(2) is not None
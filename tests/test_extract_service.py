@@ -0,0 +1,63 @@
+import asyncio
+import time
+
+import pytest
+
+from extract_service import ExtractService
+
+
+def _slow(value, delay=0.2):
+    time.sleep(delay)
+    return value
+
+
+def test_gather_runs_concurrently_and_keeps_order():
+    svc = ExtractService(max_workers=3, timeout=5)
+
+    async def main():
+        start = time.monotonic()
+        res = await svc.gather(_slow, ["a", "b", "c"])
+        return res, time.monotonic() - start
+
+    res, elapsed = asyncio.run(main())
+    svc.shutdown()
+    assert res == ["a", "b", "c"]
+    assert elapsed < 0.5
+
+
+def test_gather_returns_exceptions_in_place():
+    svc = ExtractService(max_workers=2, timeout=5)
+
+    def func(x):
+        if x == "bad":
+            raise ValueError(x)
+        return x
+
+    res = asyncio.run(svc.gather(func, ["ok", "bad"]))
+    svc.shutdown()
+    assert res[0] == "ok"
+    assert isinstance(res[1], ValueError)
+
+
+def test_run_times_out():
+    svc = ExtractService(max_workers=1, timeout=0.05)
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(svc.run(_slow, "x", 0.3))
+    svc.shutdown()
+
+
+def test_cancel_owner():
+    svc = ExtractService(max_workers=1, timeout=5)
+    owner = object()
+
+    async def main():
+        task = asyncio.create_task(svc.run(_slow, "x", 0.3, owner=owner))
+        await asyncio.sleep(0.05)
+        assert svc.pending(owner) == 1
+        assert svc.cancel(owner) == 1
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert svc.pending() == 0
+
+    asyncio.run(main())
+    svc.shutdown()
@@ -0,0 +1,102 @@
+import threading
+import time
+
+from frame_buffer import BufferBudget, FrameBuffer
+
+
+def _source(count, size=10):
+    frames = iter(range(count))
+
+    def read():
+        try:
+            i = next(frames)
+        except StopIteration:
+            return b""
+        return i.to_bytes(2, "big") * (size // 2)
+    return read
+
+
+def _index(data):
+    return int.from_bytes(data[:2], "big")
+
+
+def _wait_eof(buf):
+    for _ in range(200):
+        if buf.eof:
+            return
+        time.sleep(0.005)
+
+
+def test_reads_frames_in_order_until_eof():
+    buf = FrameBuffer(_source(100), capacity=4096)
+    got = []
+    while data := buf.read():
+        got.append(_index(data))
+    assert got == list(range(100))
+    assert buf.remaining() == 0
+    buf.close()
+
+
+def test_seek_inside_window_is_instant():
+    buf = FrameBuffer(_source(500), start=10.0, capacity=1 << 16, max_ahead=100)
+    _wait_eof(buf)
+    for _ in range(300):
+        buf.read()
+    assert buf.position == 10.0 + 300 * 0.02
+    assert buf.seek(12.0)               # 巻き戻し
+    assert _index(buf.read()) == 100
+    assert buf.seek(19.0)               # 先読み済みの早送り
+    assert _index(buf.read()) == 450
+    assert not buf.seek(9.0)            # 開始位置より前
+    assert not buf.seek(30.0)           # まだ読んでいない区間
+    buf.close()
+
+
+def test_ring_drops_played_frames_but_never_unread_ones():
+    buf = FrameBuffer(_source(1000), capacity=200, max_ahead=100)
+    got = []
+    while data := buf.read():
+        got.append(_index(data))
+    assert got == list(range(1000))
+    lo, hi = buf.window()
+    assert hi - lo <= 20 * 0.02         # 200 バイト = 20 フレーム分しか残らない
+    assert not buf.seek(0.0)
+    buf.close()
+
+
+def test_read_ahead_is_bounded():
+    buf = FrameBuffer(_source(10_000), capacity=1 << 20, max_ahead=1.0)
+    time.sleep(0.05)
+    lo, hi = buf.window()
+    assert hi - lo <= 1.0 + 1e-9
+    buf.close()
+
+
+def test_close_unblocks_reader():
+    gate = threading.Event()
+
+    def read():
+        gate.wait()
+        return b""
+
+    buf = FrameBuffer(read)
+    out = []
+    t = threading.Thread(target=lambda: out.append(buf.read()))
+    t.start()
+    buf.close()
+    t.join(1)
+    gate.set()
+    assert out == [b""]
+
+
+def test_budget_shrinks_buffers_but_keeps_minimum():
+    budget = BufferBudget(100)
+    assert budget.acquire(60, 10) == 60
+    assert budget.acquire(60, 10) == 40   # 残りだけ
+    assert budget.acquire(60, 10) == 10   # 使い切っても最低限は渡す
+    assert budget.used == 110
+    budget.release(60)
+    assert budget.acquire(60, 10) == 50
+    for size in (40, 10, 50):
+        budget.release(size)
+    assert budget.used == 0
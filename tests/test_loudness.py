@@ -0,0 +1,32 @@
+import pytest
+
+from loudness import db_to_linear, linear_to_db, normalize_gain_db, parse_ebur128
+
+SAMPLE = """
+[Parsed_ebur128_0 @ 0x5581] Summary:
+
+  Integrated loudness:
+    I:         -9.8 LUFS
+    Threshold: -20.1 LUFS
+
+  Loudness range:
+    LRA:         5.3 LU
+"""
+
+
+def test_parse_ebur128_summary():
+    assert parse_ebur128(SAMPLE) == -9.8
+    assert parse_ebur128("no summary here") is None
+    assert parse_ebur128("    I:         -inf LUFS\n") is None
+
+
+def test_normalize_gain_is_clamped():
+    assert normalize_gain_db(-9.8, target=-16.0) == pytest.approx(-6.2)
+    assert normalize_gain_db(-40.0, target=-16.0, max_boost=6.0) == 6.0
+    assert normalize_gain_db(10.0, target=-16.0, max_cut=20.0) == -20.0
+
+
+def test_db_conversions():
+    assert db_to_linear(0.0) == 1.0
+    assert linear_to_db(db_to_linear(-6.0)) == pytest.approx(-6.0)
+    assert linear_to_db(0.0) == float("-inf")
@@ -0,0 +1,105 @@
+import asyncio
+
+from panel_renderer import PanelScheduler
+
+
+def _make(content, applied, **kwargs):
+    def render(key):
+        return content[key], content[key]
+
+    async def apply(key, payload):
+        applied.append((key, payload))
+
+    return PanelScheduler(render, apply, **kwargs)
+
+
+def test_requests_are_coalesced():
+    content = {"g": "a"}
+    applied = []
+
+    async def main():
+        sched = _make(content, applied, min_interval=0.05)
+        for _ in range(10):
+            sched.request("g")
+        await asyncio.sleep(0.1)
+        return sched
+
+    sched = asyncio.run(main())
+    assert applied == [("g", "a")]
+    assert sched.stats["coalesced"] == 9
+    assert sched.stats["edits"] == 1
+
+
+def test_unchanged_render_is_suppressed():
+    content = {"g": "a"}
+    applied = []
+
+    async def main():
+        sched = _make(content, applied, min_interval=0.01)
+        sched.request("g")
+        await asyncio.sleep(0.05)
+        sched.request("g")
+        await asyncio.sleep(0.05)
+        content["g"] = "b"
+        sched.request("g")
+        await asyncio.sleep(0.05)
+        return sched
+
+    sched = asyncio.run(main())
+    assert [p for _, p in applied] == ["a", "b"]
+    assert sched.stats["suppressed"] == 1
+
+
+def test_token_bucket_limits_edits():
+    content = {i: str(i) for i in range(10)}
+    applied = []
+
+    async def main():
+        sched = _make(content, applied, min_interval=0.0, rate=1.0, burst=3)
+        for i in range(10):
+            sched.request(i)
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert len(applied) == 3
+
+
+def test_progress_ticks_until_interval_returns_none():
+    content = {"g": 0}
+    applied = []
+    ticks = {"n": 0}
+
+    def render(key):
+        content["g"] += 1
+        return content["g"], content["g"]
+
+    async def apply(key, payload):
+        applied.append(payload)
+
+    def interval(key):
+        ticks["n"] += 1
+        return 0.02 if ticks["n"] < 4 else None
+
+    async def main():
+        sched = PanelScheduler(render, apply, interval=interval, min_interval=0.0)
+        sched.start_progress("g")
+        await asyncio.sleep(0.2)
+
+    asyncio.run(main())
+    assert len(applied) == 3
+
+
+def test_tracked_until_forgotten():
+    content = {"g": "a"}
+    applied = []
+
+    async def main():
+        sched = _make(content, applied, min_interval=0.01)
+        sched.request("g")
+        await asyncio.sleep(0.05)
+        assert sched.tracked() == {"g"}
+        sched.forget("g")
+        return sched
+
+    sched = asyncio.run(main())
+    assert sched.tracked() == set()
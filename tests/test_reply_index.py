@@ -0,0 +1,40 @@
+from reply_index import ReplyIndex
+
+
+def test_chain_flag_is_inherited_from_parent():
+    idx = ReplyIndex()
+    assert idx.add(1, None, False) is False     # 普通の発言
+    assert idx.add(2, 1, True) is True          # Bot がそれに返信
+    assert idx.add(3, 2, False) is True         # ユーザーが Bot に返信
+    assert idx.add(4, 3, False) is True
+    assert idx.add(5, 1, False) is False        # Bot を含まない返信
+    assert idx.in_bot_chain(4) is True
+    assert idx.parent(4) == 3
+    assert 4 in idx and 99 not in idx
+
+
+def test_unknown_parent_is_unknown_unless_bot():
+    idx = ReplyIndex()
+    assert idx.add(10, 9, False) is None
+    assert idx.in_bot_chain(10) is None
+    assert idx.add(11, 9, True) is True
+    assert idx.in_bot_chain(12) is None
+
+
+def test_entries_are_bounded():
+    idx = ReplyIndex(max_entries=3)
+    for i in range(5):
+        idx.add(i, None, False)
+    assert len(idx) == 3
+    assert idx.in_bot_chain(0) is None
+    assert idx.parent(0) is None
+
+
+def test_message_cache_is_lru():
+    idx = ReplyIndex(max_messages=2)
+    idx.remember(1, "a")
+    idx.remember(2, "b")
+    assert idx.message(1) == "a"
+    idx.remember(3, "c")
+    assert idx.message(2) is None
+    assert idx.message(1) == "a" and idx.message(3) == "c"
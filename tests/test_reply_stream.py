@@ -0,0 +1,124 @@
+import asyncio
+
+from reply_stream import ReplyStream, split_text
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeChannel:
+    def __init__(self, delay=0.0, fail=None):
+        self.delay = delay
+        self.fail = list(fail or [])
+        self.inflight = 0
+        self.max_inflight = 0
+        self.log = []
+        self.sent = []
+
+    async def _op(self):
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise self.fail.pop(0)
+        finally:
+            self.inflight -= 1
+
+    async def send(self, text):
+        await self._op()
+        msg = FakeMessage(text)
+        self.sent.append(msg)
+        self.log.append(("send", text))
+        return msg
+
+    async def edit(self, msg, text):
+        await self._op()
+        msg.content = text
+        self.log.append(("edit", text))
+
+
+class RateLimited(Exception):
+    status = 429
+    retry_after = 0.02
+
+
+def test_split_text_prefers_newlines_and_is_stable():
+    text = "aaaa\nbbbb\ncccc"
+    assert split_text(text, 10) == ["aaaa\nbbbb", "cccc"]
+    assert split_text("x" * 25, 10) == ["x" * 10, "x" * 10, "x" * 5]
+    assert split_text("", 10) == [""]
+    longer = split_text(text + "dddd\neeee", 10)
+    assert longer[0] == "aaaa\nbbbb"
+
+
+def test_only_latest_is_sent_and_final_is_flushed():
+    ch = FakeChannel(delay=0.01)
+    first = FakeMessage("…")
+
+    async def main():
+        stream = ReplyStream(first, ch.send, ch.edit, min_interval=0.05)
+        text = ""
+        for i in range(50):
+            text += f"{i} "
+            stream.update(text)
+            await asyncio.sleep(0.002)
+        await stream.close()
+        return stream, text
+
+    stream, text = asyncio.run(main())
+    assert first.content == text
+    assert ch.max_inflight == 1
+    assert len(ch.log) < 10
+    assert stream.stats["skipped"] > 0
+    # 送った回数と飛ばした回数を足すと update の回数になる
+    assert stream.stats["edits"] + stream.stats["skipped"] == 50
+
+
+def test_overflow_goes_to_follow_up_messages():
+    ch = FakeChannel()
+    first = FakeMessage("…")
+
+    async def main():
+        stream = ReplyStream(first, ch.send, ch.edit, limit=10, min_interval=0)
+        stream.update("x" * 8)
+        await asyncio.sleep(0.01)
+        await stream.close("x" * 25)
+        return stream
+
+    stream = asyncio.run(main())
+    assert [m.content for m in stream.messages] == ["x" * 10, "x" * 10, "x" * 5]
+    assert [kind for kind, _ in ch.log] == ["edit", "edit", "send", "send"]
+
+
+def test_rate_limit_error_is_retried_with_longer_interval():
+    ch = FakeChannel(fail=[RateLimited()])
+    first = FakeMessage("…")
+
+    async def main():
+        stream = ReplyStream(first, ch.send, ch.edit, min_interval=0.01)
+        await stream.close("done")
+        return stream
+
+    stream = asyncio.run(main())
+    assert first.content == "done"
+    assert stream.stats["errors"] == 1
+    assert ch.log == [("edit", "done")]
+
+
+def test_gives_up_when_message_is_deleted():
+    class Gone(Exception):
+        status = 404
+
+    ch = FakeChannel(fail=[Gone()])
+    first = FakeMessage("…")
+
+    async def main():
+        stream = ReplyStream(first, ch.send, ch.edit)
+        stream.update("a")
+        await stream.close("ab")
+
+    asyncio.run(main())
+    assert first.content == "…"
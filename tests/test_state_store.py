@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+
+from state_store import StateStore
+
+
+def test_marks_are_coalesced_into_one_write(tmp_path):
+    store = StateStore(str(tmp_path), delay=0.01)
+    state = {"n": 0}
+    writes = []
+    orig = store._write
+
+    def write(key, text):
+        writes.append(key)
+        orig(key, text)
+
+    store._write = write
+
+    async def main():
+        for i in range(5):
+            state["n"] = i
+            store.mark("1", lambda: dict(state))
+        await asyncio.sleep(0.05)
+
+    asyncio.run(main())
+    assert writes == ["1"]
+    with open(tmp_path / "1.json", encoding="utf-8") as f:
+        assert json.load(f) == {"n": 4}
+
+
+def test_unchanged_snapshot_is_not_rewritten(tmp_path):
+    store = StateStore(str(tmp_path))
+    writes = []
+    orig = store._write
+    store._write = lambda key, text: (writes.append(key), orig(key, text))
+
+    async def main():
+        store.mark("1", lambda: {"a": 1})
+        await store.flush()
+        store.mark("1", lambda: {"a": 1})
+        await store.flush()
+        store.mark("1", lambda: {"a": 2})
+        await store.flush()
+
+    asyncio.run(main())
+    assert writes == ["1", "1"]
+
+
+def test_none_snapshot_and_discard_remove_file(tmp_path):
+    store = StateStore(str(tmp_path))
+
+    async def main():
+        store.mark("1", lambda: {"a": 1})
+        store.mark("2", lambda: {"b": 2})
+        await store.flush()
+        store.mark("1", lambda: None)
+        await store.flush()
+        store.mark("2", lambda: {"b": 3})
+        store.discard("2")
+        await store.flush()
+
+    asyncio.run(main())
+    assert os.listdir(tmp_path) == []
+
+
+def test_load_all_round_trip_and_skips_broken(tmp_path):
+    store = StateStore(str(tmp_path))
+
+    async def main():
+        store.mark("10", lambda: {"queue": ["a", "b"], "position": 12.5})
+        await store.flush()
+
+    asyncio.run(main())
+    (tmp_path / "20.json").write_text("{broken", encoding="utf-8")
+    (tmp_path / "30.json.tmp").write_text("{}", encoding="utf-8")
+
+    loaded = StateStore(str(tmp_path)).load_all()
+    assert loaded == {"10": {"queue": ["a", "b"], "position": 12.5}}
+    assert sorted(os.listdir(tmp_path)) == ["10.json"]
@@ -0,0 +1,87 @@
+import asyncio
+
+from thread_store import ThreadStore
+
+
+def test_claim_get_and_touch(tmp_path):
+    store = ThreadStore(str(tmp_path / "t.db"))
+
+    async def main():
+        assert await store.get(1) is None
+        info = await store.claim(1, "thread_a")
+        assert info.thread_id == "thread_a"
+        await store.touch(1, prompt_tokens=10, completion_tokens=5)
+        await store.touch(1, prompt_tokens=1)
+        return await store.get(1)
+
+    info = asyncio.run(main())
+    assert (info.requests, info.prompt_tokens, info.completion_tokens) == (2, 11, 5)
+
+
+def test_first_claim_wins_across_processes(tmp_path):
+    path = str(tmp_path / "t.db")
+    a, b = ThreadStore(path), ThreadStore(path)
+
+    async def main():
+        first = await a.claim(1, "from_a")
+        second = await b.claim(1, "from_b")
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert first.thread_id == second.thread_id == "from_a"
+
+
+def test_cache_is_refreshed_after_ttl(tmp_path):
+    path = str(tmp_path / "t.db")
+    a = ThreadStore(path, cache_ttl=0.0)
+    b = ThreadStore(path)
+
+    async def main():
+        await a.claim(1, "old")
+        await a.get(1)
+        await b.forget(1)
+        await b.claim(1, "new")
+        return await a.get(1)
+
+    assert asyncio.run(main()).thread_id == "new"
+
+
+def test_forget_only_matching_thread(tmp_path):
+    store = ThreadStore(str(tmp_path / "t.db"))
+
+    async def main():
+        await store.claim(1, "keep")
+        await store.forget(1, "other")
+        kept = await store.get(1)
+        await store.forget(1, "keep")
+        return kept, await store.get(1)
+
+    kept, gone = asyncio.run(main())
+    assert kept.thread_id == "keep" and gone is None
+
+
+def test_expire_returns_idle_threads_once(tmp_path):
+    path = str(tmp_path / "t.db")
+    a = ThreadStore(path, idle_ttl=100)
+    b = ThreadStore(path, idle_ttl=100)
+
+    async def main():
+        await a.claim(1, "idle")
+        await a.claim(2, "busy")
+        info = await a.get(1)
+        later = info.last_used + 101
+        await asyncio.to_thread(a._db.execute, "UPDATE threads SET last_used=? WHERE channel_id=2", (later,))
+        first = await a.expire(later)
+        second = await b.expire(later)
+        return first, second, await a.get(1), await a.get(2)
+
+    first, second, idle, busy = asyncio.run(main())
+    assert first == ["idle"] and second == []
+    assert idle is None and busy.thread_id == "busy"
+
+
+def test_import_legacy(tmp_path):
+    store = ThreadStore(str(tmp_path / "t.db"))
+    assert store.import_legacy({"1": "a", "2": "b", "x": "bad"}) == 2
+    assert store.import_legacy({"1": "c"}) == 0
+    assert asyncio.run(store.get(1)).thread_id == "a"
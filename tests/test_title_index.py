@@ -0,0 +1,49 @@
+from title_index import TitleIndex, normalize_title
+
+
+def _titles(results):
+    return [t for t, _ in results]
+
+
+def test_normalize_title():
+    assert normalize_title("  ＹＯＡＳＯＢＩ　「アイドル」 ") == "yoasobi 「アイドル」"
+
+
+def test_prefix_then_substring_then_fuzzy():
+    idx = TitleIndex()
+    idx.add(1, "Never Gonna Give You Up", "u1")
+    idx.add(1, "Give It Away", "u2")
+    idx.add(1, "Together Forever", "u3")
+    assert _titles(idx.search(1, "give")) == ["Give It Away", "Never Gonna Give You Up"]
+    # 打ち間違いでも trigram の一致で拾う
+    assert _titles(idx.search(1, "nevr gonna give")) == ["Never Gonna Give You Up"]
+    assert idx.search(1, "give")[0] == ("Give It Away", "u2")
+
+
+def test_short_query_and_japanese():
+    idx = TitleIndex()
+    idx.add(1, "夜に駆ける", "a")
+    idx.add(1, "群青", "b")
+    assert _titles(idx.search(1, "群")) == ["群青"]
+    assert _titles(idx.search(1, "夜に駆")) == ["夜に駆ける"]
+
+
+def test_guilds_are_separate_and_empty_query_returns_recent():
+    idx = TitleIndex()
+    idx.add(1, "a song", "1")
+    idx.add(1, "b song", "2")
+    idx.add(2, "c song", "3")
+    assert _titles(idx.search(1, "")) == ["b song", "a song"]
+    assert _titles(idx.search(2, "song")) == ["c song"]
+    assert idx.search(3, "song") == []
+
+
+def test_eviction_keeps_recently_used():
+    idx = TitleIndex(max_entries=2)
+    idx.add(1, "alpha", "a")
+    idx.add(1, "bravo", "b")
+    idx.add(1, "alpha", "a")   # 使い直したので残る
+    idx.add(1, "charlie", "c")
+    assert sorted(_titles(idx.search(1, ""))) == ["alpha", "charlie"]
+    assert idx.search(1, "bravo") == []
+    assert len(idx) == 2
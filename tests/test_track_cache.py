@@ -0,0 +1,106 @@
+import time
+
+import pytest
+
+from track_cache import TrackCache, normalize_codec, normalize_query, stream_codec, stream_expiry
+
+
+@pytest.mark.parametrize(
+    "query,expected",
+    [
+        ("https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=10", "yt:dQw4w9WgXcQ"),
+        ("https://youtu.be/dQw4w9WgXcQ", "yt:dQw4w9WgXcQ"),
+        ("https://youtube.com/shorts/dQw4w9WgXcQ", "yt:dQw4w9WgXcQ"),
+        ("  Never   Gonna Give You Up ", "q:never gonna give you up"),
+        ("https://Example.com/a#frag", "url:https://example.com/a"),
+    ],
+)
+def test_normalize_query(query, expected):
+    assert normalize_query(query) == expected
+
+
+def test_stream_expiry_uses_expire_param():
+    now = 1_000_000.0
+    url = f"https://rr1.googlevideo.com/videoplayback?expire={int(now + 600)}"
+    assert stream_expiry(url, 1800, now) == now + 540
+    assert stream_expiry("https://example.com/a.mp3", 1800, now) == now + 1800
+
+
+def test_codec_helpers():
+    assert normalize_codec("opus") == "opus"
+    assert normalize_codec("mp4a.40.2") == "aac"
+    assert normalize_codec("none") is None
+    base = "https://rr1.googlevideo.com/videoplayback?itag=251&mime="
+    assert stream_codec(base + "audio%2Fwebm") == "opus"
+    assert stream_codec(base + "audio%2Fmp4") == "aac"
+    assert stream_codec("https://example.com/a.mp3") is None
+
+
+def _store(cache, vid, query=None, stream=None):
+    cache.store(query, video_id=vid, title=f"title {vid}",
+                webpage_url=f"https://www.youtube.com/watch?v={vid}",
+                duration=200, stream_url=stream)
+
+
+def test_lookup_by_query_and_url(tmp_path):
+    cache = TrackCache(str(tmp_path / "c.db"))
+    _store(cache, "dQw4w9WgXcQ", query="rick astley", stream="https://s/1")
+    hit = cache.lookup("Rick  Astley")
+    assert hit.title == "title dQw4w9WgXcQ"
+    assert hit.stream_url == "https://s/1"
+    assert cache.lookup("https://youtu.be/dQw4w9WgXcQ").video_id == "dQw4w9WgXcQ"
+    assert cache.lookup("something else") is None
+
+
+def test_stream_url_expires_but_metadata_stays(tmp_path):
+    cache = TrackCache(str(tmp_path / "c.db"), stream_ttl=-1)
+    _store(cache, "dQw4w9WgXcQ", query="rick", stream="https://s/1")
+    hit = cache.lookup("rick")
+    assert hit is not None
+    assert hit.stream_url is None
+    cache.stream_ttl = 60
+    # 再解決した URL は _resolve_stream と同じく store() で上書きする
+    _store(cache, "dQw4w9WgXcQ", stream="https://s/2")
+    assert cache.get("dQw4w9WgXcQ").stream_url == "https://s/2"
+
+
+def test_lru_eviction(tmp_path):
+    cache = TrackCache(str(tmp_path / "c.db"), max_entries=2)
+    _store(cache, "aaaaaaaaaaa", query="a")
+    time.sleep(0.01)
+    _store(cache, "bbbbbbbbbbb", query="b")
+    time.sleep(0.01)
+    assert cache.lookup("a") is not None  # a を最近使ったことにする
+    time.sleep(0.01)
+    _store(cache, "ccccccccccc", query="c")
+    assert len(cache) == 2
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") is not None
+    assert cache.lookup("c") is not None
+
+
+def test_loudness_survives_metadata_refresh(tmp_path):
+    cache = TrackCache(str(tmp_path / "c.db"))
+    _store(cache, "dQw4w9WgXcQ", query="rick")
+    assert cache.get("dQw4w9WgXcQ").loudness is None
+    cache.store_loudness("dQw4w9WgXcQ", -11.5)
+    _store(cache, "dQw4w9WgXcQ", query="rick", stream="https://s/1")
+    assert cache.lookup("rick").loudness == -11.5
+
+
+def test_old_database_gains_loudness_column(tmp_path):
+    import sqlite3
+
+    path = str(tmp_path / "old.db")
+    db = sqlite3.connect(path)
+    db.execute(
+        "CREATE TABLE videos (video_id TEXT PRIMARY KEY, title TEXT NOT NULL, "
+        "webpage_url TEXT NOT NULL, duration INTEGER, stream_url TEXT, "
+        "stream_expires REAL, created REAL NOT NULL, last_access REAL NOT NULL)"
+    )
+    db.commit()
+    db.close()
+    cache = TrackCache(path)
+    _store(cache, "dQw4w9WgXcQ", query="rick")
+    cache.store_loudness("dQw4w9WgXcQ", -20.0)
+    assert cache.get("dQw4w9WgXcQ").loudness == -20.0
@@ -0,0 +1,99 @@
+from array import array
+
+import pytest
+
+from track_mixer import TrackMixer, mix_pcm
+
+
+class FakeDeck:
+    def __init__(self, frames, opus=False):
+        self.frames = list(frames)
+        self.pos = 0
+        self.opus = opus
+        self.cleaned = False
+
+    def read(self):
+        if self.pos >= len(self.frames):
+            return b""
+        self.pos += 1
+        return self.frames[self.pos - 1]
+
+    def is_opus(self):
+        return self.opus
+
+    def cleanup(self):
+        self.cleaned = True
+
+    def remaining(self):
+        return len(self.frames) - self.pos
+
+
+def _pcm(value, samples=4):
+    return array("h", [value] * samples).tobytes()
+
+
+def test_gapless_switch_and_events():
+    events = []
+    a = FakeDeck([b"a1", b"a2"], opus=True)
+    b = FakeDeck([b"b1"], opus=True)
+    mixer = TrackMixer(a, tag="A", on_event=lambda k, t: events.append((k, t)))
+    mixer.queue_next(b, tag="B")
+    out = [mixer.read() for _ in range(4)]
+    assert out == [b"a1", b"a2", b"b1", b""]
+    assert a.cleaned and mixer.current is b
+    assert ("switched", "B") in events
+    assert events[0] == ("draining", "A")
+
+
+def test_without_next_ends_stream():
+    mixer = TrackMixer(FakeDeck([b"x"]))
+    assert mixer.read() == b"x"
+    assert mixer.read() == b""
+
+
+def test_clear_next_and_skip():
+    a, b, c = FakeDeck([b"a"] * 5), FakeDeck([b"b"] * 5), FakeDeck([b"c"] * 5)
+    mixer = TrackMixer(a)
+    assert not mixer.skip()
+    mixer.queue_next(b, tag="B")
+    assert mixer.clear_next() and b.cleaned
+    mixer.queue_next(c, tag="C")
+    assert mixer.skip()
+    assert mixer.read() == b"c"
+    assert mixer.current_tag == "C"
+
+
+def test_crossfade_overlaps_last_frames():
+    a = FakeDeck([_pcm(1000)] * 6)
+    b = FakeDeck([_pcm(0)] * 2 + [_pcm(500)] * 4)
+    mixer = TrackMixer(a, fade_frames=4)
+    mixer.queue_next(b)
+    out = [array("h", mixer.read())[0] for _ in range(7)]
+    assert out[:2] == [1000, 1000]
+    assert out[2:6] == [750, 500, 625, 500]   # 重なっている 4 フレーム
+    assert out[6] == 500
+    assert mixer.current is b
+
+
+def test_opus_decks_are_not_mixed():
+    a = FakeDeck([b"a"] * 3, opus=True)
+    b = FakeDeck([b"b"] * 3, opus=True)
+    mixer = TrackMixer(a, fade_frames=2)
+    mixer.queue_next(b)
+    assert b"".join(mixer.read() for _ in range(6)) == b"aaabbb"
+
+
+def test_mix_pcm_clips():
+    assert array("h", mix_pcm(_pcm(30000), _pcm(30000), 1.0, 1.0))[0] == 32767
+
+
+def test_output_type_is_fixed_for_the_mixer_lifetime():
+    a = FakeDeck([b"a"], opus=True)
+    mixer = TrackMixer(a)
+    with pytest.raises(ValueError):
+        mixer.queue_next(FakeDeck([_pcm(1)], opus=False))
+    assert not mixer.has_next
+    mixer.queue_next(FakeDeck([b"b"], opus=True))
+    mixer.read()
+    mixer.read()
+    assert mixer.is_opus()
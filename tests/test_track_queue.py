@@ -0,0 +1,97 @@
+import random
+
+import pytest
+
+from track_queue import TrackQueue
+
+
+def test_basic_order_and_indexing():
+    q = TrackQueue("abcde")
+    assert list(q) == list("abcde")
+    assert len(q) == 5
+    assert q[0] == "a" and q[-1] == "e" and q[2] == "c"
+    assert q.items(1, 3) == ["b", "c"]
+    with pytest.raises(IndexError):
+        q[5]
+
+
+def test_ids_are_stable_across_mutations():
+    q = TrackQueue()
+    ids = q.extend("abcde")
+    c_id = ids[2]
+    q.popleft()
+    q.insert(0, "x")
+    q.move(0, 4)
+    assert q.get(c_id) == "c"
+    assert q[q.index_of(c_id)] == "c"
+    assert q.remove_id(c_id) == "c"
+    assert q.remove_id(c_id) is None
+    assert "c" not in list(q)
+
+
+def test_delete_range_and_move():
+    q = TrackQueue(range(10))
+    assert q.delete_range(2, 5) == [2, 3, 4]
+    assert list(q) == [0, 1, 5, 6, 7, 8, 9]
+    q.move(0, 6)
+    assert list(q) == [1, 5, 6, 7, 8, 9, 0]
+    q.move(6, 0)
+    assert list(q) == [0, 1, 5, 6, 7, 8, 9]
+
+
+def test_version_changes_on_mutation():
+    q = TrackQueue()
+    v = q.version
+    q.append("a")
+    assert q.version > v
+    v = q.version
+    list(q)
+    q.items(0, 1)
+    assert q.version == v
+
+
+def test_shuffle_keeps_entries():
+    q = TrackQueue()
+    ids = q.extend(range(50))
+    q.shuffle(random.Random(1))
+    assert sorted(q) == list(range(50))
+    for eid, val in zip(ids, range(50)):
+        assert q[q.index_of(eid)] == val
+
+
+def test_matches_list_under_random_operations():
+    rng = random.Random(42)
+    q = TrackQueue()
+    ref = []
+    ids = []
+    for step in range(2000):
+        op = rng.random()
+        if op < 0.4 or not ref:
+            eid = q.append(step)
+            ref.append(step)
+            ids.append(eid)
+        elif op < 0.55:
+            i = rng.randrange(len(ref))
+            assert q.pop(i) == ref.pop(i)
+            ids.pop(i)
+        elif op < 0.7:
+            i = rng.randrange(len(ref))
+            assert q.remove_id(ids[i]) == ref.pop(i)
+            ids.pop(i)
+        elif op < 0.8:
+            i, j = rng.randrange(len(ref)), rng.randrange(len(ref))
+            q.move(i, j)
+            ref.insert(j, ref.pop(i))
+            ids.insert(j, ids.pop(i))
+        elif op < 0.85:
+            i = rng.randrange(len(ref))
+            j = i + rng.randrange(5)
+            assert q.delete_range(i, j) == ref[i:j]
+            del ref[i:j]
+            del ids[i:j]
+        else:
+            i = rng.randrange(len(ref))
+            assert q[i] == ref[i]
+            assert q.index_of(ids[i]) == i
+    assert list(q) == ref
+    assert q.ids() == ids
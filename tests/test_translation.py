@@ -0,0 +1,135 @@
+import asyncio
+
+import pytest
+
+from translation import Translator, combine_translations
+
+
+class FakeAPI:
+    def __init__(self, delay=0.01, fail=0, drop=()):
+        self.delay = delay
+        self.fail = fail
+        self.drop = set(drop)
+        self.calls = []
+
+    async def __call__(self, text, targets):
+        self.calls.append((text, list(targets)))
+        await asyncio.sleep(self.delay)
+        if self.fail:
+            self.fail -= 1
+            raise RuntimeError("boom")
+        return {t: f"{t[0]}:{text}" for t in targets if t[0] not in self.drop}
+
+
+def test_concurrent_requests_share_one_call():
+    api = FakeAPI()
+    tr = Translator(api, window=0.01)
+
+    async def main():
+        return await asyncio.gather(*(tr.translate(1, "hello", "French") for _ in range(5)))
+
+    assert asyncio.run(main()) == ["French:hello"] * 5
+    assert len(api.calls) == 1
+    assert tr.stats["joined"] == 4
+
+
+def test_languages_within_window_are_batched():
+    api = FakeAPI()
+    tr = Translator(api, window=0.05)
+
+    async def main():
+        first = asyncio.ensure_future(tr.translate(1, "hi", "English", "🇺🇸"))
+        await asyncio.sleep(0.01)
+        rest = await asyncio.gather(tr.translate(1, "hi", "Korean", "🇰🇷"),
+                                    tr.translate(1, "hi", "French", "🇫🇷"),
+                                    tr.translate(2, "yo", "French", "🇫🇷"))
+        return [await first, *rest]
+
+    results = asyncio.run(main())
+    assert results == ["English:hi", "Korean:hi", "French:hi", "French:yo"]
+    assert sorted(len(targets) for _, targets in api.calls) == [1, 3]
+    assert tr.stats == {"requests": 2, "targets": 4, "hits": 0, "joined": 0, "errors": 0}
+
+
+def test_cache_is_keyed_by_content_and_target():
+    api = FakeAPI(delay=0)
+    tr = Translator(api, window=0)
+
+    async def main():
+        await tr.translate(1, "hello", "French")
+        hit = await tr.translate(1, "hello", "French")
+        await tr.translate(1, "hello (edited)", "French")
+        await tr.translate(1, "hello", "English", "🇺🇸")
+        await tr.translate(1, "hello", "English", "🇬🇧")
+        return hit
+
+    assert asyncio.run(main()) == "French:hello"
+    assert len(api.calls) == 4
+    assert tr.stats["hits"] == 1
+
+
+def test_lru_eviction():
+    api = FakeAPI(delay=0)
+    tr = Translator(api, window=0, max_entries=2)
+
+    async def main():
+        for mid in (1, 2, 1, 3, 1, 2):
+            await tr.translate(mid, "x", "French")
+
+    asyncio.run(main())
+    # 1 は使われ続けるので残り、2 は 3 に押し出されて取り直しになる
+    assert len(api.calls) == 4
+    assert len(tr) == 2
+
+
+def test_errors_reach_all_waiters_and_are_not_cached():
+    api = FakeAPI(fail=1)
+    tr = Translator(api, window=0)
+
+    async def main():
+        first = await asyncio.gather(*(tr.translate(1, "hi", "German") for _ in range(3)),
+                                     return_exceptions=True)
+        second = await tr.translate(1, "hi", "German")
+        return first, second
+
+    first, second = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in first)
+    assert second == "German:hi"
+    assert len(api.calls) == 2 and tr.stats["errors"] == 1
+
+
+def test_missing_target_fails_only_that_language():
+    api = FakeAPI(drop={"Korean"})
+    tr = Translator(api, window=0.01)
+
+    async def main():
+        return await asyncio.gather(tr.translate(1, "hi", "Korean"), tr.translate(1, "hi", "French"),
+                                    return_exceptions=True)
+
+    korean, french = asyncio.run(main())
+    assert isinstance(korean, KeyError)
+    assert french == "French:hi"
+
+
+def test_combine_translations_fits_limit():
+    assert combine_translations([("A", "one"), ("B", "two")]) == "A\none\n\nB\ntwo"
+    text = combine_translations([("A", "short"), ("B", "x" * 3000), ("C", "y" * 3000)], limit=200)
+    assert len(text) <= 200
+    assert "short" in text and text.count("...") == 2
+
+
+@pytest.mark.parametrize("n", [1, 5])
+def test_combine_translations_truncates_evenly(n):
+    text = combine_translations([(f"H{i}", "z" * 1000) for i in range(n)], limit=500)
+    assert len(text) <= 500
+    assert text.count("...") == n
+
+
+def test_combine_translations_never_exceeds_limit_with_many_sections():
+    sections = [(f"💬 🇺🇸 **Language{i}** translation:", "w" * (i * 37 % 400)) for i in range(80)]
+    for limit in (50, 200, 1000, 2000):
+        for n in (1, 10, 40, 80):
+            assert len(combine_translations(sections[:n], limit=limit)) <= limit
+    # 見出しが入りきらない言語は落とし、先に来た言語を残す
+    text = combine_translations(sections, limit=2000)
+    assert text.startswith(sections[0][0]) and sections[-1][0] not in text
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from voice_manager import CONNECTED, IDLE, VoiceManager
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_guilds_connect_independently():
+    vm = VoiceManager()
+    order = []
+
+    async def slow():
+        order.append("slow start")
+        await asyncio.sleep(0.05)
+        order.append("slow end")
+        return "a"
+
+    async def fast():
+        order.append("fast")
+        return "b"
+
+    async def main():
+        return await asyncio.gather(
+            vm.connect(1, slow, timeout=1),
+            vm.connect(2, fast, timeout=1),
+        )
+
+    assert asyncio.run(main()) == ["a", "b"]
+    assert order == ["slow start", "fast", "slow end"]
+    assert vm.state(1) == vm.state(2) == CONNECTED
+    assert vm.stats()["connects"] == 2
+
+
+def test_same_guild_reuses_connection_made_while_waiting():
+    vm = VoiceManager()
+    made = []
+
+    async def factory():
+        await asyncio.sleep(0.01)
+        made.append(object())
+        return made[-1]
+
+    def current():
+        return made[-1] if made else None
+
+    async def main():
+        return await asyncio.gather(
+            vm.connect(1, factory, timeout=1, current=current),
+            vm.connect(1, factory, timeout=1, current=current),
+        )
+
+    a, b = asyncio.run(main())
+    assert a is b and len(made) == 1
+
+
+def test_timeout_is_counted_and_state_cleared():
+    vm = VoiceManager()
+
+    async def hang():
+        await asyncio.sleep(1)
+
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(vm.connect(1, hang, timeout=0.01))
+    assert vm.state(1) == IDLE
+    assert vm.stats()["timeouts"] == 1
+
+
+def test_suppression_expires():
+    clock = FakeClock()
+    vm = VoiceManager(suppress_ttl=60, clock=clock)
+    vm.suppress(1)
+    clock.now = 30
+    assert vm.suppressed(1) == pytest.approx(30)
+    clock.now = 61
+    assert vm.suppressed(1) == 0
+    assert vm.stats()["suppressed"] == 0
+
+
+def test_backoff_grows_until_cap_and_resets():
+    vm = VoiceManager(backoff_base=1, backoff_cap=8)
+    delays = [vm.reconnecting(1) for _ in range(6)]
+    for d, limit in zip(delays, [1, 2, 4, 8, 8, 8]):
+        assert limit / 2 <= d <= limit
+    assert vm.stats()["reconnects"] == 6
+    vm.connected(1)
+    assert vm.backoff(1) <= 1
+    vm.disconnected(1)
+    assert vm.state(1) == IDLE
@@ -1,11 +1,170 @@
-import shelve
+from __future__ import annotations
 
-_DB = shelve.open("threads.db")
+import asyncio
+import collections
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
 
 
-def get(channel_id: int) -> str | None:
-    return _DB.get(str(channel_id))
+@dataclass
+class ThreadInfo:
+    channel_id: int
+    thread_id: str
+    created: float
+    last_used: float
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
 
 
-def save(channel_id: int, thread_id: str):
-    _DB[str(channel_id)] = thread_id
+class ThreadStore:
+    """チャンネル → OpenAI スレッドの対応を持つ SQLite ストア
+
+    - WAL モード + busy_timeout なので複数の Bot プロセスから同時に使える
+      (新規作成は INSERT が先に成功した方のスレッドに揃える)
+    - 読み出しは ``cache_size`` 件の LRU に ``cache_ttl`` 秒だけ載せる
+      (他プロセスの更新もその時間内に反映される)
+    - 利用回数・トークン数を記録し、``idle_ttl`` 秒使われなかったスレッドは
+      ``expire()`` で削除して ID を返す (OpenAI 側の削除は呼び出し側で行う)
+    - SQLite の呼び出しはすべてワーカースレッドで行い、イベントループを止めない
+    """
+
+    def __init__(self, path: str, *, cache_size: int = 1024, cache_ttl: float = 60.0,
+                 idle_ttl: float = 30 * 86400):
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.idle_ttl = idle_ttl
+        self._cache: collections.OrderedDict[int, tuple[float, ThreadInfo]] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                                   timeout=10.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS threads (
+                channel_id        INTEGER PRIMARY KEY,
+                thread_id         TEXT NOT NULL,
+                created           REAL NOT NULL,
+                last_used         REAL NOT NULL,
+                requests          INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens     INTEGER NOT NULL DEFAULT 0,
+                completion_tokens INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS idx_threads_used ON threads(last_used);
+            """
+        )
+
+    # ---- 公開 API (async) ----
+    async def get(self, channel_id: int) -> ThreadInfo | None:
+        now = time.time()
+        hit = self._cache.get(channel_id)
+        if hit is not None and now - hit[0] < self.cache_ttl:
+            self._cache.move_to_end(channel_id)
+            return hit[1]
+        info = await asyncio.to_thread(self._get, channel_id)
+        self._remember(channel_id, info)
+        return info
+
+    async def claim(self, channel_id: int, thread_id: str) -> ThreadInfo:
+        """新しく作ったスレッドを登録する
+
+        他のプロセスが先に登録していればそちらを返す (thread_id は使われない)。
+        """
+        info = await asyncio.to_thread(self._claim, channel_id, thread_id)
+        self._remember(channel_id, info)
+        return info
+
+    async def touch(self, channel_id: int, *, prompt_tokens: int = 0,
+                    completion_tokens: int = 0) -> None:
+        """利用を記録する (最終利用時刻・回数・トークン数)"""
+        await asyncio.to_thread(self._touch, channel_id, prompt_tokens, completion_tokens)
+        self._cache.pop(channel_id, None)
+
+    async def forget(self, channel_id: int, thread_id: str | None = None) -> None:
+        """対応を消す (thread_id を渡すと、それが登録されている場合だけ)"""
+        await asyncio.to_thread(self._forget, channel_id, thread_id)
+        self._cache.pop(channel_id, None)
+
+    async def expire(self, now: float | None = None) -> list[str]:
+        """idle_ttl 秒使われていないスレッドを削除し、その thread_id を返す"""
+        expired = await asyncio.to_thread(self._expire, now or time.time())
+        for channel_id, _ in expired:
+            self._cache.pop(channel_id, None)
+        return [tid for _, tid in expired]
+
+    def import_legacy(self, mapping: dict[str, str]) -> int:
+        """旧 shelve ストアの {チャンネルID: スレッドID} を取り込む (既存の対応は残す)"""
+        now = time.time()
+        rows = [(int(k), v, now, now) for k, v in mapping.items() if str(k).isdecimal()]
+        with self._lock:
+            before = self._db.total_changes
+            self._db.executemany(
+                "INSERT OR IGNORE INTO threads(channel_id, thread_id, created, last_used) "
+                "VALUES (?,?,?,?)", rows)
+            return self._db.total_changes - before
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+    # ---- 内部 (ワーカースレッド) ----
+    def _remember(self, channel_id: int, info: ThreadInfo | None) -> None:
+        if info is None:
+            self._cache.pop(channel_id, None)
+            return
+        self._cache[channel_id] = (time.time(), info)
+        self._cache.move_to_end(channel_id)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _get(self, channel_id: int) -> ThreadInfo | None:
+        with self._lock:
+            row = self._db.execute(
+                "SELECT channel_id, thread_id, created, last_used, requests, prompt_tokens, "
+                "completion_tokens FROM threads WHERE channel_id=?", (channel_id,)
+            ).fetchone()
+        return ThreadInfo(*row) if row else None
+
+    def _claim(self, channel_id: int, thread_id: str) -> ThreadInfo:
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO threads(channel_id, thread_id, created, last_used) "
+                "VALUES (?,?,?,?)", (channel_id, thread_id, now, now))
+        info = self._get(channel_id)
+        assert info is not None
+        return info
+
+    def _touch(self, channel_id: int, prompt: int, completion: int) -> None:
+        with self._lock:
+            self._db.execute(
+                "UPDATE threads SET last_used=?, requests=requests+1, "
+                "prompt_tokens=prompt_tokens+?, completion_tokens=completion_tokens+? "
+                "WHERE channel_id=?", (time.time(), prompt, completion, channel_id))
+
+    def _forget(self, channel_id: int, thread_id: str | None) -> None:
+        with self._lock:
+            if thread_id is None:
+                self._db.execute("DELETE FROM threads WHERE channel_id=?", (channel_id,))
+            else:
+                self._db.execute("DELETE FROM threads WHERE channel_id=? AND thread_id=?",
+                                 (channel_id, thread_id))
+
+    def _expire(self, now: float) -> list[tuple[int, str]]:
+        cutoff = now - self.idle_ttl
+        with self._lock:
+            # 書き込みロックを取ってから選ぶので、他プロセスと同じ行を二重に返さない
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._db.execute(
+                    "SELECT channel_id, thread_id FROM threads WHERE last_used < ?", (cutoff,)
+                ).fetchall()
+                self._db.execute("DELETE FROM threads WHERE last_used < ?", (cutoff,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return rows
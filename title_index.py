@@ -0,0 +1,97 @@
+from __future__ import annotations
+
+import collections
+import unicodedata
+from typing import Hashable
+
+
+def normalize_title(text: str) -> str:
+    """検索用に曲名を正規化する (全角半角・大文字小文字・空白の違いを無視)"""
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
+def trigrams(text: str) -> set[str]:
+    """正規化済み文字列の 3 文字組 (先頭は空白で埋めて前方一致を効かせる)"""
+    padded = f"  {text}"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class _GuildIndex:
+    def __init__(self):
+        self.entries: collections.OrderedDict[str, tuple[str, str]] = collections.OrderedDict()
+        self.grams: dict[str, set[str]] = {}   # trigram -> 正規化済み曲名
+
+
+class TitleIndex:
+    """再生した曲名からオートコンプリート候補を引くギルドごとの索引
+
+    - ``add`` した (曲名, 値) をギルドごとに最大 ``max_entries`` 件、使った順に保持
+    - ``search`` は前方一致 → 部分一致 → trigram の一致率の順に並べる
+      (打ち間違いや語順違いも拾う)。空文字なら最近の曲を返す
+    - メモリ上だけで完結するので Discord の 3 秒の応答期限に収まる
+    """
+
+    def __init__(self, max_entries: int = 2000, min_score: float = 0.4):
+        self.max_entries = max_entries
+        self.min_score = min_score
+        self._guilds: dict[Hashable, _GuildIndex] = {}
+
+    def __len__(self) -> int:
+        return sum(len(g.entries) for g in self._guilds.values())
+
+    def add(self, guild: Hashable, title: str, value: str) -> None:
+        """曲名と、選ばれたときに渡す値 (URL など) を登録する"""
+        key = normalize_title(title)
+        if not key:
+            return
+        g = self._guilds.setdefault(guild, _GuildIndex())
+        if key not in g.entries:
+            for gram in trigrams(key):
+                g.grams.setdefault(gram, set()).add(key)
+        g.entries[key] = (title, value)
+        g.entries.move_to_end(key)
+        while len(g.entries) > self.max_entries:
+            old, _ = g.entries.popitem(last=False)
+            self._unlink(g, old)
+
+    def forget(self, guild: Hashable) -> None:
+        self._guilds.pop(guild, None)
+
+    def search(self, guild: Hashable, query: str, limit: int = 25) -> list[tuple[str, str]]:
+        """query に近い (曲名, 値) を最大 limit 件返す"""
+        g = self._guilds.get(guild)
+        if g is None or limit <= 0:
+            return []
+        q = normalize_title(query)
+        if not q:
+            return [g.entries[k] for k in reversed(list(g.entries)[-limit:])]
+
+        recency = {k: i for i, k in enumerate(g.entries)}
+        scored: list[tuple[tuple, str]] = []
+        if len(q) < 3:
+            # 短すぎて trigram が効かないので部分一致だけを見る
+            for key in g.entries:
+                if q in key:
+                    scored.append(((key.startswith(q), 1.0, recency[key]), key))
+        else:
+            qgrams = trigrams(q)
+            hits: collections.Counter[str] = collections.Counter()
+            for gram in qgrams:
+                hits.update(g.grams.get(gram, ()))
+            for key, n in hits.items():
+                score = n / len(qgrams)
+                if q in key:
+                    score = 1.0
+                elif score < self.min_score:
+                    continue
+                scored.append(((key.startswith(q), score, recency[key]), key))
+        scored.sort(reverse=True)
+        return [g.entries[key] for _, key in scored[:limit]]
+
+    def _unlink(self, g: _GuildIndex, key: str) -> None:
+        for gram in trigrams(key):
+            keys = g.grams.get(gram)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del g.grams[gram]
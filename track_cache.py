@@ -0,0 +1,233 @@
+from __future__ import annotations
+
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from urllib.parse import parse_qs, urlparse, urlunparse
+
+
+_YT_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+
+def youtube_video_id(url: str) -> str | None:
+    """YouTube の URL から動画 ID を取り出す (該当しなければ None)"""
+    try:
+        p = urlparse(url)
+    except Exception:
+        return None
+    host = (p.hostname or "").lower()
+    vid = None
+    if host == "youtu.be":
+        vid = p.path.lstrip("/").split("/")[0]
+    elif host.endswith("youtube.com") or host.endswith("youtube-nocookie.com"):
+        if p.path == "/watch":
+            vid = parse_qs(p.query).get("v", [None])[0]
+        else:
+            parts = p.path.strip("/").split("/")
+            if len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+                vid = parts[1]
+    if vid and _YT_ID_RE.match(vid):
+        return vid
+    return None
+
+
+def normalize_query(query: str) -> str:
+    """キャッシュキー用に URL / 検索語を正規化する"""
+    q = query.strip()
+    if q.startswith(("http://", "https://")):
+        vid = youtube_video_id(q)
+        if vid:
+            return f"yt:{vid}"
+        p = urlparse(q)
+        return "url:" + urlunparse(p._replace(
+            scheme=p.scheme.lower(), netloc=p.netloc.lower(), fragment=""))
+    return "q:" + " ".join(q.casefold().split())
+
+
+def stream_expiry(url: str, ttl: float, now: float | None = None) -> float:
+    """ストリーム URL の有効期限 (epoch 秒)
+
+    googlevideo の URL は ``expire`` パラメータを持つので、あればそれと
+    ``ttl`` の短い方を採用する。
+    """
+    now = time.time() if now is None else now
+    expires = now + ttl
+    try:
+        exp = parse_qs(urlparse(url).query).get("expire", [None])[0]
+        if exp:
+            expires = min(expires, float(exp) - 60)
+    except Exception:
+        pass
+    return expires
+
+
+def normalize_codec(acodec: str | None) -> str | None:
+    """yt-dlp の acodec ("opus", "mp4a.40.2", "none" など) を短い名前にする"""
+    if not acodec or acodec == "none":
+        return None
+    name = acodec.split(".", 1)[0].lower()
+    return "aac" if name == "mp4a" else name
+
+
+def stream_codec(url: str) -> str | None:
+    """ストリーム URL から音声コーデックを推測する (分からなければ None)
+
+    googlevideo の URL は ``mime`` パラメータを持ち、audio/webm は常に Opus。
+    """
+    try:
+        p = urlparse(url)
+        mime = parse_qs(p.query).get("mime", [""])[0].lower()
+    except Exception:
+        return None
+    if mime == "audio/webm":
+        return "opus"
+    if mime == "audio/mp4":
+        return "aac"
+    if p.path.lower().endswith(".opus"):
+        return "opus"
+    return None
+
+
+@dataclass
+class CachedTrack:
+    video_id: str
+    title: str
+    webpage_url: str
+    duration: int | None
+    stream_url: str | None     # 期限切れなら None
+    stream_expires: float | None = None
+    loudness: float | None = None   # integrated loudness (LUFS, 未測定なら None)
+
+
+class TrackCache:
+    """yt_extract 結果 (タイトル/長さ/動画ID) の SQLite キャッシュ
+
+    検索語・URL → 動画ID の対応と、動画ごとのメタデータを別テーブルで持つ。
+    メタデータは ``meta_ttl`` 秒、ストリーム URL は ``stream_ttl`` 秒で失効し、
+    ``max_entries`` を超えたら最終アクセスが古い動画から削除する (LRU)。
+    """
+
+    def __init__(self, path: str, *, max_entries: int = 5000,
+                 meta_ttl: float = 30 * 86400, stream_ttl: float = 1800):
+        self.max_entries = max_entries
+        self.meta_ttl = meta_ttl
+        self.stream_ttl = stream_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS videos (
+                video_id       TEXT PRIMARY KEY,
+                title          TEXT NOT NULL,
+                webpage_url    TEXT NOT NULL,
+                duration       INTEGER,
+                stream_url     TEXT,
+                stream_expires REAL,
+                loudness       REAL,
+                created        REAL NOT NULL,
+                last_access    REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS queries (
+                key      TEXT PRIMARY KEY,
+                video_id TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_videos_access ON videos(last_access);
+            CREATE INDEX IF NOT EXISTS idx_queries_video ON queries(video_id);
+            """
+        )
+        cols = {row[1] for row in self._db.execute("PRAGMA table_info(videos)")}
+        if "loudness" not in cols:  # 旧バージョンで作ったファイル
+            self._db.execute("ALTER TABLE videos ADD COLUMN loudness REAL")
+
+    # ---- 参照 ----
+    def _row_to_cached(self, row, now: float) -> CachedTrack:
+        vid, title, page, dur, stream, expires, loudness = row
+        if not stream or expires is None or expires <= now:
+            stream, expires = None, None
+        return CachedTrack(vid, title, page, dur, stream, expires, loudness)
+
+    def lookup(self, query: str) -> CachedTrack | None:
+        """検索語/URL からキャッシュ済みトラックを返す"""
+        return self._get("SELECT video_id FROM queries WHERE key=?", normalize_query(query))
+
+    def get(self, video_id: str) -> CachedTrack | None:
+        """動画 ID からキャッシュ済みトラックを返す"""
+        return self._get(None, video_id)
+
+    def _get(self, key_sql: str | None, key: str) -> CachedTrack | None:
+        now = time.time()
+        with self._lock:
+            if key_sql is not None:
+                row = self._db.execute(key_sql, (key,)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                key = row[0]
+            row = self._db.execute(
+                "SELECT video_id, title, webpage_url, duration, stream_url, stream_expires, "
+                "loudness, created FROM videos WHERE video_id=?", (key,)
+            ).fetchone()
+            if row is None or row[7] + self.meta_ttl <= now:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE videos SET last_access=? WHERE video_id=?", (now, key))
+            self.hits += 1
+        return self._row_to_cached(row[:7], now)
+
+    # ---- 登録 ----
+    def store(self, query: str | None, *, video_id: str, title: str, webpage_url: str,
+              duration: int | None, stream_url: str | None = None) -> None:
+        """メタデータ (と分かればストリーム URL) を保存し、query を紐づける"""
+        now = time.time()
+        expires = stream_expiry(stream_url, self.stream_ttl, now) if stream_url else None
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO videos(video_id, title, webpage_url, duration, stream_url, "
+                "stream_expires, created, last_access) VALUES (?,?,?,?,?,?,?,?) "
+                "ON CONFLICT(video_id) DO UPDATE SET title=excluded.title, "
+                "webpage_url=excluded.webpage_url, duration=excluded.duration, "
+                "stream_url=COALESCE(excluded.stream_url, videos.stream_url), "
+                "stream_expires=COALESCE(excluded.stream_expires, videos.stream_expires), "
+                "created=excluded.created, last_access=excluded.last_access",
+                (video_id, title, webpage_url, duration, stream_url, expires, now, now),
+            )
+            keys = {normalize_query(webpage_url)}
+            if query:
+                keys.add(normalize_query(query))
+            self._db.executemany(
+                "INSERT OR REPLACE INTO queries(key, video_id) VALUES (?, ?)",
+                [(k, video_id) for k in keys],
+            )
+            self._evict_locked()
+
+    def store_loudness(self, video_id: str, loudness: float) -> None:
+        """解析した integrated loudness を保存する (メタデータと同じ寿命)"""
+        with self._lock:
+            self._db.execute("UPDATE videos SET loudness=? WHERE video_id=?", (loudness, video_id))
+
+    def _evict_locked(self) -> None:
+        (count,) = self._db.execute("SELECT COUNT(*) FROM videos").fetchone()
+        over = count - self.max_entries
+        if over <= 0:
+            return
+        self._db.execute(
+            "DELETE FROM videos WHERE video_id IN "
+            "(SELECT video_id FROM videos ORDER BY last_access LIMIT ?)", (over,)
+        )
+        self._db.execute(
+            "DELETE FROM queries WHERE video_id NOT IN (SELECT video_id FROM videos)"
+        )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import sys
+import threading
+from array import array
+from typing import Any, Callable, Protocol
+
+
+class Deck(Protocol):
+    """TrackMixer に載せる 1 曲分の音源 (BufferedAudio など)"""
+
+    def read(self) -> bytes: ...
+    def is_opus(self) -> bool: ...
+    def cleanup(self) -> None: ...
+    def remaining(self) -> int | None: ...
+
+
+EventFunc = Callable[[str, Any], None]
+
+
+def mix_pcm(a: bytes, b: bytes, ga: float, gb: float) -> bytes:
+    """16bit PCM (リトルエンディアン) 2 本を gain を掛けて足し合わせる"""
+    x, y = array("h", a), array("h", b)
+    if sys.byteorder == "big":
+        x.byteswap()
+        y.byteswap()
+    if len(x) < len(y):
+        x.extend([0] * (len(y) - len(x)))
+    elif len(y) < len(x):
+        y.extend([0] * (len(x) - len(y)))
+    out = array("h", [max(-32768, min(32767, int(p * ga + q * gb))) for p, q in zip(x, y)])
+    if sys.byteorder == "big":
+        out.byteswap()
+    return out.tobytes()
+
+
+class TrackMixer:
+    """曲間を途切れさせずにつなぐ AudioSource 相当のソース
+
+    再生中の deck が終わると、``queue_next`` で先に開いておいた次の deck へ
+    フレーム単位で切り替える。PCM で ``fade_frames`` > 0 なら、終わりの
+    ``fade_frames`` フレームを重ねてクロスフェードする。
+
+    出力が Opus か PCM かは最初の deck で決まり、途中で変えない (discord.py は
+    ``play()`` の時点の ``is_opus()`` でエンコーダを用意するため)。
+    ``queue_next`` には同じ種類の deck しか渡せない。
+
+    ``on_event(kind, tag)`` は読み出しスレッドから呼ばれる:
+
+    - ``"draining"``: 再生中の deck が終端まで読み込み済みになった (次を用意する合図)
+    - ``"switched"``: 次の deck に切り替わった (tag は queue_next で渡した値)
+    """
+
+    def __init__(self, deck: Deck, *, tag: Any = None, fade_frames: int = 0,
+                 on_event: EventFunc | None = None):
+        self.current = deck
+        self.current_tag = tag
+        self._opus = deck.is_opus()
+        self.fade_frames = fade_frames
+        self._on_event = on_event
+        self._next: Deck | None = None
+        self._next_tag: Any = None
+        self._draining = False
+        self._lock = threading.Lock()
+
+    # ---- 制御 (イベントループ側) ----
+    @property
+    def next_tag(self) -> Any:
+        return self._next_tag if self._next is not None else None
+
+    @property
+    def has_next(self) -> bool:
+        return self._next is not None
+
+    def queue_next(self, deck: Deck, tag: Any = None) -> None:
+        """次に流す deck を登録する (既にあれば置き換える)"""
+        if deck.is_opus() != self._opus:
+            raise ValueError("deck output type differs from the mixer (Opus / PCM)")
+        with self._lock:
+            old, self._next, self._next_tag = self._next, deck, tag
+        if old is not None:
+            old.cleanup()
+
+    def clear_next(self) -> bool:
+        """登録済みの次の deck を破棄する (無ければ False)"""
+        with self._lock:
+            old, self._next, self._next_tag = self._next, None, None
+        if old is None:
+            return False
+        old.cleanup()
+        return True
+
+    def skip(self) -> bool:
+        """次の deck が用意できていれば今すぐ切り替える"""
+        with self._lock:
+            if self._next is None:
+                return False
+            old = self._switch_locked()
+        old.cleanup()
+        self._emit("switched", self.current_tag)
+        return True
+
+    # ---- AudioSource ----
+    def is_opus(self) -> bool:
+        return self._opus
+
+    def read(self) -> bytes:
+        events: list[tuple[str, Any]] = []
+        old = None
+        with self._lock:
+            cur, nxt = self.current, self._next
+            left = cur.remaining()
+            if not self._draining and left is not None:
+                self._draining = True
+                events.append(("draining", self.current_tag))
+            if (nxt is not None and self._can_fade()
+                    and left is not None and 0 < left <= self.fade_frames):
+                a, b = cur.read(), nxt.read()
+                g = (left - 1) / self.fade_frames  # 出ていく曲の音量 (1 → 0)
+                data = mix_pcm(a, b, g, 1.0 - g) if a and b else (a or b)
+                if left == 1 or not a:
+                    old = self._switch_locked()
+                    events.append(("switched", self.current_tag))
+            else:
+                data = cur.read()
+                if not data and nxt is not None:
+                    old = self._switch_locked()
+                    events.append(("switched", self.current_tag))
+                    data = self.current.read()
+        if old is not None:
+            old.cleanup()
+        for kind, tag in events:
+            self._emit(kind, tag)
+        return data
+
+    def cleanup(self) -> None:
+        with self._lock:
+            decks = [d for d in (self.current, self._next) if d is not None]
+            self._next = None
+            self._next_tag = None
+        for d in decks:
+            d.cleanup()
+
+    # ---- 内部 ----
+    def _can_fade(self) -> bool:
+        return self.fade_frames > 0 and not self._opus
+
+    def _switch_locked(self) -> Deck:
+        old = self.current
+        self.current, self.current_tag = self._next, self._next_tag
+        self._next = self._next_tag = None
+        self._draining = False
+        return old
+
+    def _emit(self, kind: str, tag: Any) -> None:
+        if self._on_event is not None:
+            self._on_event(kind, tag)
@@ -0,0 +1,271 @@
+from __future__ import annotations
+
+import itertools
+import random
+from typing import Generic, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+
+
+class _Node(Generic[T]):
+    __slots__ = ("item", "eid", "prio", "size", "left", "right", "parent")
+
+    def __init__(self, item: T, eid: int):
+        self.item = item
+        self.eid = eid
+        self.prio = random.random()
+        self.size = 1
+        self.left: _Node[T] | None = None
+        self.right: _Node[T] | None = None
+        self.parent: _Node[T] | None = None
+
+
+def _size(node: _Node | None) -> int:
+    return node.size if node else 0
+
+
+def _update(node: _Node) -> None:
+    node.size = 1 + _size(node.left) + _size(node.right)
+    if node.left:
+        node.left.parent = node
+    if node.right:
+        node.right.parent = node
+
+
+def _split(node: _Node | None, k: int) -> tuple[_Node | None, _Node | None]:
+    """先頭 k 件とそれ以降に分ける"""
+    if node is None:
+        return None, None
+    if _size(node.left) >= k:
+        left, node.left = _split(node.left, k)
+        _update(node)
+        if left:
+            left.parent = None
+        return left, node
+    node.right, right = _split(node.right, k - _size(node.left) - 1)
+    _update(node)
+    if right:
+        right.parent = None
+    return node, right
+
+
+def _merge(a: _Node | None, b: _Node | None) -> _Node | None:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.prio > b.prio:
+        a.right = _merge(a.right, b)
+        _update(a)
+        return a
+    b.left = _merge(a, b.left)
+    _update(b)
+    return b
+
+
+class TrackQueue(Generic[T]):
+    """添字アクセス/削除/移動が O(log n) の再生キュー
+
+    暗黙キーの treap で実装している。各エントリには追加時に一意な ``eid`` が
+    振られ、表示後に他の操作でキューがずれても ``remove_id`` で狙った曲だけを
+    消せる。変更のたびに ``version`` が増える。
+    """
+
+    def __init__(self, items: Iterable[T] = ()):
+        self._root: _Node[T] | None = None
+        self._nodes: dict[int, _Node[T]] = {}
+        self._ids = itertools.count(1)
+        self.version = 0
+        self.extend(items)
+
+    # ---- 参照 ----
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __bool__(self) -> bool:
+        return self._root is not None
+
+    def __iter__(self) -> Iterator[T]:
+        for node in self._iter_nodes(0):
+            yield node.item
+
+    def __contains__(self, item: object) -> bool:
+        return any(node.item is item for node in self._nodes.values())
+
+    def __getitem__(self, index: int) -> T:
+        return self._node_at(index).item
+
+    def _norm(self, index: int) -> int:
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError("queue index out of range")
+        return index
+
+    def _node_at(self, index: int) -> _Node[T]:
+        k = self._norm(index)
+        node = self._root
+        while node:
+            ls = _size(node.left)
+            if k < ls:
+                node = node.left
+            elif k == ls:
+                return node
+            else:
+                k -= ls + 1
+                node = node.right
+        raise IndexError("queue index out of range")
+
+    def _iter_nodes(self, start: int) -> Iterator[_Node[T]]:
+        stack: list[_Node[T]] = []
+        node, k = self._root, start
+        while node:
+            ls = _size(node.left)
+            if k < ls:
+                stack.append(node)
+                node = node.left
+            elif k == ls:
+                stack.append(node)
+                node = None
+            else:
+                k -= ls + 1
+                node = node.right
+        while stack:
+            node = stack.pop()
+            yield node
+            child = node.right
+            while child:
+                stack.append(child)
+                child = child.left
+
+    def items(self, start: int = 0, stop: int | None = None) -> list[T]:
+        """start 番目から stop 番目の手前までを返す (O(log n + k))"""
+        count = None if stop is None else max(0, stop - start)
+        return [n.item for n in itertools.islice(self._iter_nodes(max(0, start)), count)]
+
+    def id_at(self, index: int) -> int:
+        return self._node_at(index).eid
+
+    def ids(self, start: int = 0, stop: int | None = None) -> list[int]:
+        count = None if stop is None else max(0, stop - start)
+        return [n.eid for n in itertools.islice(self._iter_nodes(max(0, start)), count)]
+
+    def get(self, eid: int) -> T | None:
+        node = self._nodes.get(eid)
+        return node.item if node else None
+
+    def index_of(self, eid: int) -> int | None:
+        """エントリ ID の現在位置 (無ければ None)"""
+        node = self._nodes.get(eid)
+        if node is None:
+            return None
+        i = _size(node.left)
+        while node.parent:
+            if node is node.parent.right:
+                i += _size(node.parent.left) + 1
+            node = node.parent
+        return i
+
+    # ---- 変更 ----
+    def _set_root(self, root: _Node[T] | None) -> None:
+        if root:
+            root.parent = None
+        self._root = root
+        self.version += 1
+
+    def _build(self, items: Iterable[T]) -> tuple[_Node[T] | None, list[int]]:
+        root, ids = None, []
+        for item in items:
+            node = _Node(item, next(self._ids))
+            self._nodes[node.eid] = node
+            ids.append(node.eid)
+            root = _merge(root, node)
+        return root, ids
+
+    def append(self, item: T) -> int:
+        return self.extend((item,))[0]
+
+    def appendleft(self, item: T) -> int:
+        return self.insert(0, item)
+
+    def extend(self, items: Iterable[T]) -> list[int]:
+        sub, ids = self._build(items)
+        if ids:
+            self._set_root(_merge(self._root, sub))
+        return ids
+
+    def insert(self, index: int, item: T) -> int:
+        index = max(0, min(index, len(self)))
+        sub, ids = self._build((item,))
+        left, right = _split(self._root, index)
+        self._set_root(_merge(_merge(left, sub), right))
+        return ids[0]
+
+    def delete_range(self, start: int, stop: int) -> list[T]:
+        """[start, stop) を一括削除して取り除いた要素を返す"""
+        n = len(self)
+        start, stop = max(0, start), min(stop, n)
+        if start >= stop:
+            return []
+        left, rest = _split(self._root, start)
+        mid, right = _split(rest, stop - start)
+        removed = self._collect(mid)
+        for node in removed:
+            del self._nodes[node.eid]
+        self._set_root(_merge(left, right))
+        return [node.item for node in removed]
+
+    @staticmethod
+    def _collect(root: _Node[T] | None) -> list[_Node[T]]:
+        """部分木のノードを先頭から順に返す"""
+        out, stack, node = [], [], root
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+            node = stack.pop()
+            out.append(node)
+            node = node.right
+        return out
+
+    def pop(self, index: int = -1) -> T:
+        index = self._norm(index)
+        return self.delete_range(index, index + 1)[0]
+
+    def popleft(self) -> T:
+        return self.pop(0)
+
+    def remove_id(self, eid: int) -> T | None:
+        """エントリ ID で削除 (既に無ければ None)"""
+        index = self.index_of(eid)
+        if index is None:
+            return None
+        return self.pop(index)
+
+    def move(self, src: int, dst: int) -> None:
+        """src 番目の要素を dst 番目へ移動"""
+        src = self._norm(src)
+        left, rest = _split(self._root, src)
+        node, right = _split(rest, 1)
+        root = _merge(left, right)
+        dst = max(0, min(dst, _size(root)))
+        left, right = _split(root, dst)
+        self._set_root(_merge(_merge(left, node), right))
+
+    def shuffle(self, rng: random.Random | None = None) -> None:
+        """エントリ ID を保ったまま並びをシャッフル (O(n))"""
+        nodes = list(self._iter_nodes(0))
+        (rng or random).shuffle(nodes)
+        root = None
+        for node in nodes:
+            node.left = node.right = node.parent = None
+            node.size = 1
+            root = _merge(root, node)
+        self._set_root(root)
+
+    def clear(self) -> list[T]:
+        removed = [node.item for node in self._collect(self._root)]
+        self._nodes.clear()
+        self._set_root(None)
+        return removed
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import hashlib
+from typing import Awaitable, Callable
+
+Target = tuple[str, str]   # (言語名, 地域のヒント = 国旗など)
+
+# 本文と翻訳先の一覧を受け取り、{翻訳先: 訳文} を返す (まとめて 1 回の API 呼び出し)
+TranslateFunc = Callable[[str, list[Target]], Awaitable[dict[Target, str]]]
+
+
+def content_key(text: str) -> str:
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def combine_translations(sections: list[tuple[str, str]], limit: int = 2000) -> str:
+    """(見出し, 訳文) を 1 通にまとめる
+
+    limit を超えるときは長い訳文から削って、どの言語も少しずつ載るようにする。
+    見出しだけで収まらないほど多いときは、後から来た言語を載せない。
+    """
+    sep = "\n\n"
+
+    def fixed(n: int) -> int:
+        return sum(len(head) + 1 for head, _ in sections[:n]) + len(sep) * max(n - 1, 0)
+
+    n = len(sections)
+    while n and fixed(n) > limit:
+        n -= 1
+    sections = sections[:n]
+    budget = limit - fixed(n)
+    bodies = [body for _, body in sections]
+    if sum(map(len, bodies)) > budget:
+        # 短い訳文から順に枠を割り当て、余りを長い訳文に回す
+        allowed = [0] * len(bodies)
+        order = sorted(range(len(bodies)), key=lambda i: len(bodies[i]))
+        for k, i in enumerate(order):
+            allowed[i] = min(len(bodies[i]), budget // (len(order) - k))
+            budget -= allowed[i]
+        bodies = [
+            body if len(body) <= cap else (body[:cap - 3] + "..." if cap >= 3 else "..."[:cap])
+            for body, cap in zip(bodies, allowed)
+        ]
+    return sep.join(f"{head}\n{body}" for (head, _), body in zip(sections, bodies))
+
+
+class _Batch:
+    def __init__(self, text: str):
+        self.text = text
+        self.futures: dict[Target, asyncio.Future[str]] = {}
+
+
+class Translator:
+    """国旗リアクション用の翻訳サービス
+
+    - 同じメッセージへの翻訳依頼を ``window`` 秒だけ溜め、翻訳先をまとめて
+      1 回の API 呼び出しで訳す
+    - 結果を (メッセージ ID, 本文のハッシュ, 言語, 地域) ごとに ``max_entries`` 件まで
+      LRU で覚える (本文が編集されればハッシュが変わるので訳し直す)
+    - 同じキーの翻訳が実行中ならもう一度は頼まずにその結果を待つ
+    - 失敗した結果は覚えない (次のリアクションでやり直す)
+    """
+
+    def __init__(self, translate: TranslateFunc, *, window: float = 1.5, max_entries: int = 1024):
+        self.window = window
+        self.max_entries = max_entries
+        self._translate = translate
+        self._cache: collections.OrderedDict[tuple, str] = collections.OrderedDict()
+        self._inflight: dict[tuple, asyncio.Future[str]] = {}
+        self._batches: dict[tuple[int, str], _Batch] = {}
+        self._tasks: set[asyncio.Task] = set()
+        self.stats = {"requests": 0, "targets": 0, "hits": 0, "joined": 0, "errors": 0}
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    async def translate(self, message_id: int, text: str, lang: str, region: str = "") -> str:
+        base = (message_id, content_key(text))
+        key = base + (lang, region)
+        hit = self._cache.get(key)
+        if hit is not None:
+            self._cache.move_to_end(key)
+            self.stats["hits"] += 1
+            return hit
+
+        fut = self._inflight.get(key)
+        if fut is not None:
+            self.stats["joined"] += 1
+        else:
+            batch = self._batches.get(base)
+            if batch is None:
+                batch = self._batches[base] = _Batch(text)
+                task = asyncio.get_running_loop().create_task(self._run(base, batch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            fut = batch.futures[(lang, region)] = asyncio.get_running_loop().create_future()
+            self._inflight[key] = fut
+        # 待っている人がキャンセルされても、同じ翻訳を待つ他の人には影響させない
+        return await asyncio.shield(fut)
+
+    async def _run(self, base: tuple[int, str], batch: _Batch) -> None:
+        error: Exception | None = None
+        results: dict[Target, str] = {}
+        try:
+            await asyncio.sleep(self.window)
+            # ここから先に来た依頼は次のバッチに入る
+            self._batches.pop(base, None)
+            targets = list(batch.futures)
+            self.stats["requests"] += 1
+            self.stats["targets"] += len(targets)
+            results = await self._translate(batch.text, targets)
+        except asyncio.CancelledError:
+            self._batches.pop(base, None)
+            for fut in batch.futures.values():
+                fut.cancel()
+            raise
+        except Exception as e:
+            self.stats["errors"] += 1
+            error = e
+        finally:
+            for target in batch.futures:
+                self._inflight.pop(base + target, None)
+
+        for target, fut in batch.futures.items():
+            text = results.get(target)
+            if text is not None:
+                self._store(base + target, text)
+                fut.set_result(text)
+            else:
+                fut.set_exception(error or KeyError(f"no translation for {target[0]}"))
+                fut.exception()  # 待っている人がいなくても警告を出さない
+
+    def _store(self, key: tuple, text: str) -> None:
+        self._cache[key] = text
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
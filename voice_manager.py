@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import asyncio
+import collections
+import logging
+import random
+import time
+import weakref
+from typing import Awaitable, Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+IDLE = "idle"
+CONNECTING = "connecting"
+CONNECTED = "connected"
+RECONNECTING = "reconnecting"
+
+
+class VoiceManager:
+    """ギルドごとの VC 接続をまとめて管理する
+
+    - 接続はギルド単位のロックで直列化する (別ギルドの接続は待たない)
+    - 接続状態 (``IDLE`` / ``CONNECTING`` / ``CONNECTED`` / ``RECONNECTING``) を記録
+    - 再接続の待ち時間はギルドごとの指数バックオフ (``backoff_cap`` 秒で頭打ち)
+    - close code 4022 などで接続を控えるギルドは ``suppress_ttl`` 秒後に自動で解除
+    - 接続にかかった時間と再接続回数を ``stats()`` で返す
+    """
+
+    def __init__(self, *, suppress_ttl: float = 60.0, backoff_base: float = 1.0,
+                 backoff_cap: float = 60.0, latency_samples: int = 256,
+                 clock: Callable[[], float] = time.monotonic):
+        self.suppress_ttl = suppress_ttl
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self._clock = clock
+        self._locks: weakref.WeakValueDictionary[int, asyncio.Lock] = weakref.WeakValueDictionary()
+        self._states: dict[int, str] = {}
+        self._attempts: dict[int, int] = {}                 # guild -> 連続失敗回数
+        self._suppressed: dict[int, float] = {}              # guild -> 解除時刻
+        self._latencies: collections.deque[float] = collections.deque(maxlen=latency_samples)
+        self.connects = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.reconnects = 0
+
+    # ---- 接続 ----
+    def lock(self, guild_id: int) -> asyncio.Lock:
+        """ギルド専用のロック (誰も使っていなければ自動で破棄される)"""
+        lock = self._locks.get(guild_id)
+        if lock is None:
+            lock = self._locks[guild_id] = asyncio.Lock()
+        return lock
+
+    async def connect(self, guild_id: int, factory: Callable[[], Awaitable[T]], *,
+                      timeout: float, current: Callable[[], T | None] | None = None) -> T:
+        """``factory()`` で接続して結果を返す
+
+        ロックを取った後に ``current()`` が接続を返せば (先に別の呼び出しが
+        接続し終えていれば) それをそのまま使う。タイムアウト時は
+        ``asyncio.TimeoutError`` を送出する。
+        """
+        async with self.lock(guild_id):
+            if current is not None and (existing := current()) is not None:
+                return existing
+            self._states[guild_id] = CONNECTING
+            started = self._clock()
+            try:
+                result = await asyncio.wait_for(factory(), timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                self._failed(guild_id)
+                raise
+            except BaseException:
+                self.failures += 1
+                self._failed(guild_id)
+                raise
+            elapsed = self._clock() - started
+            self._latencies.append(elapsed)
+            self.connects += 1
+            self.connected(guild_id)
+            logger.info("voice connected: guild %s in %.2fs", guild_id, elapsed)
+            return result
+
+    def connected(self, guild_id: int) -> None:
+        """接続 (再接続) に成功した"""
+        self._states[guild_id] = CONNECTED
+        self._attempts.pop(guild_id, None)
+
+    def disconnected(self, guild_id: int) -> None:
+        """切断したのでギルドの状態を忘れる"""
+        self._states.pop(guild_id, None)
+        self._attempts.pop(guild_id, None)
+
+    def reconnecting(self, guild_id: int) -> float:
+        """再接続を始める。待つべき秒数 (バックオフ) を返す"""
+        self.reconnects += 1
+        self._states[guild_id] = RECONNECTING
+        return self.backoff(guild_id)
+
+    def backoff(self, guild_id: int) -> float:
+        """次の試行までの待ち時間 (失敗するたびに倍、上限 backoff_cap、ゆらぎ付き)"""
+        n = self._attempts.get(guild_id, 0)
+        self._attempts[guild_id] = n + 1
+        delay = min(self.backoff_cap, self.backoff_base * 2 ** min(n, 30))
+        return delay * random.uniform(0.5, 1.0)
+
+    def state(self, guild_id: int) -> str:
+        return self._states.get(guild_id, IDLE)
+
+    def _failed(self, guild_id: int) -> None:
+        self._states.pop(guild_id, None)
+        self._attempts[guild_id] = self._attempts.get(guild_id, 0) + 1
+
+    # ---- 接続の抑制 ----
+    def suppress(self, guild_id: int, ttl: float | None = None) -> None:
+        """ttl 秒 (既定 suppress_ttl) の間そのギルドへの接続を控える"""
+        self._prune()
+        self._suppressed[guild_id] = self._clock() + (self.suppress_ttl if ttl is None else ttl)
+
+    def suppressed(self, guild_id: int) -> float:
+        """接続を控えている残り秒数 (控えていなければ 0)"""
+        self._prune()
+        until = self._suppressed.get(guild_id)
+        return max(0.0, until - self._clock()) if until is not None else 0.0
+
+    def _prune(self) -> None:
+        now = self._clock()
+        for gid, until in list(self._suppressed.items()):
+            if until <= now:
+                del self._suppressed[gid]
+
+    # ---- 計測 ----
+    def stats(self) -> dict[str, float]:
+        """接続回数・失敗・再接続回数と、最近の接続時間 (秒) の中央値・p95・最大"""
+        lat = sorted(self._latencies)
+
+        def pct(p: float) -> float:
+            return lat[min(len(lat) - 1, int(len(lat) * p))] if lat else 0.0
+
+        return {
+            "connects": self.connects,
+            "failures": self.failures,
+            "timeouts": self.timeouts,
+            "reconnects": self.reconnects,
+            "connected": sum(1 for s in self._states.values() if s == CONNECTED),
+            "suppressed": len(self._suppressed),
+            "latency_p50": pct(0.5),
+            "latency_p95": pct(0.95),
+            "latency_max": lat[-1] if lat else 0.0,
+        }